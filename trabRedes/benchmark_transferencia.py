@@ -0,0 +1,144 @@
+"""Benchmark de vazão do enviar-arquivo em uma cadeia de roteadores reais.
+
+Sobe saltos + 1 processos roteador.py em endereços de loopback
+(127.0.1.1 - 127.0.1.2 - ...), cada um na sua pasta com o próprio
+roteadores.txt e registro em JSON, espera o primeiro aprender a rota para o
+último, envia um arquivo aleatório entre eles e confere o arquivo recebido.
+Mede tempo, vazão, retransmissões e o RTO final. Requer que 127.0.1.0/24
+responda no loopback (padrão no Linux).
+
+Uso:
+    python benchmark_transferencia.py --saltos 3 --tamanho 8
+    python benchmark_transferencia.py --saltos 5 --janela 256 --asyncio
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from transferencia import JANELA_PADRAO, MAXIMO_JANELA_TRANSFERENCIA, TAMANHO_DADOS_SEGMENTO
+
+
+def _ler_eventos(processo: subprocess.Popen, eventos: queue.Queue):
+    for linha in processo.stdout:
+        try:
+            eventos.put(json.loads(linha))
+        except ValueError:
+            continue
+
+
+def _esperar(eventos: queue.Queue, condicao, tempo_limite: float) -> Dict:
+    prazo = time.monotonic() + tempo_limite
+    while True:
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            raise TimeoutError
+        try:
+            evento = eventos.get(timeout=restante)
+        except queue.Empty:
+            raise TimeoutError
+        if condicao(evento):
+            return evento
+
+
+def executar(saltos: int, tamanho: int, janela: int, opcoes: List[str], tempo_limite: float) -> Dict:
+    ips = [f"127.0.1.{i + 1}" for i in range(saltos + 1)]
+    raiz = tempfile.mkdtemp(prefix='transferencia-')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'roteador.py')
+    processos: List[subprocess.Popen] = []
+    try:
+        for i, ip in enumerate(ips):
+            pasta = os.path.join(raiz, ip)
+            os.mkdir(pasta)
+            vizinhos = [ips[j] for j in (i - 1, i + 1) if 0 <= j < len(ips)]
+            with open(os.path.join(pasta, 'roteadores.txt'), 'w') as f:
+                f.write("KEEPALIVE=1\nTEMPO_LIMITE=5\nLOG_FORMATO=json\nLOG_TABELAS=nao\n"
+                        f"JANELA_TRANSFERENCIA={janela}\n" + "\n".join(vizinhos) + "\n")
+            processos.append(subprocess.Popen([sys.executable, script, ip] + opcoes, cwd=pasta,
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                              stderr=subprocess.DEVNULL, text=True, bufsize=1))
+        eventos_origem: queue.Queue = queue.Queue()
+        eventos_destino: queue.Queue = queue.Queue()
+        threading.Thread(target=_ler_eventos, args=(processos[0], eventos_origem), daemon=True).start()
+        threading.Thread(target=_ler_eventos, args=(processos[-1], eventos_destino), daemon=True).start()
+        for processo in processos[1:-1]:
+            threading.Thread(target=_ler_eventos, args=(processo, queue.Queue()), daemon=True).start()
+
+        destino = ips[-1]
+        _esperar(eventos_origem, lambda e: e.get('evento') in ('NOVA ROTA', 'ROTA MELHORADA')
+                 and e.get('destino') == destino, tempo_limite)
+
+        arquivo = os.path.join(raiz, 'dados.bin')
+        conteudo = os.urandom(tamanho)
+        with open(arquivo, 'wb') as f:
+            f.write(conteudo)
+        processos[0].stdin.write(f"enviar-arquivo {destino} {arquivo}\n")
+        processos[0].stdin.flush()
+
+        resultado = _esperar(eventos_origem, lambda e: e.get('evento') in ('TRANSFERÊNCIA CONCLUÍDA',
+                                                                           'TRANSFERÊNCIA FALHOU', 'ERRO'),
+                             tempo_limite)
+        if resultado['evento'] != 'TRANSFERÊNCIA CONCLUÍDA':
+            raise RuntimeError(resultado.get('mensagem'))
+        recebido = _esperar(eventos_destino, lambda e: e.get('evento') == 'ARQUIVO RECEBIDO', tempo_limite)
+        with open(os.path.join(raiz, destino, recebido['caminho']), 'rb') as f:
+            resultado['integro'] = f.read() == conteudo
+        return resultado
+    finally:
+        for processo in processos:
+            try:
+                processo.stdin.write("sair\n")
+                processo.stdin.flush()
+            except OSError:
+                pass
+        for processo in processos:
+            try:
+                processo.wait(5)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        shutil.rmtree(raiz, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de vazão da transferência de arquivos")
+    parser.add_argument('--saltos', type=int, default=3)
+    parser.add_argument('--tamanho', type=float, default=4.0, help="tamanho do arquivo em MB")
+    parser.add_argument('--janela', type=int, default=JANELA_PADRAO,
+                        help=f"segmentos em trânsito (1 a {MAXIMO_JANELA_TRANSFERENCIA})")
+    parser.add_argument('--asyncio', action='store_true', help="roteadores com --asyncio")
+    parser.add_argument('--tempo-limite', type=float, default=120.0)
+    args = parser.parse_args()
+    if args.saltos < 1 or not 1 <= args.janela <= MAXIMO_JANELA_TRANSFERENCIA:
+        parser.error("saltos deve ser ao menos 1 e a janela estar entre 1 e "
+                     f"{MAXIMO_JANELA_TRANSFERENCIA}")
+
+    tamanho = int(args.tamanho * 1e6)
+    print(f"{args.saltos} saltos, {tamanho} bytes, janela de {args.janela} segmentos"
+          f"{' (asyncio)' if args.asyncio else ''}")
+    try:
+        resultado = executar(args.saltos, tamanho, args.janela, ['--asyncio'] if args.asyncio else [],
+                             args.tempo_limite)
+    except TimeoutError:
+        sys.exit("Tempo limite esgotado")
+    except RuntimeError as e:
+        sys.exit(f"Transferência falhou: {e}")
+    print(f"Tempo: {resultado['segundos']:.3f}s")
+    print(f"Vazão: {resultado['vazao']:.2f} MB/s")
+    # O segmento 0 leva o nome do arquivo
+    segmentos = 1 + -(-tamanho // TAMANHO_DADOS_SEGMENTO)
+    print(f"Segmentos: {segmentos}, retransmissões: {resultado['retransmissoes']}")
+    print(f"RTO final: {resultado['rto'] * 1000:.1f} ms")
+    print(f"Arquivo recebido {'íntegro' if resultado['integro'] else 'DIFERENTE do enviado'}")
+    if not resultado['integro']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Banco de estado de enlace (LSAs) e cálculo incremental do menor caminho.
+
+Cada roteador anuncia um LSA com os vizinhos ativos e as redes locais,
+numerado por uma sequência crescente. Um enlace só entra no grafo se os
+dois lados o anunciam, então o LSA antigo de um roteador que caiu não cria
+caminhos. O grafo fica em cache e, a cada LSA novo, só os enlaces do
+roteador que o originou são comparados; a árvore de menor caminho é
+corrigida a partir dessas alterações em vez de recalculada inteira.
+
+Formato do LSA (texto, como as demais mensagens do protocolo):
+    $<origem>;<sequência>*<vizinho>;<custo>...+<rede>;<custo>...
+"""
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+
+PREFIXO_LSA = b'$'
+# Pedido de todos os LSAs conhecidos (enviado ao entrar na rede)
+PEDIDO_SINCRONIZACAO = b'$?'
+
+# (nó de origem, nó de destino, custo antigo, custo novo); None = sem enlace
+AlteracaoEnlace = Tuple[str, str, Optional[int], Optional[int]]
+
+
+class Lsa:
+    __slots__ = ('origem', 'sequencia', 'vizinhos', 'prefixos', 'dados', 'instante')
+
+    def __init__(self, origem: str, sequencia: int, vizinhos: Dict[str, int], prefixos: Dict[str, int],
+                 dados: bytes, instante: float):
+        self.origem = origem
+        self.sequencia = sequencia
+        self.vizinhos = vizinhos
+        self.prefixos = prefixos
+        # Mensagem original, reenviada sem recodificar na inundação
+        self.dados = dados
+        self.instante = instante
+
+
+def codificar_lsa(origem: str, sequencia: int, vizinhos: Dict[str, int], prefixos: Dict[str, int]) -> bytes:
+    partes = [f"${origem};{sequencia}"]
+    partes.extend(f"*{vizinho};{custo}" for vizinho, custo in sorted(vizinhos.items()))
+    partes.extend(f"+{prefixo};{custo}" for prefixo, custo in sorted(prefixos.items()))
+    return "".join(partes).encode('utf-8')
+
+
+def decodificar_lsa(dados: bytes) -> Tuple[str, int, Dict[str, int], Dict[str, int]]:
+    """Retorna (origem, sequência, vizinhos, prefixos); ValueError se inválido."""
+    texto = dados.decode('utf-8')
+    if not texto.startswith('$'):
+        raise ValueError("Não é um LSA")
+    fim_cabecalho = min((i for i in (texto.find('*'), texto.find('+')) if i >= 0), default=len(texto))
+    origem, sequencia = texto[1:fim_cabecalho].split(';')
+    vizinhos: Dict[str, int] = {}
+    prefixos: Dict[str, int] = {}
+    destino = vizinhos
+    inicio = fim_cabecalho
+    while inicio < len(texto):
+        destino = vizinhos if texto[inicio] == '*' else prefixos
+        proximo = min((i for i in (texto.find('*', inicio + 1), texto.find('+', inicio + 1)) if i >= 0),
+                      default=len(texto))
+        ip, custo = texto[inicio + 1:proximo].split(';')
+        if int(custo) < 0:
+            raise ValueError(f"Custo negativo: {custo}")
+        destino[ip] = int(custo)
+        inicio = proximo
+    return origem, int(sequencia), vizinhos, prefixos
+
+
+class BancoEstadoEnlace:
+    """LSAs conhecidos, grafo de enlaces bidirecionais e árvore de menor
+    caminho a partir de raiz (este roteador)."""
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        self.lsas: Dict[str, Lsa] = {}
+        # nó -> {vizinho: custo}, só com enlaces anunciados pelos dois lados
+        self.grafo: Dict[str, Dict[str, int]] = {}
+        self.distancia: Dict[str, int] = {raiz: 0}
+        self.pai: Dict[str, str] = {}
+        # Enlaces alterados desde o último cálculo
+        self.alteracoes: List[AlteracaoEnlace] = []
+        # Só prefixos mudaram: a árvore continua válida
+        self.prefixos_alterados = False
+
+    def instalar(self, lsa: Lsa) -> bool:
+        """Guarda o LSA se for mais novo que o conhecido; retorna se guardou."""
+        atual = self.lsas.get(lsa.origem)
+        if atual is not None and atual.sequencia >= lsa.sequencia:
+            return False
+        self.lsas[lsa.origem] = lsa
+        if atual is None or atual.prefixos != lsa.prefixos:
+            self.prefixos_alterados = True
+        self._atualizar_enlaces(lsa.origem, atual.vizinhos if atual is not None else {})
+        return True
+
+    def remover(self, origem: str):
+        lsa = self.lsas.pop(origem, None)
+        if lsa is not None:
+            self.prefixos_alterados = True
+            self._atualizar_enlaces(origem, lsa.vizinhos)
+
+    def expirar(self, limite: float) -> List[str]:
+        """Remove os LSAs (de outros roteadores) não renovados desde limite."""
+        expirados = [origem for origem, lsa in self.lsas.items() if lsa.instante < limite and origem != self.raiz]
+        for origem in expirados:
+            self.remover(origem)
+        return expirados
+
+    def _enlace(self, de: str, para: str) -> Optional[int]:
+        """Custo de de -> para se os dois LSAs anunciam o enlace."""
+        lsa_de = self.lsas.get(de)
+        lsa_para = self.lsas.get(para)
+        if lsa_de is None or lsa_para is None or de not in lsa_para.vizinhos:
+            return None
+        return lsa_de.vizinhos.get(para)
+
+    def _atualizar_enlaces(self, origem: str, vizinhos_antigos: Dict[str, int]):
+        lsa = self.lsas.get(origem)
+        envolvidos = set(vizinhos_antigos) | (set(lsa.vizinhos) if lsa is not None else set())
+        for vizinho in envolvidos:
+            for de, para in ((origem, vizinho), (vizinho, origem)):
+                antigo = self.grafo.get(de, {}).get(para)
+                novo = self._enlace(de, para)
+                if antigo == novo:
+                    continue
+                if novo is None:
+                    del self.grafo[de][para]
+                else:
+                    self.grafo.setdefault(de, {})[para] = novo
+                self.alteracoes.append((de, para, antigo, novo))
+
+    def calcular(self) -> bool:
+        """Corrige a árvore de menor caminho com os enlaces alterados.
+        Retorna se as rotas podem ter mudado."""
+        # Vários LSAs desde o último cálculo: vale o custo de antes do
+        # primeiro e o de depois do último
+        liquidas: Dict[Tuple[str, str], List[Optional[int]]] = {}
+        for de, para, antigo, novo in self.alteracoes:
+            liquidas.setdefault((de, para), [antigo, novo])[1] = novo
+        alteracoes = [(de, para, antigo, novo) for (de, para), (antigo, novo) in liquidas.items() if antigo != novo]
+        self.alteracoes = []
+        prefixos_alterados, self.prefixos_alterados = self.prefixos_alterados, False
+        if not alteracoes:
+            return prefixos_alterados
+        distancia, pai = self.distancia, self.pai
+        heap: List[Tuple[int, str, str]] = []
+        # Enlace da árvore removido ou mais caro: a subárvore abaixo dele
+        # perde as distâncias e é recalculada a partir da fronteira
+        raizes_invalidas = {para for de, para, antigo, novo in alteracoes
+                            if pai.get(para) == de and (novo is None or novo > antigo)}
+        if raizes_invalidas:
+            filhos: Dict[str, List[str]] = {}
+            for no, pai_no in pai.items():
+                filhos.setdefault(pai_no, []).append(no)
+            invalidos: Set[str] = set()
+            pilha = list(raizes_invalidas)
+            while pilha:
+                no = pilha.pop()
+                if no not in invalidos:
+                    invalidos.add(no)
+                    pilha.extend(filhos.get(no, ()))
+            for no in invalidos:
+                distancia.pop(no, None)
+                pai.pop(no, None)
+            for no in invalidos:
+                # O grafo é simétrico quanto à existência dos enlaces
+                for anterior in self.grafo.get(no, {}):
+                    custo = self.grafo.get(anterior, {}).get(no)
+                    if anterior in distancia and custo is not None:
+                        heapq.heappush(heap, (distancia[anterior] + custo, no, anterior))
+        # Enlaces novos ou mais baratos podem encurtar caminhos
+        for de, para, antigo, novo in alteracoes:
+            if novo is not None and de in distancia and (antigo is None or novo < antigo):
+                heapq.heappush(heap, (distancia[de] + novo, para, de))
+        self._dijkstra(heap)
+        return True
+
+    def _dijkstra(self, heap: List[Tuple[int, str, str]]):
+        distancia, pai = self.distancia, self.pai
+        while heap:
+            custo, no, anterior = heapq.heappop(heap)
+            if custo >= distancia.get(no, custo + 1):
+                continue
+            distancia[no] = custo
+            pai[no] = anterior
+            for vizinho, custo_enlace in self.grafo.get(no, {}).items():
+                if custo + custo_enlace < distancia.get(vizinho, custo + custo_enlace + 1):
+                    heapq.heappush(heap, (custo + custo_enlace, vizinho, no))
+
+    def recalcular(self):
+        """Dijkstra completo (referência para o cálculo incremental)."""
+        self.alteracoes = []
+        self.prefixos_alterados = False
+        self.distancia = {self.raiz: 0}
+        self.pai = {}
+        self._dijkstra([(custo, vizinho, self.raiz) for vizinho, custo in self.grafo.get(self.raiz, {}).items()])
+
+    def rotas(self) -> Dict[str, Tuple[int, str]]:
+        """destino -> (métrica, primeiro salto) para os roteadores alcançáveis,
+        as redes que eles anunciam e os vizinhos diretos que ainda não
+        enviaram LSA."""
+        primeiro_salto: Dict[str, str] = {}
+
+        def salto(no: str) -> str:
+            caminho = []
+            while no not in primeiro_salto and self.pai.get(no) != self.raiz:
+                caminho.append(no)
+                no = self.pai[no]
+            resultado = primeiro_salto.setdefault(no, no)
+            for anterior in caminho:
+                primeiro_salto[anterior] = resultado
+            return resultado
+
+        rotas: Dict[str, Tuple[int, str]] = {}
+        propria = self.lsas.get(self.raiz)
+        if propria is not None:
+            for vizinho, custo in propria.vizinhos.items():
+                if vizinho not in self.lsas:
+                    rotas[vizinho] = (custo, vizinho)
+        for no, distancia in self.distancia.items():
+            if no == self.raiz:
+                continue
+            rotas[no] = (distancia, salto(no))
+            for prefixo, custo in self.lsas[no].prefixos.items():
+                atual = rotas.get(prefixo)
+                if atual is None or distancia + custo < atual[0]:
+                    rotas[prefixo] = (distancia + custo, rotas[no][1])
+        return rotas
@@ -0,0 +1,201 @@
+"""Contadores e histogramas do roteador, exportados no formato texto do
+Prometheus.
+
+O registro é só uma consulta a dicionário e uma soma, barato o bastante
+para ficar sempre ligado. Não há lock: com várias threads, incrementos
+simultâneos da mesma série podem raramente se perder, o que é aceitável
+para estatísticas.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Limites (em segundos) das faixas dos histogramas de tempo
+LIMITES_TEMPO = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+                 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+def _formatar_rotulos(nomes: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    pares = [f'{nome}="{valor}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Contador:
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.valores: Dict[Tuple[str, ...], float] = {}
+
+    def incrementar(self, *valores_rotulos: str, quantidade: float = 1):
+        self.valores[valores_rotulos] = self.valores.get(valores_rotulos, 0) + quantidade
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for valores, total in sorted(self.valores.copy().items()):
+            linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, valores)} {total:g}")
+        return linhas
+
+
+class ContadorCalculado:
+    """Contador mantido fora deste processo (por exemplo, em memória
+    compartilhada), lido só na exportação: funcao retorna os valores por
+    combinação de rótulos."""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str],
+                 funcao: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.funcao = funcao
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for valores, total in sorted(self.funcao().items()):
+            linhas.append(f"{self.nome}{_formatar_rotulos(self.rotulos, valores)} {total:g}")
+        return linhas
+
+
+class Trafego:
+    """Mensagens e bytes da mesma série, exportados como dois contadores.
+    Uma só consulta ao dicionário por datagrama."""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.series: Dict[Tuple[str, ...], List[int]] = {}
+
+    def registrar(self, tamanho: int, *valores_rotulos: str):
+        serie = self.series.get(valores_rotulos)
+        if serie is None:
+            serie = self.series[valores_rotulos] = [0, 0]
+        serie[0] += 1
+        serie[1] += tamanho
+
+    def exportar(self) -> List[str]:
+        series = sorted(self.series.copy().items())
+        linhas = []
+        for indice, unidade in enumerate(("mensagens", "bytes")):
+            nome = f"{self.nome}_{unidade}_total"
+            linhas.append(f"# HELP {nome} {self.ajuda} ({unidade})")
+            linhas.append(f"# TYPE {nome} counter")
+            for valores, serie in series:
+                linhas.append(f"{nome}{_formatar_rotulos(self.rotulos, valores)} {serie[indice]}")
+        return linhas
+
+
+class Medidor:
+    """Valor instantâneo calculado só na exportação."""
+
+    def __init__(self, nome: str, ajuda: str, funcao: Callable[[], float]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} gauge",
+                f"{self.nome} {self.funcao():g}"]
+
+
+class Histograma:
+    """Cada série é uma lista com a contagem de cada faixa (a última é +Inf)
+    seguida da soma dos valores observados."""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = (),
+                 limites: Sequence[float] = LIMITES_TEMPO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(limites)
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observar(self, valor: float, *valores_rotulos: str):
+        serie = self.series.get(valores_rotulos)
+        if serie is None:
+            serie = self.series[valores_rotulos] = [0] * (len(self.limites) + 2)
+        serie[bisect_left(self.limites, valor)] += 1
+        serie[-1] += valor
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for valores, serie in sorted(self.series.copy().items()):
+            serie = list(serie)
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (float('inf'),), serie):
+                acumulado += contagem
+                le = "+Inf" if limite == float('inf') else f"{limite:g}"
+                rotulos = _formatar_rotulos(self.rotulos, valores, f'le="{le}"')
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            rotulos = _formatar_rotulos(self.rotulos, valores)
+            linhas.append(f"{self.nome}_sum{rotulos} {serie[-1]:g}")
+            linhas.append(f"{self.nome}_count{rotulos} {acumulado}")
+        return linhas
+
+
+class Metricas:
+    """Registro das métricas de um roteador."""
+
+    def __init__(self):
+        self.familias: List = []
+
+    def contador(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()) -> Contador:
+        contador = Contador(nome, ajuda, rotulos)
+        self.familias.append(contador)
+        return contador
+
+    def trafego(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()) -> Trafego:
+        trafego = Trafego(nome, ajuda, rotulos)
+        self.familias.append(trafego)
+        return trafego
+
+    def histograma(self, nome: str, ajuda: str, rotulos: Sequence[str] = (),
+                   limites: Sequence[float] = LIMITES_TEMPO) -> Histograma:
+        histograma = Histograma(nome, ajuda, rotulos, limites)
+        self.familias.append(histograma)
+        return histograma
+
+    def contador_calculado(self, nome: str, ajuda: str, rotulos: Sequence[str],
+                           funcao: Callable[[], Dict[Tuple[str, ...], float]]) -> ContadorCalculado:
+        contador = ContadorCalculado(nome, ajuda, rotulos, funcao)
+        self.familias.append(contador)
+        return contador
+
+    def medidor(self, nome: str, ajuda: str, funcao: Callable[[], float]) -> Medidor:
+        medidor = Medidor(nome, ajuda, funcao)
+        self.familias.append(medidor)
+        return medidor
+
+    def exportar(self) -> str:
+        linhas: List[str] = []
+        for familia in self.familias:
+            linhas.extend(familia.exportar())
+        return "\n".join(linhas) + "\n"
+
+
+class LockMedido:
+    """Envolve um lock registrando o tempo de espera para adquiri-lo e o
+    tempo em que ficou retido (uma thread por vez, então o instante de
+    aquisição pode ficar no próprio objeto)."""
+
+    def __init__(self, lock, espera: Histograma, retencao: Histograma):
+        self.lock = lock
+        self.espera = espera
+        self.retencao = retencao
+        self.adquirido = 0.0
+
+    def __enter__(self):
+        inicio = time.perf_counter()
+        self.lock.acquire()
+        self.adquirido = time.perf_counter()
+        self.espera.observar(self.adquirido - inicio)
+        return self
+
+    def __exit__(self, *_):
+        retido = time.perf_counter() - self.adquirido
+        self.retencao.observar(retido)
+        self.lock.release()
+        return False
@@ -0,0 +1,191 @@
+"""Registro de eventos do roteador com níveis, limite de repetição e
+escrita em segundo plano.
+
+As threads do protocolo só verificam o nível e o limite e enfileiram o
+evento (tipo, campos e modelo da mensagem); a formatação e a escrita no
+stdout ficam com uma thread própria, então um terminal lento não segura o
+processamento de mensagens nem o lock da tabela.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+NIVEL_DEPURACAO = 10
+NIVEL_INFO = 20
+NIVEL_AVISO = 30
+NIVEL_ERRO = 40
+NIVEIS = {'depuracao': NIVEL_DEPURACAO, 'info': NIVEL_INFO,
+          'aviso': NIVEL_AVISO, 'erro': NIVEL_ERRO}
+NOMES_NIVEIS = {valor: nome for nome, valor in NIVEIS.items()}
+
+FORMATO_REGISTRO_TEXTO = 'texto'
+FORMATO_REGISTRO_JSON = 'json'
+
+# Eventos iguais aceitos por intervalo; os excedentes só são contados
+LIMITE_PADRAO = 20
+INTERVALO_LIMITE = 1.0
+TAMANHO_FILA = 10000
+
+# Modelo str.format com os campos, ou função chamada só na escrita com os
+# mesmos argumentos nomeados; em ambos há também o campo hora (HH:MM:SS).
+# Sem campos, um texto é escrito como está (pode ser uma f-string pronta)
+Mensagem = Union[str, Callable[..., str]]
+
+
+class Registro:
+
+    def __init__(self, nivel: int = NIVEL_INFO, formato: str = FORMATO_REGISTRO_TEXTO,
+                 assincrono: bool = True):
+        self.nivel = nivel
+        self.formato = formato
+        self.assincrono = assincrono
+        self.fila: queue.Queue = queue.Queue(TAMANHO_FILA)
+        self.thread: Optional[threading.Thread] = None
+        self.trava_thread = threading.Lock()
+        # (tipo, chave) -> [início da janela, eventos na janela, suprimidos, nível]
+        self.janelas: Dict[Tuple[str, str], List] = {}
+        self.trava_janelas = threading.Lock()
+        # Quando as janelas vencidas voltam a ser conferidas
+        self.proxima_coleta = 0.0
+        # Eventos perdidos com a fila cheia
+        self.descartados = 0
+
+    def ativo(self, nivel: int) -> bool:
+        return nivel >= self.nivel
+
+    def registrar(self, nivel: int, tipo: str, mensagem: Mensagem = "",
+                  limite: int = LIMITE_PADRAO, chave: str = "", **campos):
+        """Registra o evento tipo; no máximo limite eventos com o mesmo tipo
+        e chave por INTERVALO_LIMITE segundos. Os excedentes são contados e
+        informados no próximo evento igual ou quando a janela vence."""
+        if nivel < self.nivel:
+            return
+        agora = time.monotonic()
+        with self.trava_janelas:
+            janela = self.janelas.get((tipo, chave))
+            if janela is None or agora - janela[0] >= INTERVALO_LIMITE:
+                suprimidos = janela[2] if janela is not None else 0
+                self.janelas[(tipo, chave)] = [agora, 1, 0, nivel]
+            elif janela[1] < limite:
+                janela[1] += 1
+                suprimidos = 0
+            else:
+                janela[2] += 1
+                return
+        evento = (time.time(), nivel, tipo, mensagem, campos, suprimidos)
+        if not self.assincrono:
+            self._escrever(self._coletar_suprimidos() + [evento])
+            return
+        if self.thread is None:
+            self._iniciar_thread()
+        try:
+            self.fila.put_nowait(evento)
+        except queue.Full:
+            self.descartados += 1
+
+    def depuracao(self, tipo: str, mensagem: Mensagem = "", **campos):
+        self.registrar(NIVEL_DEPURACAO, tipo, mensagem, **campos)
+
+    def info(self, tipo: str, mensagem: Mensagem = "", **campos):
+        self.registrar(NIVEL_INFO, tipo, mensagem, **campos)
+
+    def aviso(self, tipo: str, mensagem: Mensagem = "", **campos):
+        self.registrar(NIVEL_AVISO, tipo, mensagem, **campos)
+
+    def erro(self, tipo: str, mensagem: Mensagem = "", **campos):
+        self.registrar(NIVEL_ERRO, tipo, mensagem, **campos)
+
+    def _iniciar_thread(self):
+        with self.trava_thread:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, daemon=True)
+                self.thread.start()
+
+    def _coletar_suprimidos(self, todas: bool = False) -> List[Tuple]:
+        """Esquece as janelas vencidas (todas, no encerramento) e retorna um
+        evento com a contagem de cada uma que suprimiu eventos."""
+        agora = time.monotonic()
+        if not todas and agora < self.proxima_coleta:
+            return []
+        self.proxima_coleta = agora + INTERVALO_LIMITE
+        eventos = []
+        with self.trava_janelas:
+            for (tipo, chave), janela in list(self.janelas.items()):
+                if not todas and agora - janela[0] < INTERVALO_LIMITE:
+                    continue
+                del self.janelas[(tipo, chave)]
+                if janela[2]:
+                    mensagem = f"Eventos repetidos suprimidos ({chave})" if chave else "Eventos repetidos suprimidos"
+                    eventos.append((time.time(), janela[3], tipo, mensagem, {}, janela[2]))
+        return eventos
+
+    def _executar(self):
+        while True:
+            # Acorda a cada janela para informar os suprimidos sem esperar
+            # o próximo evento do mesmo tipo
+            try:
+                eventos = [self.fila.get(timeout=INTERVALO_LIMITE)]
+            except queue.Empty:
+                eventos = []
+            # Escreve de uma vez tudo o que já estiver na fila
+            while len(eventos) < 256:
+                try:
+                    eventos.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            fim = None in eventos
+            eventos = [evento for evento in eventos if evento is not None]
+            self._escrever(eventos + self._coletar_suprimidos(todas=fim))
+            if fim:
+                return
+
+    def encerrar(self, tempo_limite: float = 1.0):
+        """Escreve o que ainda estiver na fila, com os suprimidos ainda não
+        informados, e para a thread."""
+        with self.trava_thread:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.fila.put(None)
+            thread.join(tempo_limite)
+        else:
+            self._escrever(self._coletar_suprimidos(todas=True))
+
+    def _escrever(self, eventos: List[Tuple]):
+        linhas = []
+        for evento in eventos:
+            try:
+                linhas.append(self._formatar(*evento))
+            except Exception as e:
+                linhas.append(f"[ERRO] Evento {evento[2]} não pôde ser formatado: {e}")
+        if self.descartados:
+            linhas.append(f"[AVISO] {self.descartados} eventos descartados (fila de registro cheia)")
+            self.descartados = 0
+        if linhas:
+            sys.stdout.write("\n".join(linhas) + "\n")
+            sys.stdout.flush()
+
+    def _formatar(self, instante: float, nivel: int, tipo: str, mensagem: Mensagem,
+                  campos: Dict, suprimidos: int) -> str:
+        hora = datetime.fromtimestamp(instante).strftime('%H:%M:%S')
+        # Campos em bytes (do caminho de encaminhamento) só são decodificados aqui
+        campos = {nome: valor.decode('utf-8', 'replace') if isinstance(valor, (bytes, bytearray)) else valor
+                  for nome, valor in campos.items()}
+        if callable(mensagem):
+            texto = mensagem(hora=hora, **campos)
+        else:
+            texto = mensagem.format(hora=hora, **campos) if campos else mensagem
+        if self.formato == FORMATO_REGISTRO_JSON:
+            registro = {'instante': instante, 'nivel': NOMES_NIVEIS.get(nivel, nivel),
+                        'evento': tipo, 'mensagem': texto}
+            registro.update(campos)
+            if suprimidos:
+                registro['suprimidos'] = suprimidos
+            return json.dumps(registro, ensure_ascii=False, default=str)
+        linha = f"[{tipo}] {texto}"
+        if suprimidos:
+            linha += f" (+{suprimidos} suprimidas)"
+        return linha
@@ -1,22 +1,429 @@
+import asyncio
+import contextlib
+import heapq
+import multiprocessing
+import os
+import select
+import signal
 import socket
+import struct
+import tempfile
 import threading
 import time
 import sys
-from typing import Dict, List, Tuple, Optional
-from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Set, Tuple, Optional
+from datetime import datetime
+from multiprocessing.connection import Connection, wait
+
+from metricas import LockMedido, Metricas
+from estado_enlace import PEDIDO_SINCRONIZACAO, PREFIXO_LSA, BancoEstadoEnlace, Lsa, codificar_lsa, decodificar_lsa
+from registro import (FORMATO_REGISTRO_JSON, FORMATO_REGISTRO_TEXTO, NIVEIS, NIVEL_INFO,
+                      NOMES_NIVEIS, Registro)
+from trabalhadores import (CAPACIDADE_ENTRADAS, MAXIMO_TRABALHADORES, MemoriaTabela,
+                           criar_socket_compartilhado, decodificar_repasse, enviar_datagrama,
+                           executar_trabalhador)
+from transferencia import (JANELA_PADRAO, MARCADOR_TRANSFERENCIA, MAXIMO_JANELA_TRANSFERENCIA,
+                           GerenciadorTransferencias)
+
+# Métrica que representa destino inalcançável (usada para retirar rotas)
+METRICA_INFINITA = 16
+
+# Modos de horizonte aplicados às rotas aprendidas do próprio vizinho
+HORIZONTE_NENHUM = 'nenhum'    # anuncia todas as rotas a todos os vizinhos
+HORIZONTE_SPLIT = 'split'      # omite as rotas aprendidas do vizinho
+HORIZONTE_POISON = 'poison'    # anuncia essas rotas com métrica infinita
+MODOS_HORIZONTE = (HORIZONTE_NENHUM, HORIZONTE_SPLIT, HORIZONTE_POISON)
+
+RotaAnunciada = Optional[Tuple[int, str]]
+
+# Formatos de anúncio de rotas. O binário só é usado com vizinhos que
+# anunciaram suporte a ele pela mensagem de capacidades '&'
+FORMATO_TEXTO = 'texto'
+FORMATO_BINARIO = 'binario'
+FORMATO_BINARIO_PREFIXOS = 'binario2'
+VERSAO_BINARIA = 1
+# Versão 2: entradas com tamanho de prefixo (rotas CIDR e agregadas)
+VERSAO_BINARIA_PREFIXOS = 2
+# Capacidade 3: o vizinho aceita '@' e '&' agrupados no datagrama da tabela
+VERSAO_KEEPALIVE_AGRUPADO = 3
+# Byte de controle ASCII: roteadores antigos decodificam e ignoram a mensagem
+MARCADOR_BINARIO = 0x02
+TIPO_TABELA_COMPLETA = 0
+TIPO_DELTA = 1
+# Primeira parte de uma tabela completa que também vale como '@' e '&'
+TIPO_TABELA_KEEPALIVE = 2
+# marcador, versão, tipo, id do anúncio, parte, total de partes
+CABECALHO_BINARIO = struct.Struct('!BBBIBB')
+# IPv4 (4 bytes) + métrica (1 byte)
+ENTRADA_BINARIA = struct.Struct('!4sB')
+# Rede IPv4 (4 bytes) + tamanho do prefixo (1 byte) + métrica (1 byte)
+ENTRADA_BINARIA_PREFIXO = struct.Struct('!4sBB')
+ENDERECO_IPV4 = struct.Struct('!I')
+TAMANHO_MAXIMO_DATAGRAMA = 1400
+TAMANHO_BUFFER_RECEPCAO = 65535
+# Datagramas processados por despertar do socket antes de voltar ao loop
+MAXIMO_LOTE_RECEPCAO = 256
+
+# Intervalos padrão em segundos (configuráveis em roteadores.txt)
+INTERVALO_KEEPALIVE = 10.0
+TEMPO_LIMITE_VIZINHO = 15.0
+
+# Mensagens de dados: '!TTL!origem;destino;texto', com TTL de 3 dígitos
+# decrementado a cada salto ('!origem;destino;texto' sem TTL ainda é aceito)
+TTL_PADRAO = 64
+MAXIMO_ENTRADAS_ENCAMINHAMENTO = 4096
+
+# Estado de enlace: LSA próprio renovado a cada tantos keepalives; LSAs
+# de outros roteadores sem renovação por IDADE_MAXIMA_LSA keepalives expiram
+KEEPALIVES_POR_RENOVACAO_LSA = 60
+IDADE_MAXIMA_LSA = 4 * KEEPALIVES_POR_RENOVACAO_LSA
+# LSAs que chegam juntos (inundação, sincronização) geram um só cálculo, e
+# vizinhos que mudam juntos um só LSA
+ATRASO_CALCULO_ROTAS = 0.05
+
+# Cópia da tabela em disco (CACHE_ROTAS=): identificador, versão do
+# formato, instante da gravação (ms do relógio de parede) e número de rotas
+CABECALHO_CACHE_ROTAS = struct.Struct('!4sBQI')
+# Rede IPv4, tamanho do prefixo, métrica, IPv4 do próximo salto
+ENTRADA_CACHE_ROTAS = struct.Struct('!IBB4s')
+IDENTIFICADOR_CACHE_ROTAS = b'RTAB'
+VERSAO_CACHE_ROTAS = 1
+# Um cache mais antigo que isso é ignorado na partida
+IDADE_MAXIMA_CACHE_ROTAS = 300.0
+
+TIPOS_MENSAGEM = {ord(tipo): tipo for tipo in '*%@&!$'}
+TIPOS_MENSAGEM[MARCADOR_BINARIO] = 'binário'
+
+
+def tipo_mensagem(dados: bytes) -> str:
+    """Tipo da mensagem pelo primeiro byte ('binário' para o formato binário)."""
+    return TIPOS_MENSAGEM.get(dados[0], '?') if dados else '?'
+
+
+def parsear_prefixo(destino: str) -> Optional[Tuple[int, int]]:
+    """Converte 'a.b.c.d' ou 'a.b.c.d/n' em (rede como inteiro, n)."""
+    ip, _, tamanho_str = destino.partition('/')
+    try:
+        rede = ENDERECO_IPV4.unpack(socket.inet_pton(socket.AF_INET, ip))[0]
+        tamanho = int(tamanho_str) if tamanho_str else 32
+    except (OSError, ValueError):
+        return None
+    if not 0 <= tamanho <= 32:
+        return None
+    return rede & mascara_prefixo(tamanho), tamanho
+    
+    
+def mascara_prefixo(tamanho: int) -> int:
+    return (0xFFFFFFFF << (32 - tamanho)) & 0xFFFFFFFF
+    
+    
+def formatar_prefixo(rede: int, tamanho: int) -> str:
+    """Rotas de host (/32) ficam sem sufixo, como no formato original."""
+    ip = socket.inet_ntoa(ENDERECO_IPV4.pack(rede))
+    return ip if tamanho == 32 else f"{ip}/{tamanho}"
+    
+    
+def prefixo_contem(resumo: Tuple[int, int], prefixo: Tuple[int, int]) -> bool:
+    """True se prefixo está contido em resumo (e é mais específico que ele)."""
+    return prefixo[1] > resumo[1] and prefixo[0] & mascara_prefixo(resumo[1]) == resumo[0]
+    
+    
+def resumir_rotas(rotas: List[Tuple[str, int]], resumos: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+    """Substitui as rotas cobertas por um prefixo de resumo configurado por
+    uma única entrada do resumo, com a menor métrica entre elas. O próprio
+    resumo recebido de outro roteador não conta, para não realimentá-lo."""
+    if not resumos:
+        return rotas
+    metricas_resumo: Dict[Tuple[int, int], int] = {}
+    chaves_resumo = {formatar_prefixo(*resumo) for resumo in resumos}
+    resultado = []
+    for destino, metrica in rotas:
+        if destino in chaves_resumo:
+            continue
+        prefixo = parsear_prefixo(destino)
+        resumo = next((r for r in resumos if prefixo is not None and prefixo_contem(r, prefixo)), None)
+        if resumo is None:
+            resultado.append((destino, metrica))
+        else:
+            metricas_resumo[resumo] = min(metrica, metricas_resumo.get(resumo, metrica))
+    resultado.extend((formatar_prefixo(*resumo), metrica) for resumo, metrica in metricas_resumo.items())
+    return resultado
+
+
+class ArvorePrefixos:
+    """Trie binária sobre endereços IPv4 inteiros para busca do prefixo mais
+    longo. Cada nó é [filho 0, filho 1, valor]. Alterações copiam o caminho
+    até a raiz em vez de mudar nós existentes, então uma cópia (que só
+    compartilha a raiz) continua válida e pode ser lida sem lock."""
+    
+    def __init__(self, raiz: Optional[list] = None):
+        self.raiz: list = raiz if raiz is not None else [None, None, None]
+        
+    def copia(self) -> 'ArvorePrefixos':
+        return ArvorePrefixos(self.raiz)
+        
+    def _substituir(self, rede: int, tamanho: int, valor: Optional[str]):
+        caminho = []
+        no = self.raiz
+        for i in range(tamanho):
+            caminho.append(no)
+            no = no[(rede >> (31 - i)) & 1] if no is not None else None
+        novo = [None, None, valor] if no is None else [no[0], no[1], valor]
+        for i in range(tamanho - 1, -1, -1):
+            # Poda os nós que ficaram sem valor e sem filhos
+            if novo[0] is None and novo[1] is None and novo[2] is None:
+                novo = None
+            pai = caminho[i]
+            copia = list(pai) if pai is not None else [None, None, None]
+            copia[(rede >> (31 - i)) & 1] = novo
+            novo = copia
+        self.raiz = novo
+        
+    def inserir(self, rede: int, tamanho: int, valor: str):
+        self._substituir(rede, tamanho, valor)
+        
+    def remover(self, rede: int, tamanho: int):
+        self._substituir(rede, tamanho, None)
+            
+    def valores_sob(self, rede: int, tamanho: int) -> List[str]:
+        """Valores de todos os prefixos contidos em rede/tamanho (inclusive)."""
+        no = self.raiz
+        for i in range(tamanho):
+            no = no[(rede >> (31 - i)) & 1]
+            if no is None:
+                return []
+        valores = []
+        pilha = [no]
+        while pilha:
+            no = pilha.pop()
+            if no[2] is not None:
+                valores.append(no[2])
+            pilha.extend(filho for filho in no[:2] if filho is not None)
+        return valores
+        
+    def buscar(self, endereco: int) -> Optional[str]:
+        no = self.raiz
+        melhor = no[2]
+        for i in range(32):
+            no = no[(endereco >> (31 - i)) & 1]
+            if no is None:
+                break
+            if no[2] is not None:
+                melhor = no[2]
+        return melhor
+
+
+def codificar_rotas_binario(rotas: List[Tuple[str, int]], tipo: int, id_anuncio: int,
+                            tamanho_maximo: int = TAMANHO_MAXIMO_DATAGRAMA,
+                            versao: int = VERSAO_BINARIA) -> List[bytes]:
+    """Codifica as rotas no formato binário, dividindo em quantos datagramas
+    forem necessários para não ultrapassar tamanho_maximo bytes cada."""
+    entrada = ENTRADA_BINARIA_PREFIXO if versao == VERSAO_BINARIA_PREFIXOS else ENTRADA_BINARIA
+    por_datagrama = (tamanho_maximo - CABECALHO_BINARIO.size) // entrada.size
+    total = max(1, -(-len(rotas) // por_datagrama))
+    if total > 255:
+        raise ValueError("Tabela grande demais para o formato binário")
+    datagramas = []
+    for parte in range(total):
+        bloco = rotas[parte * por_datagrama:(parte + 1) * por_datagrama]
+        buffer = bytearray(CABECALHO_BINARIO.size + len(bloco) * entrada.size)
+        CABECALHO_BINARIO.pack_into(buffer, 0, MARCADOR_BINARIO, versao, tipo,
+                                    id_anuncio & 0xFFFFFFFF, parte, total)
+        deslocamento = CABECALHO_BINARIO.size
+        for ip_destino, metrica in bloco:
+            if versao == VERSAO_BINARIA_PREFIXOS:
+                prefixo = parsear_prefixo(ip_destino)
+                if prefixo is None:
+                    raise ValueError(f"Destino não é um prefixo IPv4: {ip_destino}")
+                entrada.pack_into(buffer, deslocamento, ENDERECO_IPV4.pack(prefixo[0]), prefixo[1],
+                                  min(metrica, 255))
+            else:
+                entrada.pack_into(buffer, deslocamento, socket.inet_aton(ip_destino), min(metrica, 255))
+            deslocamento += entrada.size
+        datagramas.append(bytes(buffer))
+    return datagramas
+
+
+def marcar_keepalive(datagrama: bytes) -> bytes:
+    """Cópia do datagrama binário de tabela completa com o tipo keepalive."""
+    dados = bytearray(datagrama)
+    dados[2] = TIPO_TABELA_KEEPALIVE
+    return bytes(dados)
+
+
+def decodificar_rotas_binario(dados: bytes) -> Tuple[int, int, int, int, List[Tuple[str, int]]]:
+    """Retorna (tipo, id do anúncio, parte, total de partes, rotas)."""
+    visao = memoryview(dados)
+    marcador, versao, tipo, id_anuncio, parte, total = CABECALHO_BINARIO.unpack_from(visao, 0)
+    if marcador != MARCADOR_BINARIO or versao not in (VERSAO_BINARIA, VERSAO_BINARIA_PREFIXOS):
+        raise ValueError(f"Versão binária não suportada: {versao}")
+    entrada = ENTRADA_BINARIA_PREFIXO if versao == VERSAO_BINARIA_PREFIXOS else ENTRADA_BINARIA
+    corpo = visao[CABECALHO_BINARIO.size:]
+    if len(corpo) % entrada.size:
+        raise ValueError("Mensagem binária truncada")
+    if versao == VERSAO_BINARIA_PREFIXOS:
+        rotas = []
+        for rede, tamanho, metrica in entrada.iter_unpack(corpo):
+            if tamanho > 32:
+                raise ValueError(f"Tamanho de prefixo inválido: {tamanho}")
+            rede_int = ENDERECO_IPV4.unpack(rede)[0] & mascara_prefixo(tamanho)
+            rotas.append((formatar_prefixo(rede_int, tamanho), metrica))
+    else:
+        rotas = [(socket.inet_ntoa(ip), metrica) for ip, metrica in entrada.iter_unpack(corpo)]
+    return tipo, id_anuncio, parte, total, rotas
+
+
+def codificar_cache_rotas(rotas: List[Tuple[str, int, str]], instante: float) -> bytes:
+    """Rotas (destino, métrica, próximo salto) com destino e salto IPv4."""
+    entradas = []
+    for destino, metrica, saida in rotas:
+        prefixo = parsear_prefixo(destino)
+        if prefixo is None or parsear_prefixo(saida) is None or metrica > 255:
+            continue
+        entradas.append(ENTRADA_CACHE_ROTAS.pack(prefixo[0], prefixo[1], metrica, socket.inet_aton(saida)))
+    return CABECALHO_CACHE_ROTAS.pack(IDENTIFICADOR_CACHE_ROTAS, VERSAO_CACHE_ROTAS,
+                                      int(instante * 1000), len(entradas)) + b''.join(entradas)
+
+
+def decodificar_cache_rotas(dados: bytes) -> Tuple[float, List[Tuple[str, int, str]]]:
+    """Retorna (instante da gravação, rotas); ValueError se inválido."""
+    if len(dados) < CABECALHO_CACHE_ROTAS.size:
+        raise ValueError("Cache de rotas truncado")
+    identificador, versao, instante, quantidade = CABECALHO_CACHE_ROTAS.unpack_from(dados)
+    if identificador != IDENTIFICADOR_CACHE_ROTAS or versao != VERSAO_CACHE_ROTAS:
+        raise ValueError("Formato de cache de rotas desconhecido")
+    corpo = memoryview(dados)[CABECALHO_CACHE_ROTAS.size:]
+    if len(corpo) != quantidade * ENTRADA_CACHE_ROTAS.size:
+        raise ValueError("Cache de rotas truncado")
+    rotas = []
+    for rede, tamanho, metrica, saida in ENTRADA_CACHE_ROTAS.iter_unpack(corpo):
+        if tamanho > 32:
+            raise ValueError(f"Tamanho de prefixo inválido: {tamanho}")
+        rotas.append((formatar_prefixo(rede & mascara_prefixo(tamanho), tamanho), metrica, socket.inet_ntoa(saida)))
+    return instante / 1000, rotas
+
+
+def gravar_arquivo_atomico(arquivo: str, dados: bytes):
+    """Grava em um arquivo temporário e o renomeia: quem lê (ou um
+    reinício no meio da gravação) vê o arquivo antigo ou o novo inteiro.
+    Cada gravação tem o próprio temporário, na mesma pasta do arquivo."""
+    descritor, temporario = tempfile.mkstemp(prefix=f"{os.path.basename(arquivo)}.", suffix='.tmp',
+                                             dir=os.path.dirname(arquivo) or '.')
+    try:
+        with os.fdopen(descritor, 'wb') as f:
+            f.write(dados)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, arquivo)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporario)
+        raise
+
+
+def formatar_tabela(rotas: List[Tuple[str, int, str]]) -> str:
+    if not rotas:
+        return "Tabela vazia"
+    linhas = ["", f"{'IP Destino':<20} {'Métrica':<10} {'IP Saída':<20}", "-" * 50]
+    linhas.extend(f"{ip_destino:<20} {metrica:<10} {ip_saida:<20}" for ip_destino, metrica, ip_saida in sorted(rotas))
+    return "\n".join(linhas) + "\n"
+
+
+def formatar_dump_tabela(titulo: str, rotas: List[Tuple[str, int, str]], hora: str) -> str:
+    return f"{titulo} ({hora}):\n{formatar_tabela(rotas)}"
+
+
+class InstantaneoTabela:
+    """Cópia imutável da tabela publicada ao fim de cada lote de alterações.
+    Encaminhamento, anúncios e exibição leem o instantâneo atual sem lock;
+    nada aqui é alterado depois de publicado."""
+    
+    __slots__ = ('versao', 'rotas', 'arvore', 'ip_roteador')
+    
+    def __init__(self, versao: int, rotas: Dict[str, Tuple[int, str, datetime]],
+                 arvore: ArvorePrefixos, ip_roteador: str):
+        self.versao = versao
+        self.rotas = rotas
+        self.arvore = arvore
+        self.ip_roteador = ip_roteador
+        
+    def obter_rota(self, ip_destino: str) -> Optional[Tuple[int, str]]:
+        rota = self.rotas.get(ip_destino)
+        return (rota[0], rota[1]) if rota is not None else None
+        
+    def buscar_rota(self, ip_destino: str) -> Optional[Tuple[int, str]]:
+        """Rota do prefixo mais longo que contém ip_destino."""
+        rota = self.obter_rota(ip_destino)
+        if rota is not None:
+            return rota
+        prefixo = parsear_prefixo(ip_destino)
+        if prefixo is None:
+            return None
+        destino = self.arvore.buscar(prefixo[0])
+        return self.obter_rota(destino) if destino is not None else None
+        
+    def obter_rotas_com_saida(self) -> List[Tuple[str, int, str]]:
+        return [(ip_destino, metrica, ip_saida) for ip_destino, (metrica, ip_saida, _) in self.rotas.items()
+                if ip_destino != self.ip_roteador]
+        
+    def listar(self) -> List[Tuple[str, int, str]]:
+        """(destino, métrica, saída) de todas as rotas, para exibição."""
+        return [(ip_destino, metrica, ip_saida) for ip_destino, (metrica, ip_saida, _) in self.rotas.items()]
+
 
 class TabelaRoteamento:
+    """Tabela alterada só por quem detém o lock do roteador; leitores sem
+    lock usam o instantâneo em self.atual, trocado por publicar()."""
     
     def __init__(self, ip_roteador: str):
         self.ip_roteador = ip_roteador
         self.rotas: Dict[str, Tuple[int, str, datetime]] = {}
+        # Destinos IPv4 (hosts e prefixos CIDR) para busca do prefixo mais longo
+        self.arvore = ArvorePrefixos()
+        # Destinos alterados desde o último anúncio enviado -> versão da alteração
+        self.alteracoes: Dict[str, int] = {}
+        # Incrementada a cada alteração de rota (invalida anúncios em cache)
+        self.versao = 0
+        # Chamados como observador(ip_destino, rota_antiga, rota_nova) a cada alteração
+        self.observadores: List[Callable[[str, RotaAnunciada, RotaAnunciada], None]] = []
+        # Chamados com o novo instantâneo antes de ele se tornar o atual
+        self.observadores_publicacao: List[Callable[[InstantaneoTabela], None]] = []
+        self.atual = InstantaneoTabela(0, {}, self.arvore.copia(), ip_roteador)
+        
+    def publicar(self):
+        """Publica as alterações feitas desde a última publicação como um novo
+        instantâneo (uma atribuição, atômica para os leitores)."""
+        if self.versao == self.atual.versao:
+            return
+        instantaneo = InstantaneoTabela(self.versao, self.rotas.copy(), self.arvore.copia(), self.ip_roteador)
+        for observador in self.observadores_publicacao:
+            observador(instantaneo)
+        self.atual = instantaneo
+        
+    def _notificar(self, ip_destino: str, antiga: RotaAnunciada, nova: RotaAnunciada):
+        self.versao += 1
+        self.alteracoes[ip_destino] = self.versao
+        for observador in self.observadores:
+            observador(ip_destino, antiga, nova)
         
     def adicionar_rota(self, ip_destino: str, metrica: int, ip_saida: str):
+        rota_atual = self.rotas.get(ip_destino)
         self.rotas[ip_destino] = (metrica, ip_saida, datetime.now())
+        if rota_atual is None:
+            prefixo = parsear_prefixo(ip_destino)
+            if prefixo is not None:
+                self.arvore.inserir(prefixo[0], prefixo[1], ip_destino)
+        if rota_atual is None or rota_atual[0] != metrica or rota_atual[1] != ip_saida:
+            antiga = (rota_atual[0], rota_atual[1]) if rota_atual is not None else None
+            self._notificar(ip_destino, antiga, (metrica, ip_saida))
         
     def remover_rota(self, ip_destino: str):
         if ip_destino in self.rotas:
-            del self.rotas[ip_destino]
+            metrica, ip_saida, _ = self.rotas.pop(ip_destino)
+            prefixo = parsear_prefixo(ip_destino)
+            if prefixo is not None:
+                self.arvore.remover(prefixo[0], prefixo[1])
+            self._notificar(ip_destino, (metrica, ip_saida), None)
             
     def obter_rota(self, ip_destino: str) -> Optional[Tuple[int, str]]:
         if ip_destino in self.rotas:
@@ -24,21 +431,44 @@ class TabelaRoteamento:
             return (metrica, ip_saida)
         return None
         
-    def obter_rotas_para_envio(self) -> List[Tuple[str, int]]:
+    def buscar_rota(self, ip_destino: str) -> Optional[Tuple[int, str]]:
+        """Rota do prefixo mais longo que contém ip_destino."""
+        rota = self.obter_rota(ip_destino)
+        if rota is not None:
+            return rota
+        prefixo = parsear_prefixo(ip_destino)
+        if prefixo is None:
+            return None
+        destino = self.arvore.buscar(prefixo[0])
+        return self.obter_rota(destino) if destino is not None else None
+        
+    def obter_rotas_com_saida(self) -> List[Tuple[str, int, str]]:
         rotas_envio = []
-        for ip_destino, (metrica, _, _) in self.rotas.items():
+        for ip_destino, (metrica, ip_saida, _) in self.rotas.items():
             if ip_destino != self.ip_roteador:
-                rotas_envio.append((ip_destino, metrica))
+                rotas_envio.append((ip_destino, metrica, ip_saida))
+        return rotas_envio
+        
+    def obter_alteracoes_para_envio(self) -> List[Tuple[str, RotaAnunciada]]:
+        """Retorna as rotas alteradas desde o último anúncio e limpa o registro.
+        Rotas removidas são retornadas como None."""
+        rotas_envio = []
+        for ip_destino in self.alteracoes:
+            if ip_destino == self.ip_roteador:
+                continue
+            rota = self.rotas.get(ip_destino)
+            rotas_envio.append((ip_destino, (rota[0], rota[1]) if rota is not None else None))
+        self.alteracoes.clear()
         return rotas_envio
         
+    def descartar_alteracoes(self, ate_versao: int):
+        """Esquece as alterações já contidas no instantâneo ate_versao."""
+        for ip_destino, versao in list(self.alteracoes.items()):
+            if versao <= ate_versao:
+                del self.alteracoes[ip_destino]
+        
     def formatar_para_exibicao(self) -> str:
-        if not self.rotas:
-            return "Tabela vazia"
-        resultado = f"\n{'IP Destino':<20} {'Métrica':<10} {'IP Saída':<20}\n"
-        resultado += "-" * 50 + "\n"
-        for ip_destino, (metrica, ip_saida, _) in sorted(self.rotas.items()):
-            resultado += f"{ip_destino:<20} {metrica:<10} {ip_saida:<20}\n"
-        return resultado
+        return formatar_tabela(self.atual.listar())
         
     def remover_rotas_por_vizinho(self, ip_vizinho: str):
         rotas_remover = []
@@ -49,128 +479,1178 @@ class TabelaRoteamento:
             self.remover_rota(ip_destino)
 
 
+class CacheAnuncios:
+    """Anúncios da tabela completa já codificados, um por vizinho. Com split
+    horizon ou poisoned reverse cada vizinho recebe uma visão diferente; uma
+    visão só é reconstruída quando uma alteração muda o que aquele vizinho vê.
+    
+    As visões pertencem a um instantâneo da tabela: a cada publicação o
+    escritor leva para o novo as que não mudaram, e quem anuncia lê o par
+    (instantâneo, visões) sem lock, construindo as que faltarem."""
+    
+    def __init__(self, tabela: TabelaRoteamento, codificar: Callable[[List[Tuple[str, int]], str], List[bytes]],
+                 modo: str = HORIZONTE_POISON, metrica_infinita: int = METRICA_INFINITA):
+        self.tabela = tabela
+        self.codificar = codificar
+        self.modo = modo
+        self.metrica_infinita = metrica_infinita
+        # Instantâneo e suas visões: (vizinho, formato) -> datagramas da tabela completa
+        self.estado: Tuple[InstantaneoTabela, Dict[Tuple[str, str], List[bytes]]] = (tabela.atual, {})
+        # Alterações ainda não publicadas: (destino, rota antiga, rota nova)
+        self.pendentes: List[Tuple[str, RotaAnunciada, RotaAnunciada]] = []
+        # Prefixos anunciados no lugar das rotas mais específicas que cobrem
+        self.resumos: List[Tuple[int, int]] = []
+        tabela.observadores.append(self._registrar_alteracao)
+        tabela.observadores_publicacao.append(self._publicar)
+        
+    def configurar(self, modo: str, metrica_infinita: int):
+        self.modo = modo
+        self.metrica_infinita = metrica_infinita
+        self.estado = (self.tabela.atual, {})
+        
+    def adicionar_resumo(self, resumo: Tuple[int, int]):
+        if resumo not in self.resumos:
+            self.resumos.append(resumo)
+            self.estado = (self.tabela.atual, {})
+            
+    def definir_resumos(self, resumos: List[Tuple[int, int]]):
+        self.resumos = list(resumos)
+        self.estado = (self.tabela.atual, {})
+            
+    def resumo_de(self, destino: str) -> Optional[Tuple[int, int]]:
+        prefixo = parsear_prefixo(destino)
+        if prefixo is None:
+            return None
+        return next((r for r in self.resumos if r == prefixo or prefixo_contem(r, prefixo)), None)
+        
+    def metrica_resumo(self, vizinho: str, resumo: Tuple[int, int],
+                       instantaneo: InstantaneoTabela) -> Optional[int]:
+        """Menor métrica visível ao vizinho entre as rotas cobertas pelo resumo."""
+        melhor = None
+        for destino in instantaneo.arvore.valores_sob(resumo[0], resumo[1]):
+            prefixo = parsear_prefixo(destino)
+            if prefixo == resumo or destino == instantaneo.ip_roteador:
+                continue
+            metrica = self.metrica_visivel(vizinho, instantaneo.obter_rota(destino))
+            if metrica is not None and (melhor is None or metrica < melhor):
+                melhor = metrica
+        return melhor
+        
+    def _chave(self, vizinho: str) -> str:
+        # Sem horizonte todos os vizinhos compartilham a mesma visão
+        return vizinho if self.modo != HORIZONTE_NENHUM else ''
+        
+    def metrica_visivel(self, vizinho: str, rota: RotaAnunciada) -> Optional[int]:
+        """Métrica que o vizinho deve ver para a rota (None = omitida)."""
+        if rota is None:
+            return None
+        metrica, ip_saida = rota
+        if ip_saida == vizinho and self.modo != HORIZONTE_NENHUM:
+            return None if self.modo == HORIZONTE_SPLIT else self.metrica_infinita
+        return metrica
+        
+    def _registrar_alteracao(self, ip_destino: str, antiga: RotaAnunciada, nova: RotaAnunciada):
+        if ip_destino != self.tabela.ip_roteador:
+            self.pendentes.append((ip_destino, antiga, nova))
+            
+    def _publicar(self, instantaneo: InstantaneoTabela):
+        """Chamado pelo escritor, com o lock, a cada novo instantâneo."""
+        pendentes, self.pendentes = self.pendentes, []
+        _, visoes = self.estado
+        self.estado = (instantaneo, {
+            (chave, formato): visao for (chave, formato), visao in list(visoes.items())
+            if all(self.metrica_visivel(chave, antiga) == self.metrica_visivel(chave, nova)
+                   for _, antiga, nova in pendentes)})
+                
+    def obter(self, vizinho: str, formato: str = FORMATO_TEXTO) -> List[bytes]:
+        instantaneo, visoes = self.estado
+        chave = (self._chave(vizinho), formato)
+        visao = visoes.get(chave)
+        if visao is None:
+            rotas_envio = []
+            for ip_destino, metrica, ip_saida in instantaneo.obter_rotas_com_saida():
+                metrica_visivel = self.metrica_visivel(chave[0], (metrica, ip_saida))
+                if metrica_visivel is not None:
+                    rotas_envio.append((ip_destino, metrica_visivel))
+            if formato == FORMATO_BINARIO_PREFIXOS:
+                # Só vizinhos com suporte a prefixos entendem rotas resumidas
+                rotas_envio = resumir_rotas(rotas_envio, self.resumos)
+            visao = self.codificar(rotas_envio, formato) if rotas_envio else []
+            # Se outro instantâneo já foi publicado, a visão fica só no antigo
+            visoes[chave] = visao
+        return visao
+
+
+class MonitorVizinhos:
+    """Prazos de expiração dos vizinhos em um min-heap (time.monotonic()).
+    Renovar um vizinho é O(1): só o instante da última mensagem muda e a
+    entrada antiga do heap é corrigida quando chega ao topo. Cada vizinho
+    tem no máximo uma entrada no heap."""
+    
+    def __init__(self, tempo_limite: float = TEMPO_LIMITE_VIZINHO):
+        self.tempo_limite = tempo_limite
+        self.ultima_mensagem: Dict[str, float] = {}
+        self.heap: List[Tuple[float, str]] = []
+        
+    def renovar(self, vizinho: str, agora: float) -> bool:
+        """Registra mensagem do vizinho. Retorna True se ele não era monitorado."""
+        novo = vizinho not in self.ultima_mensagem
+        self.ultima_mensagem[vizinho] = agora
+        if novo:
+            heapq.heappush(self.heap, (agora + self.tempo_limite, vizinho))
+        return novo
+        
+    def remover(self, vizinho: str):
+        # A entrada do heap é descartada quando chegar ao topo
+        self.ultima_mensagem.pop(vizinho, None)
+        
+    def proximo_prazo(self) -> Optional[float]:
+        return self.heap[0][0] if self.heap else None
+        
+    def expirados(self, agora: float) -> List[str]:
+        vizinhos = []
+        while self.heap and self.heap[0][0] <= agora:
+            _, vizinho = heapq.heappop(self.heap)
+            ultima = self.ultima_mensagem.get(vizinho)
+            if ultima is None:
+                continue
+            prazo = ultima + self.tempo_limite
+            if prazo <= agora:
+                del self.ultima_mensagem[vizinho]
+                vizinhos.append(vizinho)
+            else:
+                heapq.heappush(self.heap, (prazo, vizinho))
+        return vizinhos
+
+
+class Configuracao:
+    """Conteúdo validado de um roteadores.txt. None (ou lista vazia) indica
+    chave ausente do arquivo."""
+    
+    def __init__(self):
+        self.porta: Optional[int] = None
+        self.porta_metricas: Optional[int] = None
+        self.intervalo_keepalive: Optional[float] = None
+        self.tempo_limite: Optional[float] = None
+        self.nivel_registro: Optional[str] = None
+        self.formato_registro: Optional[str] = None
+        self.exibir_tabelas: Optional[bool] = None
+        self.arquivo_cache_rotas: Optional[str] = None
+        self.roteamento: Optional[str] = None
+        self.modo_horizonte: Optional[str] = None
+        self.metrica_infinita: Optional[int] = None
+        self.janela_transferencia: Optional[int] = None
+        self.redes: List[str] = []
+        self.resumos: List[Tuple[int, int]] = []
+        # IP -> porta (None: a porta deste roteador)
+        self.vizinhos: Dict[str, Optional[int]] = {}
+        # Uma mensagem de aviso por linha inválida
+        self.erros: List[str] = []
+        
+    def preencher_padroes(self, porta: int):
+        """Troca as chaves ausentes pelos valores de um roteador iniciado sem
+        elas (porta: a da linha de comando). Usado na recarga, em que o
+        arquivo vale inteiro: retirar uma chave volta ao padrão."""
+        padroes = (('porta', porta), ('intervalo_keepalive', INTERVALO_KEEPALIVE),
+                   ('tempo_limite', TEMPO_LIMITE_VIZINHO), ('nivel_registro', NOMES_NIVEIS[NIVEL_INFO]),
+                   ('formato_registro', FORMATO_REGISTRO_TEXTO), ('exibir_tabelas', True),
+                   ('roteamento', MotorVetorDistancia.nome), ('modo_horizonte', HORIZONTE_POISON),
+                   ('metrica_infinita', METRICA_INFINITA), ('janela_transferencia', JANELA_PADRAO))
+        for atributo, padrao in padroes:
+            if getattr(self, atributo) is None:
+                setattr(self, atributo, padrao)
+
+
+def _porta_valida(valor: str) -> int:
+    porta = int(valor)
+    if not 0 < porta < 65536:
+        raise ValueError
+    return porta
+
+
+def ler_configuracao(arquivo: str, ip_roteador: str) -> Configuracao:
+    """Interpreta o arquivo sem aplicar nada. OSError se não puder ser lido;
+    linhas inválidas ficam em Configuracao.erros."""
+    configuracao = Configuracao()
+    erros = configuracao.erros
+    with open(arquivo, 'r') as f:
+        linhas = f.read().splitlines()
+    for linha in linhas:
+        linha = linha.strip()
+        conteudo = linha.split('#')[0].strip()
+        if not conteudo:
+            continue
+        chave, separador, valor = conteudo.partition('=')
+        chave = chave.strip().upper()
+        valor = valor.strip()
+        
+        if not separador:
+            # Vizinho: IP ou IP:PORTA
+            ip, _, porta_str = conteudo.partition(':')
+            ip = ip.strip()
+            try:
+                socket.inet_pton(socket.AF_INET, ip)
+            except OSError:
+                erros.append(f"Vizinho inválido: {linha}")
+                continue
+            porta_vizinho = None
+            if porta_str:
+                try:
+                    porta_vizinho = _porta_valida(porta_str.strip())
+                except ValueError:
+                    erros.append(f"Porta inválida para {ip}: {porta_str.strip()}")
+                    continue
+            if ip != ip_roteador:
+                configuracao.vizinhos[ip] = porta_vizinho
+                
+        elif chave in ('LOG_NIVEL', 'LOG_FORMATO', 'LOG_TABELAS'):
+            valor = valor.lower()
+            if chave == 'LOG_NIVEL' and valor in NIVEIS:
+                configuracao.nivel_registro = valor
+            elif chave == 'LOG_FORMATO' and valor in (FORMATO_REGISTRO_TEXTO, FORMATO_REGISTRO_JSON):
+                configuracao.formato_registro = valor
+            elif chave == 'LOG_TABELAS' and valor in ('sim', 'nao'):
+                configuracao.exibir_tabelas = valor == 'sim'
+            else:
+                erros.append(f"Linha de registro inválida: {linha}")
+                
+        elif chave in ('METRICAS', 'PORTA'):
+            try:
+                porta = _porta_valida(valor)
+            except ValueError:
+                erros.append(f"Linha de {'métricas' if chave == 'METRICAS' else 'porta'} inválida: {linha}")
+                continue
+            if chave == 'METRICAS':
+                configuracao.porta_metricas = porta
+            else:
+                configuracao.porta = porta
+                
+        elif chave in ('KEEPALIVE', 'TEMPO_LIMITE'):
+            try:
+                segundos = float(valor)
+                if not segundos > 0:
+                    raise ValueError
+            except ValueError:
+                erros.append(f"Linha de intervalo inválida: {linha}")
+                continue
+            if chave == 'KEEPALIVE':
+                configuracao.intervalo_keepalive = segundos
+            else:
+                configuracao.tempo_limite = segundos
+                
+        elif chave == 'CACHE_ROTAS':
+            if valor:
+                configuracao.arquivo_cache_rotas = valor
+            else:
+                erros.append(f"Linha de cache de rotas inválida: {linha}")
+                
+        elif chave in ('REDE', 'AGREGAR'):
+            prefixo = parsear_prefixo(valor)
+            if chave == 'REDE' and prefixo is not None:
+                configuracao.redes.append(formatar_prefixo(*prefixo))
+            elif chave == 'AGREGAR' and prefixo is not None and prefixo[1] < 32:
+                if prefixo not in configuracao.resumos:
+                    configuracao.resumos.append(prefixo)
+            else:
+                erros.append(f"Prefixo de {'rede' if chave == 'REDE' else 'resumo'} inválido: {linha}")
+                
+        elif chave == 'ROTEAMENTO':
+            if valor.lower() in MOTORES_ROTEAMENTO:
+                configuracao.roteamento = valor.lower()
+            else:
+                erros.append(f"Motor de roteamento inválido: {linha}")
+                
+        elif chave == 'HORIZONTE':
+            if valor.lower() in MODOS_HORIZONTE:
+                configuracao.modo_horizonte = valor.lower()
+            else:
+                erros.append(f"Modo de horizonte inválido: {linha}")
+                
+        elif chave == 'INFINITO':
+            try:
+                metrica_infinita = int(valor)
+                if not 2 <= metrica_infinita <= 255:
+                    raise ValueError
+                configuracao.metrica_infinita = metrica_infinita
+            except ValueError:
+                erros.append(f"Linha de métrica infinita inválida: {linha}")
+                
+        elif chave == 'JANELA_TRANSFERENCIA':
+            try:
+                janela = int(valor)
+                if not 1 <= janela <= MAXIMO_JANELA_TRANSFERENCIA:
+                    raise ValueError
+                configuracao.janela_transferencia = janela
+            except ValueError:
+                erros.append(f"Linha de janela de transferência inválida: {linha}")
+                
+        else:
+            erros.append(f"Chave de configuração desconhecida: {linha}")
+    return configuracao
+
+
+class MotorRoteamento:
+    """Algoritmo que preenche a tabela do roteador. O Roteador cuida dos
+    vizinhos ('@', '&', prazos de falha) e avisa o motor pelos métodos
+    abaixo; o motor recebe as demais mensagens de controle."""
+    
+    nome = ''
+    
+    def __init__(self, roteador: 'Roteador'):
+        self.roteador = roteador
+        
+    def iniciar(self):
+        """Chamado depois do anúncio de entrada na rede."""
+        
+    def vizinho_ativo(self, vizinho: str, responder: bool):
+        """Chegou '@' (ou keepalive agrupado) do vizinho."""
+        
+    def vizinhos_inativos(self, vizinhos: List[str]):
+        """Vizinhos que expiraram sem mensagens."""
+        
+    def vizinho_adicionado(self, vizinho: str):
+        """Vizinho novo incluído pela recarga da configuração."""
+        
+    def redes_locais_alteradas(self):
+        pass
+        
+    def rotas_removidas(self):
+        """Rotas removidas fora do motor (cache de rotas não confirmado)."""
+        
+    def anuncios_alterados(self):
+        """Horizonte, métrica infinita ou resumos mudaram na recarga."""
+        
+    def tratar_mensagem(self, data: bytes, ip_remetente: str):
+        """Mensagens que não são '!', '@' nem '&'."""
+        
+    def enviar_keepalive(self):
+        r = self.roteador
+        envios = []
+        for vizinho in list(r.vizinhos):
+            destino = (vizinho, r.portas_vizinhos.get(vizinho, r.porta))
+            envios.append((r.mensagem_anuncio, destino))
+            envios.append((r.mensagem_capacidades, destino))
+        r._enviar_lote(envios)
+
+
+class MotorVetorDistancia(MotorRoteamento):
+    """Vetor de distância (padrão): tabelas completas e deltas '*', '%' e
+    binários, com horizonte dividido."""
+    
+    nome = 'vetor'
+    
+    def vizinho_ativo(self, vizinho: str, responder: bool):
+        self.roteador._anuncio_vetor_distancia(vizinho, responder)
+        
+    def vizinhos_inativos(self, vizinhos: List[str]):
+        self.roteador._falhas_vetor_distancia(vizinhos)
+        
+    def iniciar(self):
+        # Reinício com rotas do cache: os vizinhos as recebem já na entrada
+        if self.roteador.rotas_obsoletas:
+            self.roteador.enviar_tabela_roteamento()
+            
+    def vizinho_adicionado(self, vizinho: str):
+        self.roteador._enviar_tabela_para_vizinho(vizinho)
+        self.roteador.agendar_atualizacao_disparada()
+        
+    def redes_locais_alteradas(self):
+        self.roteador.agendar_atualizacao_disparada()
+        
+    def rotas_removidas(self):
+        self.roteador.agendar_atualizacao_disparada()
+        
+    def anuncios_alterados(self):
+        # Cada vizinho passa a ver outra tabela: vai a completa
+        self.roteador.enviar_tabela_roteamento()
+        
+    def tratar_mensagem(self, data: bytes, ip_remetente: str):
+        r = self.roteador
+        if data[:1] == bytes([MARCADOR_BINARIO]):
+            r.processar_mensagem_binaria(data, ip_remetente)
+            return
+        try:
+            mensagem = data.decode('utf-8')
+        except UnicodeDecodeError:
+            r.contador_falhas_parse.incrementar(tipo_mensagem(data))
+            return
+        if mensagem.startswith('*'):
+            r.processar_mensagem_rotas(mensagem, ip_remetente)
+        elif mensagem.startswith('%'):
+            r.processar_atualizacao_incremental(mensagem, ip_remetente)
+            
+    def enviar_keepalive(self):
+        self.roteador._enviar_keepalive_vetor_distancia()
+
+
+class MotorEstadoEnlace(MotorRoteamento):
+    """Estado de enlace: cada roteador inunda um LSA com os vizinhos ativos
+    e as redes locais, e as rotas saem do menor caminho sobre o grafo
+    montado com os LSAs de todos (ver estado_enlace.py). Todos os
+    roteadores da rede precisam usar este motor."""
+    
+    nome = 'enlace'
+    
+    def __init__(self, roteador: 'Roteador'):
+        super().__init__(roteador)
+        self.banco = BancoEstadoEnlace(roteador.ip_roteador)
+        self.sequencia = 0
+        self.calculo_agendado = None
+        self.originacao_agendada = None
+        self.keepalives_desde_lsa = 0
+        
+    def _originar(self) -> Lsa:
+        """Novo LSA próprio, com os vizinhos ativos e as redes locais. Deve
+        ser chamado com o lock do roteador adquirido."""
+        r = self.roteador
+        vizinhos = {vizinho: 1 for vizinho in r.monitor_vizinhos.ultima_mensagem}
+        prefixos = {destino: metrica for destino, metrica, saida in r.tabela.obter_rotas_com_saida()
+                    if saida == r.ip_roteador}
+        # Milissegundos do relógio de parede: um roteador reiniciado volta
+        # com sequência maior que a dos LSAs antigos ainda em circulação
+        self.sequencia = max(self.sequencia + 1, int(time.time() * 1000))
+        dados = codificar_lsa(r.ip_roteador, self.sequencia, vizinhos, prefixos)
+        lsa = Lsa(r.ip_roteador, self.sequencia, vizinhos, prefixos, dados, r.relogio())
+        self.banco.instalar(lsa)
+        self.keepalives_desde_lsa = 0
+        return lsa
+        
+    def originar(self):
+        r = self.roteador
+        with r.lock:
+            self.originacao_agendada = None
+            lsa = self._originar()
+        self._inundar(lsa.dados, None)
+        self.agendar_calculo()
+        
+    def agendar_originacao(self):
+        """Vizinhos descobertos juntos (subida da rede) geram um só LSA."""
+        r = self.roteador
+        with r.lock:
+            if self.originacao_agendada is not None:
+                return
+            self.originacao_agendada = r._agendar(ATRASO_CALCULO_ROTAS, self.originar)
+        
+    def _inundar(self, dados: bytes, exceto: Optional[str]):
+        r = self.roteador
+        r._enviar_lote([(dados, (vizinho, r.portas_vizinhos.get(vizinho, r.porta)))
+                        for vizinho in list(r.vizinhos) if vizinho != exceto])
+        
+    def _enviar_banco(self, vizinho: str):
+        r = self.roteador
+        with r.lock:
+            lsas = [lsa.dados for lsa in self.banco.lsas.values()]
+        destino = (vizinho, r.portas_vizinhos.get(vizinho, r.porta))
+        r._enviar_lote([(dados, destino) for dados in lsas])
+        
+    def iniciar(self):
+        self.originar()
+        r = self.roteador
+        r._enviar_lote([(PEDIDO_SINCRONIZACAO, (vizinho, r.portas_vizinhos.get(vizinho, r.porta)))
+                        for vizinho in list(r.vizinhos)])
+        
+    def vizinho_ativo(self, vizinho: str, responder: bool):
+        propria = self.banco.lsas.get(self.roteador.ip_roteador)
+        if propria is None or vizinho not in propria.vizinhos:
+            self.agendar_originacao()
+            self._enviar_banco(vizinho)
+            
+    def vizinhos_inativos(self, vizinhos: List[str]):
+        self.agendar_originacao()
+        
+    def vizinho_adicionado(self, vizinho: str):
+        self.agendar_originacao()
+        self._enviar_banco(vizinho)
+        
+    def redes_locais_alteradas(self):
+        if self.roteador.rodando:
+            self.agendar_originacao()
+            
+    def tratar_mensagem(self, data: bytes, ip_remetente: str):
+        r = self.roteador
+        if data[:1] != PREFIXO_LSA:
+            return
+        if data == PEDIDO_SINCRONIZACAO:
+            self._enviar_banco(ip_remetente)
+            return
+        try:
+            origem, sequencia, vizinhos, prefixos = decodificar_lsa(data)
+        except (ValueError, UnicodeDecodeError) as e:
+            r.contador_falhas_parse.incrementar('$')
+            r.registro.aviso('ERRO', "LSA inválido de {vizinho}: {erro}", vizinho=ip_remetente, erro=e)
+            return
+            
+        if origem == r.ip_roteador:
+            # LSA de uma execução anterior deste roteador: supera com um novo
+            if sequencia > self.sequencia:
+                r.contador_lsas.incrementar('próprio')
+                with r.lock:
+                    self.sequencia = sequencia
+                self.originar()
+            return
+            
+        with r.lock:
+            lsa = Lsa(origem, sequencia, vizinhos, prefixos, bytes(data), r.relogio())
+            instalado = self.banco.instalar(lsa)
+            conhecido = self.banco.lsas.get(origem)
+        if instalado:
+            r.contador_lsas.incrementar('novo')
+            self._inundar(lsa.dados, ip_remetente)
+            self.agendar_calculo()
+        elif conhecido.sequencia > sequencia:
+            # O vizinho tem uma cópia antiga: recebe a atual
+            r.contador_lsas.incrementar('antigo')
+            r._enviar_lote([(conhecido.dados, (ip_remetente, r.portas_vizinhos.get(ip_remetente, r.porta)))])
+        else:
+            r.contador_lsas.incrementar('repetido')
+            
+    def agendar_calculo(self):
+        """LSAs recebidos em sequência (inundação, sincronização) geram um só
+        cálculo."""
+        r = self.roteador
+        with r.lock:
+            if self.calculo_agendado is not None:
+                return
+            self.calculo_agendado = r._agendar(ATRASO_CALCULO_ROTAS, self.calcular_rotas)
+            
+    def calcular_rotas(self):
+        r = self.roteador
+        alteradas = 0
+        with r._alterando_tabela():
+            self.calculo_agendado = None
+            inicio = time.perf_counter()
+            if not self.banco.calcular():
+                return
+            novas = self.banco.rotas()
+            for destino, metrica, saida in r.tabela.obter_rotas_com_saida():
+                # Rotas do cache em disco esperam o banco se completar
+                if saida != r.ip_roteador and destino not in novas and destino not in r.rotas_obsoletas:
+                    r.tabela.remover_rota(destino)
+                    alteradas += 1
+            r.rotas_obsoletas.difference_update(novas)
+            for destino, (metrica, saida) in novas.items():
+                atual = r.tabela.obter_rota(destino)
+                if destino == r.ip_roteador or (atual is not None and atual[1] == r.ip_roteador):
+                    continue
+                if metrica >= r.metrica_infinita:
+                    if atual is not None:
+                        r.tabela.remover_rota(destino)
+                        alteradas += 1
+                elif atual != (metrica, saida):
+                    r.tabela.adicionar_rota(destino, metrica, saida)
+                    alteradas += 1
+            # Não há deltas de vetor de distância a enviar
+            r.tabela.alteracoes.clear()
+            r.histograma_spf.observar(time.perf_counter() - inicio)
+        if alteradas:
+            r.registro.info('SPF', "{quantidade} rotas alteradas pelo menor caminho", quantidade=alteradas)
+            r._registrar_tabela("Tabela atualizada pelo estado de enlace")
+            
+    def enviar_keepalive(self):
+        super().enviar_keepalive()
+        r = self.roteador
+        self.keepalives_desde_lsa += 1
+        if self.keepalives_desde_lsa >= KEEPALIVES_POR_RENOVACAO_LSA:
+            self.originar()
+        with r.lock:
+            expirados = self.banco.expirar(r.relogio() - IDADE_MAXIMA_LSA * r.intervalo_keepalive)
+        if expirados:
+            self.agendar_calculo()
+
+
+MOTORES_ROTEAMENTO = {motor.nome: motor for motor in (MotorVetorDistancia, MotorEstadoEnlace)}
+
+
 class Roteador:
     
     def __init__(self, ip_roteador: str, porta: int = 6000):
         self.ip_roteador = ip_roteador
         self.porta = porta
+        # Porta da linha de comando, que vale quando PORTA= não está no arquivo
+        self.porta_padrao = porta
         self.tabela = TabelaRoteamento(ip_roteador)
         self.vizinhos: List[str] = []
         self.portas_vizinhos: Dict[str, int] = {}
         
-        self.ultima_mensagem_vizinho: Dict[str, datetime] = {}
+        self.intervalo_keepalive = INTERVALO_KEEPALIVE
+        self.monitor_vizinhos = MonitorVizinhos(TEMPO_LIMITE_VIZINHO)
+        # Acorda a verificação de falhas quando surge um prazo novo
+        self.evento_prazos = threading.Event()
         
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind((self.ip_roteador, self.porta))
-        self.socket.settimeout(1.0)
+        # Relógio monotônico usado nos prazos (substituível em simulações)
+        self.relogio: Callable[[], float] = time.monotonic
+        
+        self.socket = self._criar_socket()
         
         self.rodando = False
         self.rede_existente = False
         
-        self.lock = threading.Lock()
+        self.metricas = Metricas()
+        self.registro = Registro()
+        # Dumps da tabela inteira após cada alteração (LOG_TABELAS=)
+        self.exibir_tabelas = True
+        self._criar_metricas()
+        # Porta TCP da consulta de métricas (METRICAS= no arquivo de configuração)
+        self.porta_metricas: Optional[int] = None
+        
+        self.lock = LockMedido(threading.Lock(), self.histograma_espera_lock, self.histograma_retencao_lock)
+        
+        self.mensagem_anuncio = f"@{self.ip_roteador}".encode('utf-8')
+        self.mensagem_capacidades = (f"&{VERSAO_BINARIA},{VERSAO_BINARIA_PREFIXOS},"
+                                     f"{VERSAO_KEEPALIVE_AGRUPADO}").encode('utf-8')
+        self.modo_horizonte = HORIZONTE_POISON
+        self.metrica_infinita = METRICA_INFINITA
+        self.cache_anuncios = CacheAnuncios(
+            self.tabela,
+            lambda rotas, formato: self._codificar_rotas(rotas, formato, TIPO_TABELA_COMPLETA),
+            self.modo_horizonte, self.metrica_infinita)
+        # Formato negociado com cada vizinho (texto até receber '&') e o
+        # instante do último '&'; sem renovação o vizinho volta ao texto
+        self.formato_vizinho: Dict[str, str] = {}
+        self.capacidades_vizinho: Dict[str, float] = {}
+        # Vizinhos que recebem o keepalive agrupado na tabela binária
+        self.keepalive_agrupado: Set[str] = set()
+        
+        # Buffer de recepção reaproveitado por todos os datagramas
+        self.buffer_recepcao = bytearray(TAMANHO_BUFFER_RECEPCAO)
+        self.visao_recepcao = memoryview(self.buffer_recepcao)
+        # Tabelas binárias em várias partes: remetente -> (id, partes recebidas, IPs anunciados)
+        self.recepcao_binaria: Dict[str, Tuple[int, Set[int], Set[str]]] = {}
+        
+        # Atualizações disparadas: alterações são agrupadas por este intervalo
+        # antes de serem enviadas aos vizinhos apenas como delta
+        self.intervalo_atualizacao_disparada = 1.0
+        self.atualizacao_agendada = None
+        
+        # Encaminhamento de '!': destino (bytes crus) -> (próximo salto, porta),
+        # preenchido sob demanda e válido só para o instantâneo da tabela ao
+        # lado (também é descartado quando as portas mudam)
+        self.encaminhamento: Tuple[Optional[InstantaneoTabela], Dict[bytes, Tuple[str, int]]] = (None, {})
+        
+        # Cópia da tabela em disco para reinícios (CACHE_ROTAS=). Rotas
+        # carregadas dela ficam obsoletas até o próximo salto confirmá-las
+        self.arquivo_cache_rotas: Optional[str] = None
+        self.versao_cache_rotas = -1
+        self.instante_cache_rotas = 0.0
+        self.rotas_obsoletas: Set[str] = set()
+        # Keepalive e encerramento gravam o cache: um por vez
+        self.trava_cache_rotas = threading.Lock()
+        self.tabela.observadores.append(lambda destino, *_: self.rotas_obsoletas.discard(destino))
+        
+        # Algoritmo de roteamento (ROTEAMENTO= no arquivo de configuração)
+        self.motor: MotorRoteamento = MotorVetorDistancia(self)
+        
+        # Relido pelo comando recarregar (ou SIGHUP). Vizinhos configurados
+        # (IP -> porta) e os retirados do arquivo, ignorados até voltarem
+        self.arquivo_configuracao = "roteadores.txt"
+        self.vizinhos_configurados: Dict[str, int] = {}
+        self.vizinhos_desativados: Set[str] = set()
+        self.trava_recarga = threading.Lock()
+        
+        # Arquivos enviados e recebidos pelas mensagens '!' (enviar-arquivo)
+        self.transferencias = GerenciadorTransferencias(self)
         
     def carregar_configuracao(self, arquivo: str = "roteadores.txt"):
         try:
-            with open(arquivo, 'r') as f:
-                for linha in f:
-                    linha = linha.strip()
-                    if linha.startswith('#'):
-                        continue
-                    
-                    if linha.upper().startswith('PORTA='):
-                        try:
-                            porta_config = int(linha.split('=')[1].split('#')[0].strip())
-                            self.porta = porta_config
-                            self.socket.close()
-                            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                            self.socket.bind((self.ip_roteador, self.porta))
-                            self.socket.settimeout(1.0)
-                            print(f"[CONFIG] Porta configurada: {self.porta}")
-                        except (ValueError, IndexError):
-                            print(f"[AVISO] Linha de porta inválida: {linha}")
-                        continue
-                    
-                    linha = linha.split('#')[0].strip()
-                    if not linha:
-                        continue
-                    
-                    if ':' in linha:
-                        partes = linha.split(':')
-                        if len(partes) == 2:
-                            ip, porta_str = partes
-                            ip = ip.strip()
-                            try:
-                                porta_vizinho = int(porta_str.strip())
-                                if ip and ip != self.ip_roteador:
-                                    self.vizinhos.append(ip)
-                                    self.portas_vizinhos[ip] = porta_vizinho
-                                    self.tabela.adicionar_rota(ip, 1, ip)
-                                    self.ultima_mensagem_vizinho[ip] = datetime.now()
-                            except ValueError:
-                                print(f"[AVISO] Porta inválida para {ip}: {porta_str}")
-                        else:
-                            if linha and linha != self.ip_roteador:
-                                self.vizinhos.append(linha)
-                                self.portas_vizinhos[linha] = self.porta
-                                self.tabela.adicionar_rota(linha, 1, linha)
-                                self.ultima_mensagem_vizinho[linha] = datetime.now()
-                    else:
-                        if linha and linha != self.ip_roteador:
-                            self.vizinhos.append(linha)
-                            self.portas_vizinhos[linha] = self.porta
-                            self.tabela.adicionar_rota(linha, 1, linha)
-                            self.ultima_mensagem_vizinho[linha] = datetime.now()
-                            
-            print(f"[INIT] Roteador {self.ip_roteador} inicializado na porta {self.porta}")
-            print(f"[INIT] Vizinhos diretos: {', '.join(self.vizinhos)}")
-            if self.portas_vizinhos and any(p != self.porta for p in self.portas_vizinhos.values()):
-                print(f"[INIT] Portas dos vizinhos: {dict(self.portas_vizinhos)}")
-            print(f"[INIT] Tabela inicial:")
-            print(self.tabela.formatar_para_exibicao())
+            configuracao = ler_configuracao(arquivo, self.ip_roteador)
         except FileNotFoundError:
-            print(f"[ERRO] Arquivo {arquivo} não encontrado!")
+            self.registro.erro('ERRO', f"Arquivo {arquivo} não encontrado!")
+            self.registro.encerrar()
             sys.exit(1)
         except Exception as e:
-            print(f"[ERRO] Erro ao carregar configuração: {e}")
+            self.registro.erro('ERRO', f"Erro ao carregar configuração: {e}")
+            self.registro.encerrar()
             sys.exit(1)
+        self.arquivo_configuracao = arquivo
+        
+        try:
+            # Na partida as linhas inválidas são só avisadas
+            self._aplicar_registro(configuracao, 'CONFIG')
+            for erro in configuracao.erros:
+                self.registro.aviso('AVISO', erro)
+            if configuracao.porta_metricas is not None:
+                self.porta_metricas = configuracao.porta_metricas
+                self.registro.info('CONFIG', f"Métricas em {self.ip_roteador}:{self.porta_metricas}")
+            if configuracao.arquivo_cache_rotas is not None:
+                self.arquivo_cache_rotas = configuracao.arquivo_cache_rotas
+                self.registro.info('CONFIG', f"Cache de rotas: {self.arquivo_cache_rotas}")
+            if configuracao.porta is not None:
+                self.porta = configuracao.porta
+                self.socket.close()
+                self.socket = self._criar_socket()
+                self.registro.info('CONFIG', f"Porta configurada: {self.porta}")
+            self._aplicar_intervalos(configuracao, 'CONFIG')
+            self._aplicar_janela_transferencia(configuracao, 'CONFIG')
+            if configuracao.roteamento is not None:
+                self.definir_motor(configuracao.roteamento)
+                self.registro.info('CONFIG', f"Roteamento: {configuracao.roteamento}")
+            self._aplicar_horizonte(configuracao, 'CONFIG')
+            for resumo in configuracao.resumos:
+                with self.lock:
+                    self.cache_anuncios.adicionar_resumo(resumo)
+                self.registro.info('CONFIG', f"Resumo anunciado: {formatar_prefixo(*resumo)}")
+            for prefixo in configuracao.redes:
+                self.adicionar_rede_local(prefixo)
+                self.registro.info('CONFIG', f"Rede local: {prefixo}")
+            for ip, porta_vizinho in configuracao.vizinhos.items():
+                self.adicionar_vizinho(ip, porta_vizinho if porta_vizinho is not None else self.porta)
+            self.vizinhos_configurados = {ip: self.portas_vizinhos[ip] for ip in configuracao.vizinhos}
+                            
+            if self.arquivo_cache_rotas is not None:
+                self.carregar_cache_rotas()
+            self.registro.info('INIT', f"Roteador {self.ip_roteador} inicializado na porta {self.porta}")
+            self.registro.info('INIT', f"Vizinhos diretos: {', '.join(self.vizinhos)}")
+            if self.portas_vizinhos and any(p != self.porta for p in self.portas_vizinhos.values()):
+                self.registro.info('INIT', f"Portas dos vizinhos: {dict(self.portas_vizinhos)}")
+            self.registro.info('TABELA', formatar_dump_tabela, titulo="Tabela inicial",
+                               rotas=self.tabela.atual.listar())
+        except Exception as e:
+            self.registro.erro('ERRO', f"Erro ao carregar configuração: {e}")
+            self.registro.encerrar()
+            sys.exit(1)
+            
+    def _aplicar_registro(self, configuracao: Configuracao, tipo: str):
+        for chave, valor, atual in (('LOG_NIVEL', configuracao.nivel_registro, NOMES_NIVEIS[self.registro.nivel]),
+                                    ('LOG_FORMATO', configuracao.formato_registro, self.registro.formato),
+                                    ('LOG_TABELAS', configuracao.exibir_tabelas, self.exibir_tabelas)):
+            if valor is None or valor == atual:
+                continue
+            if chave == 'LOG_NIVEL':
+                self.registro.nivel = NIVEIS[valor]
+            elif chave == 'LOG_FORMATO':
+                self.registro.formato = valor
+            else:
+                self.exibir_tabelas = valor
+                valor = 'sim' if valor else 'nao'
+            self.registro.info(tipo, f"Registro: {chave}={valor}")
+            
+    def _aplicar_intervalos(self, configuracao: Configuracao, tipo: str):
+        if configuracao.intervalo_keepalive not in (None, self.intervalo_keepalive):
+            self.intervalo_keepalive = configuracao.intervalo_keepalive
+            self.registro.info(tipo, f"Intervalo de keepalive: {self.intervalo_keepalive}s")
+        if configuracao.tempo_limite not in (None, self.monitor_vizinhos.tempo_limite):
+            self.monitor_vizinhos.tempo_limite = configuracao.tempo_limite
+            self.registro.info(tipo, f"Tempo limite de vizinho: {configuracao.tempo_limite}s")
+            
+    def _aplicar_janela_transferencia(self, configuracao: Configuracao, tipo: str):
+        # Vale para as transferências iniciadas em seguida
+        if configuracao.janela_transferencia not in (None, self.transferencias.janela):
+            self.transferencias.janela = configuracao.janela_transferencia
+            self.registro.info(tipo, f"Janela de transferência: {configuracao.janela_transferencia} segmentos")
+            
+    def _aplicar_horizonte(self, configuracao: Configuracao, tipo: str) -> bool:
+        """Retorna se o modo ou a métrica infinita mudaram."""
+        modo = configuracao.modo_horizonte or self.modo_horizonte
+        metrica_infinita = configuracao.metrica_infinita or self.metrica_infinita
+        if (modo, metrica_infinita) == (self.modo_horizonte, self.metrica_infinita):
+            return False
+        if modo != self.modo_horizonte:
+            self.registro.info(tipo, f"Horizonte: {modo}")
+        if metrica_infinita != self.metrica_infinita:
+            self.registro.info(tipo, f"Métrica infinita: {metrica_infinita}")
+        self.definir_horizonte(modo, metrica_infinita)
+        return True
+        
+    def recarregar_configuracao(self) -> bool:
+        with self.trava_recarga:
+            return self._recarregar_configuracao()
+            
+    def _recarregar_configuracao(self) -> bool:
+        """Relê o arquivo de configuração e aplica só o que mudou, sem reabrir
+        o socket nem limpar a tabela: vizinhos e redes locais novos ou
+        removidos geram uma atualização disparada só com essas rotas. Um
+        arquivo com qualquer linha inválida é rejeitado inteiro. O arquivo
+        vale inteiro: chaves ausentes voltam ao valor padrão."""
+        arquivo = self.arquivo_configuracao
+        try:
+            configuracao = ler_configuracao(arquivo, self.ip_roteador)
+        except (OSError, UnicodeDecodeError) as e:
+            self.registro.erro('RECARGA', f"Não foi possível ler {arquivo}: {e}")
+            return False
+        if configuracao.erros:
+            for erro in configuracao.erros:
+                self.registro.erro('RECARGA', erro)
+            self.registro.erro('RECARGA', f"{arquivo} rejeitado ({len(configuracao.erros)} linhas inválidas); "
+                                          "nada foi alterado")
+            return False
+        configuracao.preencher_padroes(self.porta_padrao)
+            
+        # Exigem reiniciar: o socket e a porta de métricas não são reabertos
+        if configuracao.porta != self.porta:
+            self.registro.aviso('RECARGA', f"PORTA={configuracao.porta} ignorada até reiniciar o roteador")
+        if configuracao.porta_metricas is None and self.porta_metricas is not None:
+            self.registro.aviso('RECARGA', "METRICAS= retirada; as métricas seguem ativas até reiniciar o roteador")
+        elif configuracao.porta_metricas != self.porta_metricas:
+            self.registro.aviso('RECARGA', f"METRICAS={configuracao.porta_metricas} ignorada até reiniciar o roteador")
+        if configuracao.roteamento != self.motor.nome:
+            self.registro.aviso('RECARGA', f"ROTEAMENTO={configuracao.roteamento} ignorado até reiniciar o roteador")
+            
+        self._aplicar_registro(configuracao, 'RECARGA')
+        self._aplicar_intervalos(configuracao, 'RECARGA')
+        self._aplicar_janela_transferencia(configuracao, 'RECARGA')
+        if configuracao.arquivo_cache_rotas != self.arquivo_cache_rotas:
+            # Sem CACHE_ROTAS= o cache deixa de ser gravado
+            self.arquivo_cache_rotas = configuracao.arquivo_cache_rotas
+            self.versao_cache_rotas = -1
+            self.registro.info('RECARGA', f"Cache de rotas: {self.arquivo_cache_rotas or 'desativado'}")
+            
+        anuncios_alterados = self._aplicar_horizonte(configuracao, 'RECARGA')
+        if set(configuracao.resumos) != set(self.cache_anuncios.resumos):
+            with self.lock:
+                self.cache_anuncios.definir_resumos(configuracao.resumos)
+            self.registro.info('RECARGA', "Resumos anunciados: {resumos}",
+                               resumos=", ".join(formatar_prefixo(*resumo) for resumo in configuracao.resumos) or "-")
+            anuncios_alterados = True
+            
+        redes_atuais = {destino for destino, metrica, saida in self.tabela.atual.obter_rotas_com_saida()
+                        if saida == self.ip_roteador and metrica == 0}
+        for prefixo in configuracao.redes:
+            if prefixo not in redes_atuais:
+                self.adicionar_rede_local(prefixo)
+                self.registro.info('RECARGA', f"Rede local adicionada: {prefixo}")
+        for prefixo in redes_atuais - set(configuracao.redes):
+            self.remover_rede_local(prefixo)
+            self.registro.info('RECARGA', f"Rede local removida: {prefixo}")
+            
+        novos = {ip: porta_vizinho if porta_vizinho is not None else self.porta
+                 for ip, porta_vizinho in configuracao.vizinhos.items()}
+        for ip in set(self.vizinhos_configurados) - set(novos):
+            self.remover_vizinho(ip)
+            self.registro.info('RECARGA', f"Vizinho removido: {ip}")
+        for ip, porta_vizinho in novos.items():
+            if ip not in self.vizinhos:
+                self.vizinhos_desativados.discard(ip)
+                self.adicionar_vizinho(ip, porta_vizinho)
+                self._anunciar([ip])
+                self.motor.vizinho_adicionado(ip)
+                self.registro.info('RECARGA', f"Vizinho adicionado: {ip}:{porta_vizinho}")
+            elif ip not in self.vizinhos_configurados:
+                # Já era vizinho por ter enviado '@'; a porta observada vale
+                self.registro.info('RECARGA', f"Vizinho adicionado: {ip} (já ativo)")
+            elif self.vizinhos_configurados[ip] != porta_vizinho:
+                with self.lock:
+                    self.portas_vizinhos[ip] = porta_vizinho
+                    self._invalidar_encaminhamento()
+                self.registro.info('RECARGA', f"Porta do vizinho {ip}: {porta_vizinho}")
+        self.vizinhos_configurados = novos
+        
+        if anuncios_alterados:
+            self.motor.anuncios_alterados()
+        self.registro.info('RECARGA', f"Configuração de {arquivo} aplicada")
+        return True
+        
+    def carregar_cache_rotas(self):
+        """Pré-carrega as rotas gravadas antes do reinício como obsoletas: já
+        servem para encaminhar, mas são removidas se o próximo salto não as
+        confirmar em um tempo limite de vizinho após a entrada na rede."""
+        try:
+            with open(self.arquivo_cache_rotas, 'rb') as f:
+                instante, rotas = decodificar_cache_rotas(f.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.registro.aviso('AVISO', f"Cache de rotas ignorado: {e}")
+            return
+        idade = time.time() - instante
+        if idade > IDADE_MAXIMA_CACHE_ROTAS:
+            self.registro.info('CACHE', f"Cache de rotas ignorado (gravado há {idade:.0f}s)")
+            return
+        with self._alterando_tabela():
+            for destino, metrica, saida in rotas:
+                # Só rotas por vizinhos configurados e ainda sem rota (as dos
+                # vizinhos e redes locais já vêm da configuração)
+                if saida in self.vizinhos and destino != self.ip_roteador and self.tabela.obter_rota(destino) is None:
+                    self.tabela.adicionar_rota(destino, metrica, saida)
+                    self.rotas_obsoletas.add(destino)
+        self.registro.info('CACHE', "{quantidade} rotas carregadas do cache (gravado há {idade:.0f}s)",
+                           quantidade=len(self.rotas_obsoletas), idade=idade)
+        
+    def gravar_cache_rotas(self):
+        """Grava o instantâneo atual se ele mudou ou se o arquivo está perto
+        de ficar velho demais para ser usado."""
+        with self.trava_cache_rotas:
+            arquivo = self.arquivo_cache_rotas
+            if arquivo is None:
+                return
+            instantaneo = self.tabela.atual
+            if (instantaneo.versao == self.versao_cache_rotas and
+                    time.time() - self.instante_cache_rotas < IDADE_MAXIMA_CACHE_ROTAS / 4):
+                return
+            rotas = [rota for rota in instantaneo.obter_rotas_com_saida() if rota[2] != self.ip_roteador]
+            instante = time.time()
+            try:
+                gravar_arquivo_atomico(arquivo, codificar_cache_rotas(rotas, instante))
+            except OSError as e:
+                self.registro.erro('ERRO', f"Erro ao gravar o cache de rotas: {e}")
+                return
+            self.versao_cache_rotas = instantaneo.versao
+            self.instante_cache_rotas = instante
+        
+    def _revalidar_rotas_obsoletas(self, vizinho: str):
+        """A tabela completa do vizinho já confirmou (ou removeu) as rotas
+        obsoletas via ele. Deve ser chamado com self.lock adquirido."""
+        confirmadas = [destino for destino in self.rotas_obsoletas if self.tabela.rotas[destino][1] == vizinho]
+        self.rotas_obsoletas.difference_update(confirmadas)
+        
+    def _expirar_rotas_obsoletas(self):
+        with self._alterando_tabela():
+            obsoletas = list(self.rotas_obsoletas)
+            for destino in obsoletas:
+                self.tabela.remover_rota(destino)
+        if obsoletas:
+            self.registro.info('CACHE', "{quantidade} rotas do cache não confirmadas foram removidas",
+                               quantidade=len(obsoletas))
+            self._registrar_tabela("Tabela atualizada após remoção de rotas")
+            self.motor.rotas_removidas()
+            
+    def _criar_metricas(self):
+        m = self.metricas
+        self.trafego_recebido = m.trafego(
+            'roteador_recebidos', 'Datagramas recebidos', ('tipo', 'vizinho'))
+        self.trafego_enviado = m.trafego(
+            'roteador_enviados', 'Datagramas enviados', ('tipo', 'vizinho'))
+        self.contador_falhas_parse = m.contador(
+            'roteador_falhas_parse_total', 'Mensagens ou entradas que não puderam ser interpretadas', ('tipo',))
+        self.contador_alteracoes_rotas = m.contador(
+            'roteador_alteracoes_rotas_total', 'Rotas adicionadas, alteradas ou removidas')
+        self.contador_descartes = m.contador(
+            'roteador_mensagens_descartadas_total', 'Mensagens ! descartadas', ('motivo',))
+        self.histograma_tratadores = m.histograma(
+            'roteador_tratador_segundos', 'Tempo de processamento dos datagramas de controle', ('tipo',))
+        self.histograma_encaminhamento = m.histograma(
+            'roteador_encaminhamento_segundos', 'Tempo entre tratar e reenviar uma mensagem ! em trânsito')
+        self.histograma_espera_lock = m.histograma(
+            'roteador_lock_espera_segundos', 'Tempo de espera para adquirir o lock da tabela')
+        self.histograma_retencao_lock = m.histograma(
+            'roteador_lock_retencao_segundos', 'Tempo em que o lock da tabela ficou retido')
+        # Só usados pelo motor de estado de enlace
+        self.histograma_spf = m.histograma(
+            'roteador_spf_segundos', 'Tempo de cada cálculo de menor caminho')
+        self.contador_lsas = m.contador(
+            'roteador_lsas_total', 'LSAs recebidos', ('resultado',))
+        m.medidor('roteador_rotas', 'Entradas na tabela de roteamento', lambda: len(self.tabela.atual.rotas))
+        m.medidor('roteador_tabela_versao', 'Versão do instantâneo publicado da tabela',
+                  lambda: self.tabela.atual.versao)
+        m.medidor('roteador_rotas_obsoletas', 'Rotas do cache em disco ainda não confirmadas',
+                  lambda: len(self.rotas_obsoletas))
+        m.medidor('roteador_vizinhos', 'Vizinhos diretos conhecidos', lambda: len(self.vizinhos))
+        self.tabela.observadores.append(lambda *_: self.contador_alteracoes_rotas.incrementar())
+        
+    def _criar_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.ip_roteador, self.porta))
+        # Não bloqueante: a recepção espera com select e drena a fila inteira.
+        # Os envios esperam o buffer esvaziar (enviar_datagrama)
+        sock.setblocking(False)
+        return sock
+        
+    @contextlib.contextmanager
+    def _alterando_tabela(self):
+        """Seção de escrita na tabela: serializa os escritores pelo lock e, ao
+        sair, publica o lote de alterações como um novo instantâneo."""
+        with self.lock:
+            try:
+                yield
+            finally:
+                self.tabela.publicar()
+                
+    def adicionar_vizinho(self, ip: str, porta: int):
+        with self._alterando_tabela():
+            self.vizinhos.append(ip)
+            self.portas_vizinhos[ip] = porta
+            self._invalidar_encaminhamento()
+            self.tabela.adicionar_rota(ip, 1, ip)
+            self._renovar_vizinho(ip)
+            
+    def adicionar_rede_local(self, prefixo: str):
+        """Rede diretamente conectada a este roteador: métrica 0 e saída
+        pelo próprio roteador (mensagens para ela chegam ao destino aqui)."""
+        with self._alterando_tabela():
+            self.tabela.adicionar_rota(prefixo, 0, self.ip_roteador)
+        self.motor.redes_locais_alteradas()
+        
+    def remover_rede_local(self, prefixo: str):
+        with self._alterando_tabela():
+            rota = self.tabela.obter_rota(prefixo)
+            if rota is not None and rota[1] == self.ip_roteador:
+                self.tabela.remover_rota(prefixo)
+        self.motor.redes_locais_alteradas()
+        
+    def remover_vizinho(self, ip: str):
+        """Retira um vizinho da configuração: as rotas por ele somem e as
+        mensagens de controle dele passam a ser ignoradas."""
+        with self._alterando_tabela():
+            if ip in self.vizinhos:
+                self.vizinhos.remove(ip)
+            self.vizinhos_desativados.add(ip)
+            self.portas_vizinhos.pop(ip, None)
+            self.monitor_vizinhos.remover(ip)
+            self.formato_vizinho.pop(ip, None)
+            self.capacidades_vizinho.pop(ip, None)
+            self.keepalive_agrupado.discard(ip)
+            self.recepcao_binaria.pop(ip, None)
+            self.tabela.remover_rotas_por_vizinho(ip)
+            self._invalidar_encaminhamento()
+        self.motor.vizinhos_inativos([ip])
+            
+    def definir_motor(self, nome: str):
+        if nome != self.motor.nome:
+            self.motor = MOTORES_ROTEAMENTO[nome](self)
+            
+    def definir_horizonte(self, modo: str, metrica_infinita: int):
+        with self.lock:
+            self.modo_horizonte = modo
+            self.metrica_infinita = metrica_infinita
+            self.cache_anuncios.configurar(modo, metrica_infinita)
             
     def anunciar_entrada_rede(self):
-        mensagem = f"@{self.ip_roteador}"
-        for vizinho in self.vizinhos:
-            porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
+        self._anunciar(self.vizinhos)
+        self.rede_existente = True
+        if self.rotas_obsoletas:
+            self._agendar(self.monitor_vizinhos.tempo_limite, self._expirar_rotas_obsoletas)
+        self.motor.iniciar()
+        
+    def _anunciar(self, vizinhos: List[str]):
+        envios = []
+        for vizinho in vizinhos:
+            destino = (vizinho, self.portas_vizinhos.get(vizinho, self.porta))
+            envios.append((self.mensagem_anuncio, destino))
+            envios.append((self.mensagem_capacidades, destino))
+        self._enviar_lote(envios)
+        for _, (vizinho, porta_vizinho) in envios[::2]:
+            self.registro.info('ANÚNCIO', "Roteador {roteador} anunciado para {vizinho}:{porta}",
+                               roteador=self.ip_roteador, vizinho=vizinho, porta=porta_vizinho)
+        
+    def _enviar(self, dados: bytes, destino: Tuple[str, int]):
+        self.trafego_enviado.registrar(len(dados), tipo_mensagem(dados), destino[0])
+        self._enviar_datagrama(dados, destino)
+        
+    def _enviar_datagrama(self, dados: bytes, destino: Tuple[str, int]):
+        enviar_datagrama(self.socket, dados, destino)
+        
+    def _enviar_lote(self, envios: List[Tuple[bytes, Tuple[str, int]]]):
+        """Envia em sequência todos os datagramas de uma rodada, já montados
+        (e fora do lock); um destino com erro não interrompe os demais."""
+        for dados, destino in envios:
             try:
-                self.socket.sendto(mensagem.encode('utf-8'), (vizinho, porta_vizinho))
-                print(f"[ANÚNCIO] Roteador {self.ip_roteador} anunciado para {vizinho}:{porta_vizinho}")
+                self._enviar(dados, destino)
             except Exception as e:
-                print(f"[ERRO] Erro ao anunciar para {vizinho}:{porta_vizinho}: {e}")
-        self.rede_existente = True
+                self.registro.erro('ERRO', "Erro ao enviar para {vizinho}:{porta}: {erro}",
+                                   vizinho=destino[0], porta=destino[1], erro=e)
+        
+    def _agendar(self, atraso: float, funcao: Callable[[], None]):
+        """Executa funcao após atraso segundos; retorna objeto com cancel()."""
+        temporizador = threading.Timer(atraso, funcao)
+        temporizador.daemon = True
+        temporizador.start()
+        return temporizador
+        
+    def _obter_anuncios_vizinhos(self) -> List[Tuple[str, int, List[bytes]]]:
+        """Retorna (vizinho, porta, datagramas da tabela) para cada vizinho.
+        As visões vêm do cache, lidas do instantâneo sem lock."""
+        return [(vizinho, self.portas_vizinhos.get(vizinho, self.porta),
+                 self.cache_anuncios.obter(vizinho, self._formato_de(vizinho)))
+                for vizinho in list(self.vizinhos)]
         
     def enviar_tabela_roteamento(self):
-        with self.lock:
-            for vizinho in self.vizinhos:
-                rotas_envio = self.tabela.obter_rotas_para_envio()
-                mensagem = self._formatar_mensagem_rotas(rotas_envio) if rotas_envio else ""
-                porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
-                try:
-                    if mensagem:
-                        self.socket.sendto(mensagem.encode('utf-8'), (vizinho, porta_vizinho))
-                except Exception as e:
-                    print(f"[ERRO] Erro ao enviar tabela para {vizinho}:{porta_vizinho}: {e}")
+        anuncios = self._obter_anuncios_vizinhos()
+        self._enviar_lote([(datagrama, (vizinho, porta_vizinho))
+                           for vizinho, porta_vizinho, datagramas in anuncios
+                           for datagrama in datagramas])
                     
     def enviar_keepalive(self):
+        self.motor.enviar_keepalive()
+        self.gravar_cache_rotas()
+        
+    def _enviar_keepalive_vetor_distancia(self):
+        """'@', '&' e a tabela completa (ou um só datagrama agrupado) para cada vizinho."""
+        envios = []
+        versao_anunciada = self.cache_anuncios.estado[0].versao
+        for vizinho, porta_vizinho, datagramas in self._obter_anuncios_vizinhos():
+            destino = (vizinho, porta_vizinho)
+            if (datagramas and vizinho in self.keepalive_agrupado and
+                    self.formato_vizinho.get(vizinho) == FORMATO_BINARIO_PREFIXOS):
+                # Um só datagrama por vizinho: '@' e '&' vão no tipo da tabela
+                envios.append((marcar_keepalive(datagramas[0]), destino))
+                envios.extend((datagrama, destino) for datagrama in datagramas[1:])
+            else:
+                # Também com a visão vazia (todas as rotas omitidas pelo
+                # split horizon): não há datagrama de tabela para marcar
+                envios.append((self.mensagem_anuncio, destino))
+                envios.append((self.mensagem_capacidades, destino))
+                envios.extend((datagrama, destino) for datagrama in datagramas)
         with self.lock:
-            mensagem_anuncio = f"@{self.ip_roteador}"
-            for vizinho in self.vizinhos:
-                porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
-                try:
-                    self.socket.sendto(mensagem_anuncio.encode('utf-8'), (vizinho, porta_vizinho))
-                    rotas_envio = self.tabela.obter_rotas_para_envio()
-                    if rotas_envio:
-                        mensagem_rotas = self._formatar_mensagem_rotas(rotas_envio)
-                        self.socket.sendto(mensagem_rotas.encode('utf-8'), (vizinho, porta_vizinho))
-                except Exception as e:
-                    print(f"[ERRO] Erro ao enviar keepalive para {vizinho}:{porta_vizinho}: {e}")
+            # A tabela completa já reflete as alterações até o instantâneo lido
+            self.tabela.descartar_alteracoes(versao_anunciada)
+        self._enviar_lote(envios)
                         
+    def agendar_atualizacao_disparada(self):
+        with self.lock:
+            if self.atualizacao_agendada is not None or not self.rodando:
+                return
+            self.atualizacao_agendada = self._agendar(self.intervalo_atualizacao_disparada,
+                                                      self.enviar_atualizacao_disparada)
+            
+    def enviar_atualizacao_disparada(self):
+        """Envia aos vizinhos somente as rotas alteradas desde o último anúncio"""
+        with self.lock:
+            self.atualizacao_agendada = None
+            alteracoes = self.tabela.obter_alteracoes_para_envio()
+            # Com o lock, o instantâneo publicado contém exatamente essas alterações
+            instantaneo = self.tabela.atual
+        if not alteracoes:
+            return
+        envios = []
+        # Vizinhos que não são próximo salto de nenhuma rota alterada
+        # compartilham a mesma mensagem (uma por formato)
+        mensagens_comuns: Dict[str, List[bytes]] = {}
+        saidas_alteradas = {rota[1] for _, rota in alteracoes if rota is not None}
+        for vizinho in list(self.vizinhos):
+            porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
+            formato = self._formato_de(vizinho)
+            # Com resumos, a métrica do resumo depende do vizinho
+            if vizinho in saidas_alteradas or (formato == FORMATO_BINARIO_PREFIXOS and
+                                               self.cache_anuncios.resumos):
+                datagramas = self._formatar_delta_para_vizinho(alteracoes, vizinho, formato, instantaneo)
+            else:
+                datagramas = mensagens_comuns.get(formato)
+                if datagramas is None:
+                    datagramas = self._formatar_delta_para_vizinho(alteracoes, vizinho, formato, instantaneo)
+                    mensagens_comuns[formato] = datagramas
+            envios.extend((datagrama, (vizinho, porta_vizinho)) for datagrama in datagramas)
+        self._enviar_lote(envios)
+                        
+    def _formatar_delta_para_vizinho(self, alteracoes: List[Tuple[str, RotaAnunciada]], vizinho: str,
+                                     formato: str, instantaneo: InstantaneoTabela) -> List[bytes]:
+        # No delta, rota removida ou omitida pelo horizonte precisa ser
+        # retirada explicitamente com métrica infinita
+        rotas_envio = []
+        resumos_alterados = set()
+        for ip_destino, rota in alteracoes:
+            resumo = self.cache_anuncios.resumo_de(ip_destino) if formato == FORMATO_BINARIO_PREFIXOS else None
+            if resumo is not None:
+                # O vizinho só conhece o resumo: envia a métrica nova dele
+                resumos_alterados.add(resumo)
+                continue
+            metrica = self.cache_anuncios.metrica_visivel(vizinho, rota)
+            rotas_envio.append((ip_destino, metrica if metrica is not None else self.metrica_infinita))
+        for resumo in resumos_alterados:
+            metrica = self.cache_anuncios.metrica_resumo(vizinho, resumo, instantaneo)
+            rotas_envio.append((formatar_prefixo(*resumo),
+                                metrica if metrica is not None else self.metrica_infinita))
+        return self._codificar_rotas(rotas_envio, formato, TIPO_DELTA)
+        
+    def _codificar_rotas(self, rotas: List[Tuple[str, int]], formato: str, tipo: int) -> List[bytes]:
+        if formato in (FORMATO_BINARIO, FORMATO_BINARIO_PREFIXOS):
+            versao = VERSAO_BINARIA_PREFIXOS if formato == FORMATO_BINARIO_PREFIXOS else VERSAO_BINARIA
+            try:
+                return codificar_rotas_binario(rotas, tipo, self.tabela.versao, versao=versao)
+            except (OSError, ValueError):
+                # Destino que não é IPv4 ou tabela grande demais: usa texto
+                pass
+        prefixo = "%" if tipo == TIPO_DELTA else ""
+        return [(prefixo + self._formatar_mensagem_rotas(rotas)).encode('utf-8')]
+        
     def _formatar_mensagem_rotas(self, rotas: List[Tuple[str, int]]) -> str:
         partes = []
         for ip_destino, metrica in rotas:
@@ -186,211 +1666,523 @@ class Roteador:
                     ip, metrica = parte.split(';')
                     rotas.append((ip, int(metrica)))
                 except ValueError:
+                    self.contador_falhas_parse.incrementar('*')
                     continue
         return rotas
         
-    def processar_mensagem_rotas(self, mensagem: str, ip_remetente: str):
-        rotas_recebidas = self._parsear_mensagem_rotas(mensagem)
+    def _aplicar_rota_recebida(self, ip_destino: str, metrica_recebida: int, ip_remetente: str) -> bool:
+        """Aplica uma rota anunciada por um vizinho (Bellman-Ford). Deve ser
+        chamado com self.lock adquirido. Retorna True se a tabela mudou."""
+        if ip_destino == self.ip_roteador:
+            return False
+            
+        nova_metrica = metrica_recebida + 1
+        rota_atual = self.tabela.obter_rota(ip_destino)
+        
+        if nova_metrica >= self.metrica_infinita:
+            if rota_atual is not None and rota_atual[1] == ip_remetente and ip_destino != ip_remetente:
+                self.tabela.remover_rota(ip_destino)
+                self.registro.info('ROTA REMOVIDA', "{destino} (retirada por {vizinho})",
+                                   chave=ip_destino, destino=ip_destino, vizinho=ip_remetente)
+                return True
+            return False
+            
+        if rota_atual is None:
+            self.tabela.adicionar_rota(ip_destino, nova_metrica, ip_remetente)
+            self.registro.info('NOVA ROTA', "{destino} via {vizinho} (métrica: {metrica})",
+                               chave=ip_destino, destino=ip_destino, vizinho=ip_remetente, metrica=nova_metrica)
+            return True
+            
+        metrica_atual, ip_saida_atual = rota_atual
+        if nova_metrica < metrica_atual:
+            self.tabela.adicionar_rota(ip_destino, nova_metrica, ip_remetente)
+            self.registro.info('ROTA MELHORADA', "{destino}: {anterior} -> {metrica} via {vizinho}",
+                               chave=ip_destino, destino=ip_destino, anterior=metrica_atual, metrica=nova_metrica,
+                               vizinho=ip_remetente)
+            return True
+        if ip_saida_atual == ip_remetente and nova_metrica != metrica_atual and ip_destino != ip_remetente:
+            # O próprio próximo salto informou uma métrica pior
+            self.tabela.adicionar_rota(ip_destino, nova_metrica, ip_remetente)
+            self.registro.info('ROTA PIORADA', "{destino}: {anterior} -> {metrica} via {vizinho}",
+                               chave=ip_destino, destino=ip_destino, anterior=metrica_atual, metrica=nova_metrica,
+                               vizinho=ip_remetente)
+            return True
+        return False
+        
+    def _processar_rotas_recebidas(self, rotas_recebidas: List[Tuple[str, int]], ip_remetente: str,
+                                   ips_anunciados: Optional[Set[str]]):
+        """Aplica as rotas recebidas. Se ips_anunciados for informado (tabela
+        completa), remove as rotas via o remetente que ele não anuncia mais."""
         tabela_alterada = False
         
-        with self.lock:
-            self.ultima_mensagem_vizinho[ip_remetente] = datetime.now()
+        with self._alterando_tabela():
+            self._renovar_vizinho(ip_remetente)
             
             for ip_destino, metrica_recebida in rotas_recebidas:
-                nova_metrica = metrica_recebida + 1
-                
-                rota_atual = self.tabela.obter_rota(ip_destino)
-                
-                if ip_destino == self.ip_roteador:
-                    continue  
-                    
-                if rota_atual is None:
-                    self.tabela.adicionar_rota(ip_destino, nova_metrica, ip_remetente)
-                    print(f"[NOVA ROTA] {ip_destino} via {ip_remetente} (métrica: {nova_metrica})")
+                if self._aplicar_rota_recebida(ip_destino, metrica_recebida, ip_remetente):
                     tabela_alterada = True
-                else:
-                    metrica_atual, ip_saida_atual = rota_atual
-                    if nova_metrica < metrica_atual:
-                        self.tabela.adicionar_rota(ip_destino, nova_metrica, ip_remetente)
-                        print(f"[ROTA MELHORADA] {ip_destino}: {metrica_atual} -> {nova_metrica} via {ip_remetente}")
-                        tabela_alterada = True
                         
-            ips_anunciados = {ip for ip, _ in rotas_recebidas}
-            rotas_remover = []
-            for ip_destino, (_, ip_saida, _) in self.tabela.rotas.items():
-                if ip_saida == ip_remetente and ip_destino not in ips_anunciados and ip_destino != ip_remetente:
-                    rotas_remover.append(ip_destino)
-                    
-            for ip_destino in rotas_remover:
-                self.tabela.remover_rota(ip_destino)
-                print(f"[ROTA REMOVIDA] {ip_destino} (não mais anunciada por {ip_remetente})")
-                tabela_alterada = True
+            if ips_anunciados is not None:
+                rotas_remover = []
+                for ip_destino, (_, ip_saida, _) in self.tabela.rotas.items():
+                    if ip_saida == ip_remetente and ip_destino not in ips_anunciados and ip_destino != ip_remetente:
+                        rotas_remover.append(ip_destino)
+                        
+                for ip_destino in rotas_remover:
+                    self.tabela.remover_rota(ip_destino)
+                    self.registro.info('ROTA REMOVIDA', "{destino} (não mais anunciada por {vizinho})",
+                                       chave=ip_destino, destino=ip_destino, vizinho=ip_remetente)
+                    tabela_alterada = True
+                if self.rotas_obsoletas:
+                    self._revalidar_rotas_obsoletas(ip_remetente)
                 
         if tabela_alterada:
-            print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Tabela de roteamento atualizada:")
-            print(self.tabela.formatar_para_exibicao())
-            self.enviar_tabela_roteamento()
+            self._registrar_tabela("Tabela de roteamento atualizada")
+            self.agendar_atualizacao_disparada()
             
-    def processar_anuncio_roteador(self, ip_novo_roteador: str):
-        tabela_alterada = False
-        deve_enviar_resposta = False
+    def _ips_alcancaveis(self, rotas: List[Tuple[str, int]]) -> Set[str]:
+        return {ip for ip, metrica in rotas if metrica + 1 < self.metrica_infinita}
+            
+    def processar_mensagem_rotas(self, mensagem: str, ip_remetente: str):
+        rotas_recebidas = self._parsear_mensagem_rotas(mensagem)
+        self._processar_rotas_recebidas(rotas_recebidas, ip_remetente, self._ips_alcancaveis(rotas_recebidas))
+            
+    def processar_atualizacao_incremental(self, mensagem: str, ip_remetente: str):
+        """Processa um delta '%' contendo apenas rotas alteradas (métrica
+        infinita indica retirada). Rotas não citadas permanecem inalteradas."""
+        rotas_recebidas = self._parsear_mensagem_rotas(mensagem[1:])
+        self._processar_rotas_recebidas(rotas_recebidas, ip_remetente, None)
         
+    def processar_mensagem_binaria(self, dados: bytes, ip_remetente: str):
+        try:
+            tipo, id_anuncio, parte, total, rotas_recebidas = decodificar_rotas_binario(dados)
+        except (ValueError, struct.error) as e:
+            self.contador_falhas_parse.incrementar('binário')
+            self.registro.aviso('ERRO', "Mensagem binária inválida de {vizinho}: {erro}",
+                                vizinho=ip_remetente, erro=e)
+            return
+            
+        if tipo == TIPO_DELTA:
+            self._processar_rotas_recebidas(rotas_recebidas, ip_remetente, None)
+            return
+        if tipo == TIPO_TABELA_KEEPALIVE:
+            self._processar_keepalive_agrupado(ip_remetente)
+            
+        # A remoção de rotas não anunciadas só é feita com todas as partes
+        # da tabela; partes de um anúncio anterior são descartadas
+        recepcao = self.recepcao_binaria.get(ip_remetente)
+        if recepcao is None or recepcao[0] != id_anuncio:
+            recepcao = (id_anuncio, set(), set())
+            self.recepcao_binaria[ip_remetente] = recepcao
+        _, partes, ips_anunciados = recepcao
+        partes.add(parte)
+        ips_anunciados.update(self._ips_alcancaveis(rotas_recebidas))
+        
+        if len(partes) >= total:
+            del self.recepcao_binaria[ip_remetente]
+            self._processar_rotas_recebidas(rotas_recebidas, ip_remetente, ips_anunciados)
+        else:
+            self._processar_rotas_recebidas(rotas_recebidas, ip_remetente, None)
+            
+    def _processar_keepalive_agrupado(self, ip_remetente: str):
+        """Equivale a receber '@' e '&' do remetente, sem reenviar a tabela
+        a um vizinho que já a tem."""
         with self.lock:
-            rota_atual = self.tabela.obter_rota(ip_novo_roteador)
+            self.capacidades_vizinho[ip_remetente] = self.relogio()
+            self.formato_vizinho[ip_remetente] = FORMATO_BINARIO_PREFIXOS
+            self.keepalive_agrupado.add(ip_remetente)
+        self.processar_anuncio_roteador(ip_remetente, responder=False)
             
-            self.ultima_mensagem_vizinho[ip_novo_roteador] = datetime.now()
+    def processar_capacidades(self, mensagem: str, ip_remetente: str):
+        versoes = set(mensagem[1:].split(','))
+        with self.lock:
+            self.capacidades_vizinho[ip_remetente] = self.relogio()
+            if str(VERSAO_KEEPALIVE_AGRUPADO) in versoes:
+                self.keepalive_agrupado.add(ip_remetente)
+            else:
+                self.keepalive_agrupado.discard(ip_remetente)
+            if str(VERSAO_BINARIA_PREFIXOS) in versoes:
+                self.formato_vizinho[ip_remetente] = FORMATO_BINARIO_PREFIXOS
+            elif str(VERSAO_BINARIA) in versoes:
+                self.formato_vizinho[ip_remetente] = FORMATO_BINARIO
+            else:
+                self.formato_vizinho.pop(ip_remetente, None)
             
+    def processar_anuncio_roteador(self, ip_novo_roteador: str, responder: bool = True):
+        """Sem responder, a tabela só é enviada se o roteador era desconhecido."""
+        with self.lock:
+            self._renovar_vizinho(ip_novo_roteador)
+            if ip_novo_roteador not in self.vizinhos:
+                self.vizinhos.append(ip_novo_roteador)
+                if ip_novo_roteador not in self.portas_vizinhos:
+                    self.portas_vizinhos[ip_novo_roteador] = self.porta
+        self.motor.vizinho_ativo(ip_novo_roteador, responder)
+        
+    def _anuncio_vetor_distancia(self, ip_novo_roteador: str, responder: bool):
+        tabela_alterada = False
+        
+        with self._alterando_tabela():
+            rota_atual = self.tabela.obter_rota(ip_novo_roteador)
             if rota_atual is None:
                 self.tabela.adicionar_rota(ip_novo_roteador, 1, ip_novo_roteador)
                 tabela_alterada = True
-                print(f"[NOVO ROTEADOR] {ip_novo_roteador} adicionado à tabela (métrica: 1)")
-                deve_enviar_resposta = True
+                self.registro.info('NOVO ROTEADOR', "{vizinho} adicionado à tabela (métrica: 1)",
+                                   vizinho=ip_novo_roteador)
             elif rota_atual[0] > 1:
                 self.tabela.adicionar_rota(ip_novo_roteador, 1, ip_novo_roteador)
                 tabela_alterada = True
-                print(f"[ROTA ATUALIZADA] {ip_novo_roteador} atualizado para métrica 1")
-                deve_enviar_resposta = True
-            else:
-                deve_enviar_resposta = True
-                
-            if ip_novo_roteador not in self.vizinhos:
-                self.vizinhos.append(ip_novo_roteador)
-                if ip_novo_roteador not in self.portas_vizinhos:
-                    self.portas_vizinhos[ip_novo_roteador] = self.porta
-            
-            if tabela_alterada:
-                print(self.tabela.formatar_para_exibicao())
+                self.registro.info('ROTA ATUALIZADA', "{vizinho} atualizado para métrica 1",
+                                   chave=ip_novo_roteador, vizinho=ip_novo_roteador)
         
-        if deve_enviar_resposta:
+        if tabela_alterada:
+            self._registrar_tabela("Tabela de roteamento atualizada")
+        if responder or tabela_alterada:
             self._enviar_tabela_para_vizinho(ip_novo_roteador)
             
             if tabela_alterada:
-                self.enviar_tabela_roteamento()
+                self.agendar_atualizacao_disparada()
                 
-    def _enviar_tabela_para_vizinho(self, vizinho: str):
-        with self.lock:
-            rotas_envio = self.tabela.obter_rotas_para_envio()
-            porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
+    def _formato_de(self, vizinho: str) -> str:
+        """Formato de envio para o vizinho. Um roteador antigo reiniciado no
+        mesmo IP não renova o '&', então o binário expira após alguns
+        keepalives."""
+        formato = self.formato_vizinho.get(vizinho, FORMATO_TEXTO)
+        if formato != FORMATO_TEXTO:
+            instante = self.capacidades_vizinho.get(vizinho, 0.0)
+            if self.relogio() - instante > 3 * self.intervalo_keepalive:
+                self.formato_vizinho.pop(vizinho, None)
+                self.keepalive_agrupado.discard(vizinho)
+                return FORMATO_TEXTO
+        return formato
         
-        if rotas_envio:
-            mensagem = self._formatar_mensagem_rotas(rotas_envio)
-            try:
-                self.socket.sendto(mensagem.encode('utf-8'), (vizinho, porta_vizinho))
-            except Exception as e:
-                print(f"[ERRO] Erro ao enviar tabela para {vizinho}:{porta_vizinho}: {e}")
+    def _enviar_tabela_para_vizinho(self, vizinho: str):
+        datagramas = self.cache_anuncios.obter(vizinho, self._formato_de(vizinho))
+        porta_vizinho = self.portas_vizinhos.get(vizinho, self.porta)
+        self._enviar_lote([(datagrama, (vizinho, porta_vizinho)) for datagrama in datagramas])
                 
-    def verificar_falhas_vizinhos(self):
-        timeout = timedelta(seconds=15)
-        agora = datetime.now()
-        vizinhos_inativos = []
+    def _renovar_vizinho(self, vizinho: str):
+        """Deve ser chamado com self.lock adquirido."""
+        if self.monitor_vizinhos.renovar(vizinho, self.relogio()):
+            self._notificar_novo_prazo()
+            
+    def _notificar_novo_prazo(self):
+        self.evento_prazos.set()
         
+    def verificar_falhas_vizinhos(self):
         with self.lock:
-            for vizinho in list(self.ultima_mensagem_vizinho.keys()):
-                ultima_mensagem = self.ultima_mensagem_vizinho[vizinho]
-                if agora - ultima_mensagem > timeout:
-                    vizinhos_inativos.append(vizinho)
-                    
+            vizinhos_inativos = self.monitor_vizinhos.expirados(self.relogio())
+        for vizinho in vizinhos_inativos:
+            self.registro.info('FALHA DETECTADA', "Vizinho {vizinho} inativo (sem mensagens por {tempo:g}s)",
+                               vizinho=vizinho, tempo=self.monitor_vizinhos.tempo_limite)
+        if vizinhos_inativos:
+            self.motor.vizinhos_inativos(vizinhos_inativos)
+            
+    def _falhas_vetor_distancia(self, vizinhos_inativos: List[str]):
+        with self._alterando_tabela():
             for vizinho in vizinhos_inativos:
-                print(f"[FALHA DETECTADA] Vizinho {vizinho} inativo (sem mensagens por 15s)")
                 self.tabela.remover_rotas_por_vizinho(vizinho)
-                if vizinho in self.ultima_mensagem_vizinho:
-                    del self.ultima_mensagem_vizinho[vizinho]
-                print(f"[FALHA] Tabela atualizada após remoção de rotas:")
-                print(self.tabela.formatar_para_exibicao())
-                
-    def processar_mensagem_texto(self, mensagem: str, ip_remetente: str):
-        try:
-            partes = mensagem[1:].split(';', 2)
-            if len(partes) != 3:
-                return
+        self._registrar_tabela("Tabela atualizada após remoção de rotas")
+        self.agendar_atualizacao_disparada()
+        
+    def _registrar_tabela(self, titulo: str):
+        """Dump do instantâneo atual, formatado pela thread de registro."""
+        if self.exibir_tabelas and self.registro.ativo(NIVEL_INFO):
+            self.registro.info('TABELA', formatar_dump_tabela, limite=5, titulo=titulo,
+                               rotas=self.tabela.atual.listar())
                 
-            ip_origem, ip_destino, texto = partes
-            
-            if ip_destino == self.ip_roteador:
-                print(f"\n[MENSAGEM RECEBIDA]")
-                print(f"Origem: {ip_origem}")
-                print(f"Destino: {ip_destino} (você)")
-                print(f"Mensagem: {texto}")
-                print(f"Status: Chegou ao destino\n")
+    def _invalidar_encaminhamento(self):
+        self.encaminhamento = (None, {})
+        
+    def _proximo_salto(self, destino: bytes) -> Optional[Tuple[str, int]]:
+        """(IP, porta) do próximo salto para o destino de uma mensagem '!'.
+        O próprio IP como próximo salto indica entrega local. Não usa o lock:
+        o mapa é lido junto com o instantâneo para o qual foi preenchido."""
+        base, encaminhamento = self.encaminhamento
+        instantaneo = self.tabela.atual
+        if base is not instantaneo:
+            base, encaminhamento = self.encaminhamento = (instantaneo, {})
+        salto = encaminhamento.get(destino)
+        if salto is not None:
+            return salto
+        ip_destino = destino.decode('utf-8', 'replace')
+        if ip_destino == self.ip_roteador:
+            ip_proximo = self.ip_roteador
+        else:
+            rota = instantaneo.buscar_rota(ip_destino)
+            if rota is None:
+                return None
+            ip_proximo = rota[1]
+        salto = (ip_proximo, self.portas_vizinhos.get(ip_proximo, self.porta))
+        if len(encaminhamento) >= MAXIMO_ENTRADAS_ENCAMINHAMENTO:
+            encaminhamento.clear()
+        encaminhamento[destino] = salto
+        return salto
+        
+    def processar_mensagem_texto(self, data: bytes, ip_remetente: str):
+        """Mensagens em trânsito não são decodificadas: só o destino é lido
+        dos bytes e o datagrama segue com o TTL decrementado."""
+        inicio_tratamento = time.perf_counter()
+        if data[4:5] == b'!' and data[1:4].isdigit():
+            ttl: Optional[int] = int(data[1:4])
+            inicio = 5
+        else:
+            ttl = None
+            inicio = 1
+        fim_origem = data.find(b';', inicio)
+        fim_destino = data.find(b';', fim_origem + 1)
+        if fim_origem < 0 or fim_destino < 0:
+            self.contador_falhas_parse.incrementar('!')
+            return
+        destino = bytes(data[fim_origem + 1:fim_destino])
+        
+        salto = self._proximo_salto(destino)
+        if salto is None:
+            self.contador_descartes.incrementar('sem_rota')
+            self.registro.aviso('SEM ROTA', "Mensagem para {destino} descartada", limite=1, destino=destino)
+            return
+        if salto[0] == self.ip_roteador:
+            if data[fim_destino + 1:fim_destino + 2] == MARCADOR_TRANSFERENCIA:
+                self.transferencias.receber(bytes(data[inicio:fim_origem]).decode('utf-8', 'replace'),
+                                            bytes(data[fim_destino + 1:]))
             else:
-                rota = self.tabela.obter_rota(ip_destino)
-                if rota:
-                    _, ip_proximo = rota
-                    print(f"[MENSAGEM ROTEADA]")
-                    print(f"Origem: {ip_origem}")
-                    print(f"Destino: {ip_destino}")
-                    print(f"Próximo salto: {ip_proximo}")
-                    print(f"Mensagem: {texto}")
-                    
-                    porta_proximo = self.portas_vizinhos.get(ip_proximo, self.porta)
-                    self.socket.sendto(mensagem.encode('utf-8'), (ip_proximo, porta_proximo))
-                else:
-                    print(f"[ERRO] Rota não encontrada para {ip_destino}")
+                self._entregar_mensagem_texto(data[inicio:].decode('utf-8', 'replace'))
+            return
+        
+        if ttl is None:
+            pacote = data
+        elif ttl <= 1:
+            self.contador_descartes.incrementar('ttl')
+            self.registro.aviso('TTL EXPIRADO', "Mensagem de {origem} para {destino} descartada", limite=1,
+                                origem=data[inicio:fim_origem], destino=destino)
+            return
+        else:
+            pacote = bytearray(data)
+            pacote[1:4] = b'%03d' % (ttl - 1)
+        try:
+            self._enviar(pacote, salto)
         except Exception as e:
-            print(f"[ERRO] Erro ao processar mensagem de texto: {e}")
+            self.registro.erro('ERRO', "Erro ao encaminhar mensagem para {vizinho}:{porta}: {erro}",
+                               vizinho=salto[0], porta=salto[1], erro=e)
+            return
+        self.histograma_encaminhamento.observar(time.perf_counter() - inicio_tratamento)
+        self.registro.registrar(NIVEL_INFO, 'MENSAGEM ROTEADA', "{origem} -> {destino} via {vizinho}", 1,
+                                origem=data[inicio:fim_origem], destino=destino, vizinho=salto[0])
+            
+    def _entregar_mensagem_texto(self, mensagem: str):
+        partes = mensagem.split(';', 2)
+        if len(partes) != 3:
+            return
+        ip_origem, ip_destino, texto = partes
+        self.registro.info('MENSAGEM RECEBIDA',
+                           "\nOrigem: {origem}\nDestino: {destino} ({local})\nMensagem: {texto}\n"
+                           "Status: Chegou ao destino\n",
+                           origem=ip_origem, destino=ip_destino, texto=texto,
+                           local='você' if ip_destino == self.ip_roteador else 'rede local')
             
     def enviar_mensagem_texto(self, ip_destino: str, texto: str):
-        rota = self.tabela.obter_rota(ip_destino)
-        if rota:
+        rota = self.tabela.atual.buscar_rota(ip_destino)
+        if rota and rota[1] == self.ip_roteador:
+            self.registro.erro('ERRO', f"{ip_destino} pertence a uma rede local deste roteador")
+        elif rota:
             _, ip_proximo = rota
-            mensagem = f"!{self.ip_roteador};{ip_destino};{texto}"
+            mensagem = f"!{TTL_PADRAO:03d}!{self.ip_roteador};{ip_destino};{texto}"
             porta_proximo = self.portas_vizinhos.get(ip_proximo, self.porta)
             try:
-                self.socket.sendto(mensagem.encode('utf-8'), (ip_proximo, porta_proximo))
-                print(f"[MENSAGEM ENVIADA] Para {ip_destino} via {ip_proximo}:{porta_proximo}: {texto}")
+                self._enviar(mensagem.encode('utf-8'), (ip_proximo, porta_proximo))
+                self.registro.info('MENSAGEM ENVIADA', f"Para {ip_destino} via {ip_proximo}:{porta_proximo}: {texto}")
             except Exception as e:
-                print(f"[ERRO] Erro ao enviar mensagem: {e}")
+                self.registro.erro('ERRO', f"Erro ao enviar mensagem: {e}")
         else:
-            print(f"[ERRO] Rota não encontrada para {ip_destino}")
+            self.registro.erro('ERRO', f"Rota não encontrada para {ip_destino}")
+            
+    def enviar_mensagem_dados(self, ip_destino: str, corpo: bytes) -> bool:
+        """Envia corpo (bytes quaisquer) como texto de uma mensagem '!', sem
+        registrar evento; retorna se havia rota e o envio não falhou."""
+        destino = ip_destino.encode('utf-8')
+        salto = self._proximo_salto(destino)
+        if salto is None or salto[0] == self.ip_roteador:
+            return False
+        try:
+            self._enviar(b'!%03d!%s;%s;' % (TTL_PADRAO, self.ip_roteador.encode('utf-8'), destino) + corpo, salto)
+        except OSError:
+            return False
+        return True
             
+    def processar_datagrama(self, data: bytes, addr: Tuple[str, int]):
+        tipo = tipo_mensagem(data)
+        self.trafego_recebido.registrar(len(data), tipo, addr[0])
+        if tipo == '!':
+            # O caminho de encaminhamento registra a própria latência
+            self._tratar_datagrama(data, addr)
+            return
+        inicio = time.perf_counter()
+        try:
+            self._tratar_datagrama(data, addr)
+        finally:
+            self.histograma_tratadores.observar(time.perf_counter() - inicio, tipo)
+            
+    def _tratar_datagrama(self, data: bytes, addr: Tuple[str, int]):
+        ip_remetente = addr[0]
+        porta_remetente = addr[1]
+        
+        if ip_remetente in self.vizinhos:
+            if ip_remetente not in self.portas_vizinhos or self.portas_vizinhos[ip_remetente] != porta_remetente:
+                # Sob o lock, como as demais trocas de porta: com trabalhadores
+                # a tabela republicada não pode correr com a de uma alteração
+                with self.lock:
+                    self.portas_vizinhos[ip_remetente] = porta_remetente
+                    self._invalidar_encaminhamento()
+                
+        if data[:1] == b'!':
+            self.processar_mensagem_texto(data, ip_remetente)
+            return
+        if ip_remetente in self.vizinhos_desativados:
+            return
+        if data[:1] not in (b'@', b'&'):
+            # Mensagens de roteamento ('*', '%', binário, '$'): o motor decide
+            if data[:1] == bytes([MARCADOR_BINARIO]) and ip_remetente not in self.portas_vizinhos:
+                self.portas_vizinhos[ip_remetente] = porta_remetente
+            self.motor.tratar_mensagem(data, ip_remetente)
+            return
+        
+        try:
+            mensagem = data.decode('utf-8')
+        except UnicodeDecodeError:
+            self.contador_falhas_parse.incrementar(tipo_mensagem(data))
+            return
+        if mensagem.startswith('@'):
+            ip_novo = mensagem[1:]
+            if ip_novo not in self.portas_vizinhos:
+                self.portas_vizinhos[ip_novo] = porta_remetente
+            self.processar_anuncio_roteador(ip_novo)
+        else:
+            self.processar_capacidades(mensagem, ip_remetente)
+            
+    def _drenar_socket(self) -> int:
+        """Processa os datagramas já enfileirados no socket (até
+        MAXIMO_LOTE_RECEPCAO) sem bloquear; retorna quantos foram lidos."""
+        recebidos = 0
+        while recebidos < MAXIMO_LOTE_RECEPCAO:
+            try:
+                tamanho, addr = self.socket.recvfrom_into(self.buffer_recepcao)
+            except (BlockingIOError, InterruptedError):
+                break
+            recebidos += 1
+            try:
+                self.processar_datagrama(bytes(self.visao_recepcao[:tamanho]), addr)
+            except Exception as e:
+                self.registro.erro('ERRO', "Erro ao processar mensagem de {vizinho}: {erro}",
+                                   vizinho=addr[0], erro=e)
+        return recebidos
+        
     def receber_mensagens(self):
         while self.rodando:
             try:
-                data, addr = self.socket.recvfrom(1024)
-                mensagem = data.decode('utf-8')
-                ip_remetente = addr[0]
-                porta_remetente = addr[1]
-                
-                if ip_remetente in self.vizinhos:
-                    if ip_remetente not in self.portas_vizinhos or self.portas_vizinhos[ip_remetente] != porta_remetente:
-                        self.portas_vizinhos[ip_remetente] = porta_remetente
-                
-                if mensagem.startswith('*'):
-                    self.processar_mensagem_rotas(mensagem, ip_remetente)
-                elif mensagem.startswith('@'):
-                    ip_novo = mensagem[1:]
-                    if ip_novo not in self.portas_vizinhos:
-                        self.portas_vizinhos[ip_novo] = porta_remetente
-                    self.processar_anuncio_roteador(ip_novo)
-                elif mensagem.startswith('!'):
-                    self.processar_mensagem_texto(mensagem, ip_remetente)
-            except socket.timeout:
-                continue
+                prontos, _, _ = select.select([self.socket], [], [], 1.0)
+                if prontos:
+                    self._drenar_socket()
             except Exception as e:
                 if self.rodando:
-                    print(f"[ERRO] Erro ao receber mensagem: {e}")
+                    self.registro.erro('ERRO', "Erro ao receber mensagem: {erro}", erro=e)
                     
     def atualizar_periodicamente(self):
         """Thread para atualização periódica de rotas"""
         while self.rodando:
-            time.sleep(10)
+            time.sleep(self.intervalo_keepalive)
             if self.rodando:
                 self.enviar_keepalive()
                 
+    def _tempo_ate_proximo_prazo(self) -> Optional[float]:
+        with self.lock:
+            proximo = self.monitor_vizinhos.proximo_prazo()
+        return None if proximo is None else max(0.0, proximo - self.relogio())
+                
     def verificar_falhas_periodicamente(self):
-        """Thread para verificação periódica de falhas"""
+        """Thread de detecção de falhas: dorme até o próximo prazo expirar"""
         while self.rodando:
-            time.sleep(5)  
+            self.evento_prazos.wait(self._tempo_ate_proximo_prazo())
+            self.evento_prazos.clear()
             if self.rodando:
                 self.verificar_falhas_vizinhos()
                 
+    def resposta_metricas(self) -> bytes:
+        """Resposta HTTP com as métricas no formato texto do Prometheus."""
+        corpo = self.metricas.exportar().encode('utf-8')
+        return (b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(corpo)) + corpo
+        
+    def servir_metricas(self):
+        """Thread da consulta de métricas: cada conexão TCP recebe o texto
+        completo (serve para curl, nc ou um scraper do Prometheus)"""
+        try:
+            servidor = socket.create_server((self.ip_roteador, self.porta_metricas))
+        except OSError as e:
+            self.registro.erro('ERRO', f"Não foi possível abrir a porta de métricas {self.porta_metricas}: {e}")
+            return
+        servidor.settimeout(1.0)
+        with servidor:
+            while self.rodando:
+                try:
+                    conexao, _ = servidor.accept()
+                except socket.timeout:
+                    continue
+                with conexao:
+                    try:
+                        conexao.settimeout(1.0)
+                        # A requisição é ignorada: qualquer consulta recebe tudo
+                        conexao.recv(4096)
+                    except OSError:
+                        pass
+                    try:
+                        conexao.sendall(self.resposta_metricas())
+                    except OSError as e:
+                        self.registro.erro('ERRO', f"Erro ao enviar métricas: {e}")
+                
     def exibir_tabela_periodicamente(self):
         """Thread para exibir tabela periodicamente"""
         while self.rodando:
             time.sleep(30)  
             if self.rodando:
-                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Estado atual da tabela de roteamento:")
-                print(self.tabela.formatar_para_exibicao())
+                self.exibir_tabela()
+                
+    def exibir_tabela(self):
+        self._registrar_tabela("Estado atual da tabela de roteamento")
+        
+    def exibir_comandos(self):
+        print(f"\n[Roteador {self.ip_roteador} iniciado]")
+        print("Comandos disponíveis:")
+        print("  enviar <IP_DESTINO> <mensagem> - Envia mensagem de texto")
+        print("  enviar-arquivo <IP_DESTINO> <arquivo> - Envia um arquivo com entrega confiável")
+        print("  tabela - Exibe tabela de roteamento")
+        print("  metricas - Exibe contadores e histogramas")
+        print("  recarregar - Relê o arquivo de configuração e aplica as diferenças")
+        print("  sair - Encerra o roteador")
+        print("\nAguardando comandos...\n")
+        
+    def executar_comando(self, comando: str):
+        if comando == "sair":
+            self.parar()
+        elif comando == "tabela":
+            print(self.tabela.formatar_para_exibicao())
+        elif comando == "metricas":
+            print(self.metricas.exportar(), end="")
+        elif comando == "recarregar":
+            self.recarregar_configuracao()
+        elif comando.startswith("enviar-arquivo "):
+            partes = comando.split(' ', 2)
+            if len(partes) == 3 and partes[2].strip():
+                self.transferencias.enviar_arquivo(partes[1], partes[2].strip())
+            else:
+                print("Uso: enviar-arquivo <IP_DESTINO> <arquivo>")
+        elif comando.startswith("enviar "):
+            partes = comando.split(' ', 2)
+            if len(partes) == 3:
+                _, ip_destino, texto = partes
+                self.enviar_mensagem_texto(ip_destino, texto)
+            else:
+                print("Uso: enviar <IP_DESTINO> <mensagem>")
+        elif comando:
+            print(f"Comando desconhecido: {comando}")
                 
     def iniciar(self):
         self.rodando = True
@@ -407,33 +2199,25 @@ class Roteador:
         thread_exibir = threading.Thread(target=self.exibir_tabela_periodicamente, daemon=True)
         thread_exibir.start()
         
-        time.sleep(1)
+        if self.porta_metricas is not None:
+            threading.Thread(target=self.servir_metricas, daemon=True).start()
+            
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            # O tratador roda na thread principal, que pode estar com o lock
+            signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=self.recarregar_configuracao,
+                                                                     daemon=True).start())
+        
+        if not self.rotas_obsoletas:
+            time.sleep(1)
         self.anunciar_entrada_rede()
         
-        print(f"\n[Roteador {self.ip_roteador} iniciado]")
-        print("Comandos disponíveis:")
-        print("  enviar <IP_DESTINO> <mensagem> - Envia mensagem de texto")
-        print("  tabela - Exibe tabela de roteamento")
-        print("  sair - Encerra o roteador")
-        print("\nAguardando comandos...\n")
+        self.exibir_comandos()
         
         try:
             while self.rodando:
                 try:
                     comando = input().strip()
-                    if comando == "sair":
-                        self.parar()
-                    elif comando == "tabela":
-                        print(self.tabela.formatar_para_exibicao())
-                    elif comando.startswith("enviar "):
-                        partes = comando.split(' ', 2)
-                        if len(partes) == 3:
-                            _, ip_destino, texto = partes
-                            self.enviar_mensagem_texto(ip_destino, texto)
-                        else:
-                            print("Uso: enviar <IP_DESTINO> <mensagem>")
-                    elif comando:
-                        print(f"Comando desconhecido: {comando}")
+                    self.executar_comando(comando)
                 except EOFError:
                     time.sleep(0.1)
                     continue
@@ -442,20 +2226,349 @@ class Roteador:
             
     def parar(self):
         self.rodando = False
+        self.evento_prazos.set()
+        self.gravar_cache_rotas()
+        with self.lock:
+            if self.atualizacao_agendada is not None:
+                self.atualizacao_agendada.cancel()
+                self.atualizacao_agendada = None
         self.socket.close()
+        self.registro.encerrar()
         print(f"\n[Roteador {self.ip_roteador} encerrado]")
 
 
+class ProtocoloRoteador(asyncio.DatagramProtocol):
+    
+    def __init__(self, roteador: 'RoteadorAsync'):
+        self.roteador = roteador
+        
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            self.roteador.processar_datagrama(data, addr)
+        except Exception as e:
+            self.roteador.registro.erro('ERRO', "Erro ao receber mensagem: {erro}", erro=e)
+            
+    def error_received(self, exc: Exception):
+        if self.roteador.rodando:
+            self.roteador.registro.erro('ERRO', "Erro no socket: {erro}", erro=exc)
+
+
+class RoteadorAsync(Roteador):
+    """Roteador executado em um único event loop asyncio: recepção, keepalive,
+    detecção de falhas e exibição são corrotinas no mesmo loop, então não há
+    lock nem timeout de recepção. Onde o loop não monitora o stdin (Windows),
+    a leitura do teclado usa uma thread auxiliar."""
+    
+    def __init__(self, ip_roteador: str, porta: int = 6000):
+        super().__init__(ip_roteador, porta)
+        # Todos os handlers rodam no mesmo loop: não há concorrência
+        self.lock = contextlib.nullcontext()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transporte: Optional[asyncio.DatagramTransport] = None
+        self.encerrado: Optional[asyncio.Event] = None
+        self.buffer_teclado = b""
+        self.evento_prazos_async: Optional[asyncio.Event] = None
+        
+    def _enviar_datagrama(self, dados: bytes, destino: Tuple[str, int]):
+        if self.transporte is not None:
+            self.transporte.sendto(dados, destino)
+        else:
+            enviar_datagrama(self.socket, dados, destino)
+        
+    def _agendar(self, atraso: float, funcao: Callable[[], None]):
+        return self.loop.call_later(atraso, funcao)
+        
+    def gravar_cache_rotas(self):
+        # O fsync não pode parar o loop: com ele rodando a gravação vai para
+        # o executor (a do encerramento, com rodando falso, é feita aqui)
+        if self.rodando and self.loop is not None:
+            self.loop.run_in_executor(None, super().gravar_cache_rotas)
+        else:
+            super().gravar_cache_rotas()
+        
+    async def _periodicamente(self, intervalo: Callable[[], float], funcao: Callable[[], None]):
+        while self.rodando:
+            # Relido a cada volta: a recarga da configuração pode alterá-lo
+            await asyncio.sleep(intervalo())
+            if self.rodando:
+                funcao()
+                
+    def _notificar_novo_prazo(self):
+        if self.evento_prazos_async is not None:
+            self.evento_prazos_async.set()
+            
+    async def _verificar_falhas_nos_prazos(self):
+        while self.rodando:
+            try:
+                await asyncio.wait_for(self.evento_prazos_async.wait(), self._tempo_ate_proximo_prazo())
+            except asyncio.TimeoutError:
+                pass
+            self.evento_prazos_async.clear()
+            if self.rodando:
+                self.verificar_falhas_vizinhos()
+                
+    def _ler_teclado_disponivel(self, comandos: asyncio.Queue):
+        fd = sys.stdin.fileno()
+        dados = os.read(fd, 4096)
+        if not dados:
+            self.loop.remove_reader(fd)
+            return
+        self.buffer_teclado += dados
+        while b"\n" in self.buffer_teclado:
+            linha, self.buffer_teclado = self.buffer_teclado.split(b"\n", 1)
+            comandos.put_nowait(linha.decode('utf-8', errors='replace').strip())
+            
+    def _ler_teclado(self, comandos: asyncio.Queue):
+        """Thread de leitura do teclado (usada só se o loop não monitora o stdin)"""
+        while self.rodando:
+            try:
+                comando = input().strip()
+            except EOFError:
+                return
+            self.loop.call_soon_threadsafe(comandos.put_nowait, comando)
+            if comando == "sair":
+                return
+            
+    async def _executar(self):
+        self.loop = asyncio.get_running_loop()
+        self.encerrado = asyncio.Event()
+        self.evento_prazos_async = asyncio.Event()
+        # O socket é drenado a cada despertar; loops sem add_reader para
+        # sockets (Proactor no Windows) usam o transporte de datagramas
+        try:
+            self.loop.add_reader(self.socket.fileno(), self._drenar_socket)
+        except NotImplementedError:
+            self.transporte, _ = await self.loop.create_datagram_endpoint(
+                lambda: ProtocoloRoteador(self), sock=self.socket)
+        self.rodando = True
+        
+        tarefas = [
+            asyncio.create_task(self._periodicamente(lambda: self.intervalo_keepalive, self.enviar_keepalive)),
+            asyncio.create_task(self._verificar_falhas_nos_prazos()),
+            asyncio.create_task(self._periodicamente(lambda: 30, self.exibir_tabela)),
+        ]
+        servidor_metricas = None
+        if self.porta_metricas is not None:
+            try:
+                servidor_metricas = await asyncio.start_server(
+                    self._atender_metricas, self.ip_roteador, self.porta_metricas)
+            except OSError as e:
+                self.registro.erro('ERRO', f"Não foi possível abrir a porta de métricas {self.porta_metricas}: {e}")
+        
+        if hasattr(signal, 'SIGHUP'):
+            try:
+                self.loop.add_signal_handler(signal.SIGHUP, self.recarregar_configuracao)
+            except (NotImplementedError, RuntimeError):
+                pass
+        self.anunciar_entrada_rede()
+        self.exibir_comandos()
+        
+        comandos: asyncio.Queue = asyncio.Queue()
+        leitor_no_loop = True
+        try:
+            self.loop.add_reader(sys.stdin.fileno(), self._ler_teclado_disponivel, comandos)
+        except (NotImplementedError, OSError, ValueError):
+            leitor_no_loop = False
+            threading.Thread(target=self._ler_teclado, args=(comandos,), daemon=True).start()
+        leitura = asyncio.create_task(self._consumir_comandos(comandos))
+        try:
+            await self.encerrado.wait()
+        finally:
+            if leitor_no_loop:
+                self.loop.remove_reader(sys.stdin.fileno())
+            leitura.cancel()
+            for tarefa in tarefas:
+                tarefa.cancel()
+            if servidor_metricas is not None:
+                servidor_metricas.close()
+            if self.transporte is not None:
+                self.transporte.close()
+            else:
+                self.loop.remove_reader(self.socket.fileno())
+                self.socket.close()
+                
+    async def _atender_metricas(self, leitor: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(leitor.readuntil(b"\r\n\r\n"), 1.0)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        try:
+            escritor.write(self.resposta_metricas())
+            await escritor.drain()
+        except OSError as e:
+            self.registro.erro('ERRO', f"Erro ao enviar métricas: {e}")
+        finally:
+            escritor.close()
+            
+    async def _consumir_comandos(self, comandos: asyncio.Queue):
+        while self.rodando:
+            self.executar_comando(await comandos.get())
+            
+    def iniciar(self):
+        try:
+            asyncio.run(self._executar())
+        except KeyboardInterrupt:
+            self.parar()
+            
+    def parar(self):
+        if not self.rodando:
+            return
+        self.rodando = False
+        self.gravar_cache_rotas()
+        if self.atualizacao_agendada is not None:
+            self.atualizacao_agendada.cancel()
+            self.atualizacao_agendada = None
+        # O socket é fechado pelo próprio _executar ao sair do loop
+        if self.encerrado is not None:
+            self.encerrado.set()
+        else:
+            self.socket.close()
+        self.registro.encerrar()
+        print(f"\n[Roteador {self.ip_roteador} encerrado]")
+
+
+class RoteadorMultiprocesso(Roteador):
+    """Roteador com processos trabalhadores que encaminham '!' em paralelo
+    (ver trabalhadores.py). Este processo continua sendo o único escritor
+    da tabela e trata as mensagens de controle; cada instantâneo publicado
+    é copiado para a memória compartilhada lida pelos trabalhadores."""
+    
+    def __init__(self, ip_roteador: str, porta: int = 6000, trabalhadores: int = 2):
+        self.numero_trabalhadores = max(1, min(trabalhadores, MAXIMO_TRABALHADORES))
+        self.memoria: Optional[MemoriaTabela] = None
+        super().__init__(ip_roteador, porta)
+        self.memoria = MemoriaTabela()
+        self.trava_memoria = threading.Lock()
+        self.processos: List[multiprocessing.Process] = []
+        self.conexoes: List[Connection] = []
+        # Destinos e próximos saltos já convertidos para a memória compartilhada
+        self.prefixos_destinos: Dict[str, Optional[Tuple[int, int]]] = {}
+        self.enderecos_saltos: Dict[str, int] = {}
+        self.tabela.observadores_publicacao.append(self._publicar_para_trabalhadores)
+        for campo, nome, ajuda in ((0, 'roteador_trabalhador_encaminhadas_total', 'Mensagens ! encaminhadas pelo trabalhador'),
+                                   (1, 'roteador_trabalhador_bytes_total', 'Bytes de mensagens ! encaminhadas pelo trabalhador'),
+                                   (2, 'roteador_trabalhador_repassadas_total', 'Datagramas repassados ao processo principal')):
+            self.metricas.contador_calculado(nome, ajuda, ('trabalhador',),
+                                             lambda campo=campo: self._contadores_trabalhadores(campo))
+        
+    def _criar_socket(self) -> socket.socket:
+        # O kernel divide os datagramas entre este socket e os dos trabalhadores
+        return criar_socket_compartilhado(self.ip_roteador, self.porta)
+        
+    def _contadores_trabalhadores(self, campo: int) -> Dict[Tuple[str, ...], float]:
+        with self.trava_memoria:
+            if self.memoria.buffer is None:
+                return {}
+            return {(str(indice),): self.memoria.ler_contadores(indice)[campo]
+                    for indice in range(len(self.processos))}
+        
+    def _invalidar_encaminhamento(self):
+        super()._invalidar_encaminhamento()
+        # A porta de um próximo salto mudou: os trabalhadores também precisam saber
+        if self.memoria is not None:
+            self._publicar_para_trabalhadores(self.tabela.atual)
+            
+    def _publicar_para_trabalhadores(self, instantaneo: InstantaneoTabela):
+        entradas = []
+        for ip_destino, (_, ip_saida, _) in instantaneo.rotas.items():
+            prefixo = self.prefixos_destinos.get(ip_destino)
+            if prefixo is None:
+                if len(self.prefixos_destinos) >= CAPACIDADE_ENTRADAS:
+                    self.prefixos_destinos.clear()
+                prefixo = self.prefixos_destinos[ip_destino] = parsear_prefixo(ip_destino)
+            endereco_saida = self.enderecos_saltos.get(ip_saida)
+            if endereco_saida is None:
+                try:
+                    endereco_saida = ENDERECO_IPV4.unpack(socket.inet_aton(ip_saida))[0]
+                except OSError:
+                    continue
+                self.enderecos_saltos[ip_saida] = endereco_saida
+            if prefixo is not None:
+                entradas.append((prefixo[0], prefixo[1], endereco_saida,
+                                 self.portas_vizinhos.get(ip_saida, self.porta)))
+        with self.trava_memoria:
+            # Temporizadores ainda podem publicar depois do encerramento
+            if self.memoria.buffer is not None:
+                self.memoria.publicar(entradas)
+            
+    def iniciar_trabalhadores(self):
+        self._publicar_para_trabalhadores(self.tabela.atual)
+        contexto = multiprocessing.get_context('spawn')
+        for indice in range(self.numero_trabalhadores):
+            conexao, conexao_trabalhador = contexto.Pipe()
+            processo = contexto.Process(target=executar_trabalhador, daemon=True,
+                                        args=(indice, self.ip_roteador, self.porta, self.memoria.nome,
+                                              conexao_trabalhador))
+            processo.start()
+            conexao_trabalhador.close()
+            self.processos.append(processo)
+            self.conexoes.append(conexao)
+        self.registro.info('INIT', "{quantidade} processos trabalhadores encaminhando '!' na porta {porta}",
+                           quantidade=len(self.processos), porta=self.porta)
+        threading.Thread(target=self.receber_repassadas, daemon=True).start()
+        
+    def receber_repassadas(self):
+        """Thread que trata os datagramas que os trabalhadores não encaminham
+        (controle, entrega local, descartes) como se viessem do socket."""
+        while self.rodando and self.conexoes:
+            for conexao in wait(self.conexoes, 1.0):
+                try:
+                    mensagem = conexao.recv_bytes()
+                except (EOFError, OSError):
+                    self.conexoes.remove(conexao)
+                    if self.rodando:
+                        self.registro.erro('ERRO', "Processo trabalhador encerrado inesperadamente")
+                    continue
+                data, addr = decodificar_repasse(mensagem)
+                try:
+                    self.processar_datagrama(data, addr)
+                except Exception as e:
+                    self.registro.erro('ERRO', "Erro ao processar mensagem de {vizinho}: {erro}",
+                                       vizinho=addr[0], erro=e)
+                    
+    def iniciar(self):
+        self.rodando = True
+        self.iniciar_trabalhadores()
+        super().iniciar()
+        
+    def parar(self):
+        self.rodando = False
+        # Sem a conexão, o trabalhador sai do laço e fecha o próprio socket
+        for conexao in self.conexoes:
+            conexao.close()
+        for processo in self.processos:
+            processo.join(2.0)
+            if processo.is_alive():
+                processo.terminate()
+        super().parar()
+        with self.trava_memoria:
+            self.memoria.fechar()
+
+
 def main():
-    if len(sys.argv) < 2:
-        print("Uso: python roteador.py <IP_ROTEADOR> [porta]")
+    argumentos = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    usar_asyncio = '--asyncio' in sys.argv[1:]
+    processos = next((arg.split('=', 1)[1] for arg in sys.argv[1:] if arg.startswith('--processos=')), None)
+    if len(argumentos) < 1:
+        print("Uso: python roteador.py <IP_ROTEADOR> [porta] [--asyncio | --processos=N]")
         print("Exemplo: python roteador.py 192.168.1.1")
         sys.exit(1)
         
-    ip_roteador = sys.argv[1]
-    porta = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+    ip_roteador = argumentos[0]
+    porta = int(argumentos[1]) if len(argumentos) > 1 else 6000
     
-    roteador = Roteador(ip_roteador, porta)
+    if processos is not None:
+        if not processos.isdigit() or int(processos) < 1:
+            print("--processos precisa de um número de trabalhadores (ex.: --processos=4)")
+            sys.exit(1)
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            print("Este sistema não tem SO_REUSEPORT; o roteador usará um único processo")
+            processos = None
+    if processos is not None:
+        roteador = RoteadorMultiprocesso(ip_roteador, porta, int(processos))
+    else:
+        classe_roteador = RoteadorAsync if usar_asyncio else Roteador
+        roteador = classe_roteador(ip_roteador, porta)
     roteador.carregar_configuracao()
     roteador.iniciar()
 
@@ -0,0 +1,355 @@
+"""Simulador de vários roteadores em um único processo.
+
+Os roteadores trocam mensagens por um transporte em memória com relógio
+virtual (simulação de eventos discretos), então centenas de roteadores
+rodam em poucos segundos. Serve de benchmark de convergência do protocolo:
+mede tempo de convergência, mensagens e bytes enviados e tempo de CPU por
+roteador, na subida da rede e após cada falha de enlace injetada.
+
+Uso:
+    python simulador.py --topologia anel --roteadores 50
+    python simulador.py --topologia grade --roteadores 100 --falhas 3
+    python simulador.py --topologia aleatoria --roteadores 200 --grau 4 --semente 7
+    python simulador.py --topologia grade --roteadores 400 --roteamento enlace
+"""
+import argparse
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from registro import Registro
+from roteador import (INTERVALO_KEEPALIVE, METRICA_INFINITA, MOTORES_ROTEAMENTO, TEMPO_LIMITE_VIZINHO,
+                      Roteador, tipo_mensagem)
+
+Enlace = Tuple[int, int]
+
+
+class EventoAgendado:
+
+    def __init__(self):
+        self.cancelado = False
+
+    def cancel(self):
+        self.cancelado = True
+
+
+class RoteadorSimulado(Roteador):
+    """Roteador sem socket: envios, temporizadores e relógio são do simulador."""
+
+    def __init__(self, simulador: 'Simulador', ip_roteador: str, porta: int = 6000):
+        self.simulador = simulador
+        super().__init__(ip_roteador, porta)
+        # O simulador executa um evento por vez
+        self.lock = contextlib.nullcontext()
+        self.relogio = simulador.relogio
+        # Registro síncrono compartilhado: sem uma thread por roteador
+        self.registro = simulador.registro
+
+    def _criar_socket(self):
+        return None
+
+    def _enviar_datagrama(self, dados: bytes, destino: Tuple[str, int]):
+        self.simulador.transmitir(self.ip_roteador, destino[0], dados)
+
+    def _agendar(self, atraso: float, funcao: Callable[[], None]):
+        return self.simulador.agendar(atraso, self, funcao)
+
+    def _notificar_novo_prazo(self):
+        self.simulador.agendar_verificacao(self)
+
+    def parar(self):
+        self.rodando = False
+
+
+def ip_simulado(indice: int) -> str:
+    return f"10.{indice // 62500 % 250}.{indice // 250 % 250}.{indice % 250 + 1}"
+
+
+def topologia_anel(n: int) -> List[Enlace]:
+    if n < 3:
+        return [(0, 1)] if n == 2 else []
+    return [(i, (i + 1) % n) for i in range(n)]
+
+
+def topologia_grade(n: int) -> List[Enlace]:
+    colunas = math.ceil(math.sqrt(n))
+    enlaces = []
+    for i in range(n):
+        if (i + 1) % colunas and i + 1 < n:
+            enlaces.append((i, i + 1))
+        if i + colunas < n:
+            enlaces.append((i, i + colunas))
+    return enlaces
+
+
+def topologia_aleatoria(n: int, grau: float, gerador: random.Random) -> List[Enlace]:
+    """Grafo conexo: árvore aleatória mais enlaces extras até o grau médio."""
+    enlaces: Set[Enlace] = set()
+    for i in range(1, n):
+        enlaces.add((gerador.randrange(i), i))
+    alvo = max(n - 1, int(n * grau / 2))
+    maximo = n * (n - 1) // 2
+    while len(enlaces) < min(alvo, maximo):
+        a, b = sorted(gerador.sample(range(n), 2))
+        enlaces.add((a, b))
+    return sorted(enlaces)
+
+
+class Simulador:
+
+    def __init__(self, n: int, enlaces: List[Enlace], latencia: float = 0.001,
+                 intervalo_keepalive: float = INTERVALO_KEEPALIVE,
+                 tempo_limite: float = TEMPO_LIMITE_VIZINHO,
+                 metrica_infinita: int = METRICA_INFINITA, semente: int = 0,
+                 roteamento: str = 'vetor'):
+        self.agora = 0.0
+        self.latencia = latencia
+        self.gerador = random.Random(semente)
+        self.eventos: List[Tuple[float, int, Optional[str], Callable[[], None], EventoAgendado]] = []
+        self.sequencia = itertools.count()
+        self.registro = Registro(assincrono=False)
+        self.verificacoes: Dict[str, float] = {}
+
+        self.enlaces: Set[frozenset] = set()
+        self.ips = [ip_simulado(i) for i in range(n)]
+        self.roteadores: Dict[str, RoteadorSimulado] = {}
+
+        self.mensagens: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.mensagens_por_tipo: Dict[str, int] = {}
+        self.tempo_cpu: Dict[str, float] = {}
+        self.alteracoes_rotas = 0
+        self.ultima_alteracao = 0.0
+
+        for ip in self.ips:
+            roteador = RoteadorSimulado(self, ip)
+            roteador.intervalo_keepalive = intervalo_keepalive
+            roteador.monitor_vizinhos.tempo_limite = tempo_limite
+            roteador.definir_horizonte(roteador.modo_horizonte, metrica_infinita)
+            roteador.definir_motor(roteamento)
+            roteador.tabela.observadores.append(self._registrar_alteracao)
+            self.roteadores[ip] = roteador
+            self.mensagens[ip] = 0
+            self.bytes[ip] = 0
+            self.tempo_cpu[ip] = 0.0
+
+        for a, b in enlaces:
+            ip_a, ip_b = self.ips[a], self.ips[b]
+            self.enlaces.add(frozenset((ip_a, ip_b)))
+            self.roteadores[ip_a].adicionar_vizinho(ip_b, 6000)
+            self.roteadores[ip_b].adicionar_vizinho(ip_a, 6000)
+
+    def relogio(self) -> float:
+        return self.agora
+
+    def _registrar_alteracao(self, *_):
+        self.alteracoes_rotas += 1
+        self.ultima_alteracao = self.agora
+
+    def agendar(self, atraso: float, roteador: Optional[RoteadorSimulado],
+                funcao: Callable[[], None]) -> EventoAgendado:
+        evento = EventoAgendado()
+        ip = roteador.ip_roteador if roteador is not None else None
+        heapq.heappush(self.eventos, (self.agora + atraso, next(self.sequencia), ip, funcao, evento))
+        return evento
+
+    def agendar_verificacao(self, roteador: RoteadorSimulado):
+        prazo = roteador.monitor_vizinhos.proximo_prazo()
+        if prazo is None:
+            return
+        atual = self.verificacoes.get(roteador.ip_roteador)
+        if atual is not None and atual <= prazo:
+            return
+        self.verificacoes[roteador.ip_roteador] = prazo
+        self.agendar(max(0.0, prazo - self.agora), roteador, lambda: self._verificar(roteador, prazo))
+
+    def _verificar(self, roteador: RoteadorSimulado, prazo: float):
+        if self.verificacoes.get(roteador.ip_roteador) != prazo:
+            return
+        del self.verificacoes[roteador.ip_roteador]
+        roteador.verificar_falhas_vizinhos()
+        self.agendar_verificacao(roteador)
+
+    def _periodico(self, roteador: RoteadorSimulado, intervalo: float, funcao: Callable[[], None]):
+        def executar():
+            if roteador.rodando:
+                funcao()
+                self.agendar(intervalo, roteador, executar)
+        return executar
+
+    def transmitir(self, origem: str, destino: str, dados: bytes):
+        self.mensagens[origem] += 1
+        self.bytes[origem] += len(dados)
+        tipo = tipo_mensagem(dados)
+        self.mensagens_por_tipo[tipo] = self.mensagens_por_tipo.get(tipo, 0) + 1
+
+        roteador = self.roteadores.get(destino)
+        if roteador is None or not roteador.rodando or frozenset((origem, destino)) not in self.enlaces:
+            return
+        self.agendar(self.latencia, roteador, lambda: roteador.processar_datagrama(dados, (origem, 6000)))
+
+    def iniciar(self):
+        for roteador in self.roteadores.values():
+            roteador.rodando = True
+            self.agendar(self.gerador.uniform(0, 0.1), roteador, roteador.anunciar_entrada_rede)
+            fase = self.gerador.uniform(0, roteador.intervalo_keepalive)
+            self.agendar(fase, roteador,
+                         self._periodico(roteador, roteador.intervalo_keepalive, roteador.enviar_keepalive))
+            self.agendar_verificacao(roteador)
+
+    def executar_ate(self, limite: float):
+        while self.eventos and self.eventos[0][0] <= limite:
+            instante, _, ip, funcao, evento = heapq.heappop(self.eventos)
+            if evento.cancelado:
+                continue
+            self.agora = instante
+            inicio = time.process_time()
+            funcao()
+            if ip is not None:
+                self.tempo_cpu[ip] += time.process_time() - inicio
+        self.agora = max(self.agora, limite)
+
+    def aguardar_convergencia(self, silencio: float, limite: float = 600.0) -> float:
+        """Executa até as tabelas ficarem silencio segundos sem mudar.
+        Retorna o instante da última alteração."""
+        inicio = self.agora
+        passo = min(1.0, silencio / 4)
+        while self.agora - inicio < limite:
+            self.executar_ate(self.agora + passo)
+            if self.agora - max(self.ultima_alteracao, inicio) >= silencio:
+                break
+        return max(self.ultima_alteracao, inicio)
+
+    def falhar_enlace(self, ip_a: str, ip_b: str):
+        self.enlaces.discard(frozenset((ip_a, ip_b)))
+
+    def restaurar_enlace(self, ip_a: str, ip_b: str):
+        self.enlaces.add(frozenset((ip_a, ip_b)))
+
+    def distancias(self, origem: str) -> Dict[str, int]:
+        adjacencia: Dict[str, List[str]] = {}
+        for enlace in self.enlaces:
+            a, b = tuple(enlace)
+            adjacencia.setdefault(a, []).append(b)
+            adjacencia.setdefault(b, []).append(a)
+        distancias = {origem: 0}
+        fila = deque([origem])
+        while fila:
+            atual = fila.popleft()
+            for vizinho in adjacencia.get(atual, []):
+                if vizinho not in distancias:
+                    distancias[vizinho] = distancias[atual] + 1
+                    fila.append(vizinho)
+        return distancias
+
+    def rotas_incorretas(self) -> int:
+        """Quantos pares (roteador, destino) têm, pela busca do prefixo mais
+        longo, métrica diferente do menor caminho real (limitado pela
+        métrica infinita)."""
+        incorretas = 0
+        for ip, roteador in self.roteadores.items():
+            distancias = self.distancias(ip)
+            for destino in self.ips:
+                if destino == ip:
+                    continue
+                distancia = distancias.get(destino)
+                esperada = distancia if distancia is not None and distancia < roteador.metrica_infinita else None
+                rota = roteador.tabela.buscar_rota(destino)
+                if (rota[0] if rota is not None else None) != esperada:
+                    incorretas += 1
+        return incorretas
+        
+    def media_entradas(self) -> float:
+        return sum(len(r.tabela.rotas) for r in self.roteadores.values()) / len(self.roteadores)
+
+    def contadores(self) -> Tuple[int, int, float, float]:
+        cpu = list(self.tempo_cpu.values())
+        return sum(self.mensagens.values()), sum(self.bytes.values()), sum(cpu), max(cpu)
+
+
+def executar_benchmark(topologia: str, n: int, grau: float = 4.0, falhas: int = 1,
+                       semente: int = 0, **opcoes) -> List[Dict[str, object]]:
+    gerador = random.Random(semente)
+    if topologia == 'anel':
+        enlaces = topologia_anel(n)
+    elif topologia == 'grade':
+        enlaces = topologia_grade(n)
+    elif topologia == 'aleatoria':
+        enlaces = topologia_aleatoria(n, grau, gerador)
+    else:
+        raise ValueError(f"Topologia desconhecida: {topologia}")
+
+    resultados = []
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        simulador = Simulador(n, enlaces, semente=semente, **opcoes)
+        exemplo = next(iter(simulador.roteadores.values()))
+        silencio = exemplo.monitor_vizinhos.tempo_limite + 2 * exemplo.intervalo_keepalive
+
+        def medir(fase: str, inicio: float, antes: Tuple[int, int, float, float]):
+            fim = simulador.aguardar_convergencia(silencio)
+            depois = simulador.contadores()
+            resultados.append({
+                'fase': fase,
+                'convergencia': fim - inicio,
+                'mensagens': depois[0] - antes[0],
+                'bytes': depois[1] - antes[1],
+                'cpu_total': depois[2] - antes[2],
+                'cpu_media': (depois[2] - antes[2]) / n,
+                'entradas': simulador.media_entradas(),
+                'rotas_incorretas': simulador.rotas_incorretas(),
+            })
+
+        antes = simulador.contadores()
+        simulador.iniciar()
+        medir('inicial', 0.0, antes)
+
+        for _ in range(min(falhas, len(enlaces))):
+            a, b = enlaces.pop(gerador.randrange(len(enlaces)))
+            ip_a, ip_b = simulador.ips[a], simulador.ips[b]
+            antes = simulador.contadores()
+            inicio = simulador.agora
+            simulador.falhar_enlace(ip_a, ip_b)
+            medir(f"falha {ip_a}-{ip_b}", inicio, antes)
+
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de convergência com roteadores simulados")
+    parser.add_argument('--topologia', choices=('anel', 'grade', 'aleatoria'), default='anel')
+    parser.add_argument('--roteadores', type=int, default=20)
+    parser.add_argument('--grau', type=float, default=4.0, help="grau médio da topologia aleatória")
+    parser.add_argument('--falhas', type=int, default=1, help="enlaces derrubados, um por vez")
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--keepalive', type=float, default=INTERVALO_KEEPALIVE)
+    parser.add_argument('--tempo-limite', type=float, default=TEMPO_LIMITE_VIZINHO)
+    parser.add_argument('--infinito', type=int, default=METRICA_INFINITA)
+    parser.add_argument('--roteamento', choices=tuple(MOTORES_ROTEAMENTO), default='vetor',
+                        help="vetor de distância ou estado de enlace")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    resultados = executar_benchmark(args.topologia, args.roteadores, args.grau, args.falhas, args.semente,
+                                    intervalo_keepalive=args.keepalive, tempo_limite=args.tempo_limite,
+                                    metrica_infinita=args.infinito, roteamento=args.roteamento)
+    duracao = time.perf_counter() - inicio
+
+    print(f"Topologia: {args.topologia}, {args.roteadores} roteadores, roteamento: {args.roteamento}")
+    print(f"{'Fase':<28} {'Converg.(s)':>11} {'Mensagens':>10} {'Bytes':>12} "
+          f"{'CPU total(ms)':>14} {'CPU/rot.(ms)':>13} {'Entradas':>9} {'Incorretas':>10}")
+    print("-" * 114)
+    for r in resultados:
+        print(f"{r['fase']:<28} {r['convergencia']:>11.2f} {r['mensagens']:>10} {r['bytes']:>12} "
+              f"{r['cpu_total'] * 1000:>14.1f} {r['cpu_media'] * 1000:>13.2f} {r['entradas']:>9.1f} "
+              f"{r['rotas_incorretas']:>10}")
+    print(f"\nTempo real da simulação: {duracao:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Codificação de LSAs e cálculo incremental do menor caminho comparado ao
+Dijkstra completo."""
+import random
+import unittest
+
+from estado_enlace import BancoEstadoEnlace, Lsa, codificar_lsa, decodificar_lsa
+
+
+class TesteCodificacaoLsa(unittest.TestCase):
+
+    def test_ida_e_volta(self):
+        casos = [
+            ("10.0.0.1", 1, {}, {}),
+            ("10.0.0.1", 7, {"10.0.0.2": 1, "10.0.0.3": 12}, {}),
+            ("10.0.0.1", 2 ** 40, {}, {"192.168.1.0/24": 0}),
+            ("10.0.0.9", 3, {"10.0.0.2": 0, "10.0.0.8": 5}, {"192.168.1.0/24": 0, "172.16.0.0/12": 3}),
+        ]
+        for origem, sequencia, vizinhos, prefixos in casos:
+            dados = codificar_lsa(origem, sequencia, vizinhos, prefixos)
+            self.assertEqual(decodificar_lsa(dados), (origem, sequencia, vizinhos, prefixos))
+
+    def test_rejeita_invalidos(self):
+        for dados in (b"", b"*10.0.0.2;1", b"$10.0.0.1", b"$10.0.0.1;x", b"$10.0.0.1;1*10.0.0.2",
+                      b"$10.0.0.1;1*10.0.0.2;-1", b"$10.0.0.1;1+192.168.0.0/24;a", b"$10.0.0.1;1*;;",
+                      b"$10.0.0.1;1*10.0.0.2;\xff"):
+            with self.assertRaises(ValueError, msg=dados):
+                decodificar_lsa(dados)
+
+
+class TesteCalculoIncremental(unittest.TestCase):
+
+    def _conferir(self, banco: BancoEstadoEnlace):
+        referencia = BancoEstadoEnlace(banco.raiz)
+        referencia.lsas = banco.lsas
+        referencia.grafo = banco.grafo
+        referencia.recalcular()
+        self.assertEqual(banco.distancia, referencia.distancia)
+        # Com empates o primeiro salto pode diferir; a métrica não
+        self.assertEqual({destino: metrica for destino, (metrica, _) in banco.rotas().items()},
+                         {destino: metrica for destino, (metrica, _) in referencia.rotas().items()})
+
+    def test_igual_ao_dijkstra_completo(self):
+        aleatorio = random.Random(1)
+        for _ in range(300):
+            nos = [f"10.0.0.{i}" for i in range(aleatorio.randint(3, 25))]
+            vizinhos = {no: {} for no in nos}
+            sequencias = {no: 0 for no in nos}
+            banco = BancoEstadoEnlace(nos[0])
+
+            def publicar(no: str):
+                sequencias[no] += 1
+                banco.instalar(Lsa(no, sequencias[no], dict(vizinhos[no]),
+                                   {f"192.168.{nos.index(no)}.0/24": 1}, b"", 0.0))
+
+            for _ in range(40):
+                a, b = aleatorio.sample(nos, 2)
+                operacao = aleatorio.random()
+                if operacao < 0.5:
+                    vizinhos[a][b] = aleatorio.randint(1, 5)
+                elif operacao < 0.8:
+                    vizinhos[a].pop(b, None)
+                elif operacao < 0.9:
+                    vizinhos[a][b] = aleatorio.randint(1, 5)
+                    vizinhos[b][a] = aleatorio.randint(1, 5)
+                    publicar(b)
+                else:
+                    # Roteador que expirou e volta com um LSA novo
+                    banco.remover(a)
+                publicar(a)
+                # Às vezes vários LSAs se acumulam antes de um cálculo
+                if aleatorio.random() < 0.5:
+                    banco.calcular()
+                    self._conferir(banco)
+            banco.calcular()
+            self._conferir(banco)
+
+    def test_lsa_antigo_ignorado(self):
+        banco = BancoEstadoEnlace("a")
+        self.assertTrue(banco.instalar(Lsa("b", 2, {"a": 1}, {}, b"", 0.0)))
+        self.assertFalse(banco.instalar(Lsa("b", 2, {}, {}, b"", 0.0)))
+        self.assertFalse(banco.instalar(Lsa("b", 1, {}, {}, b"", 0.0)))
+        self.assertEqual(banco.lsas["b"].vizinhos, {"a": 1})
+
+    def test_enlace_exige_os_dois_lados(self):
+        banco = BancoEstadoEnlace("a")
+        banco.instalar(Lsa("a", 1, {"b": 1}, {}, b"", 0.0))
+        banco.instalar(Lsa("b", 1, {"c": 1}, {}, b"", 0.0))
+        banco.instalar(Lsa("c", 1, {"b": 1}, {"192.168.0.0/24": 2}, b"", 0.0))
+        banco.calcular()
+        self.assertNotIn("b", banco.distancia)
+        # b passa a anunciar a: o caminho até c e a rede dele aparecem
+        banco.instalar(Lsa("b", 2, {"a": 1, "c": 1}, {}, b"", 0.0))
+        banco.calcular()
+        self.assertEqual(banco.rotas()["c"], (2, "b"))
+        self.assertEqual(banco.rotas()["192.168.0.0/24"], (4, "b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+"""GerenciadorTransferencias entre dois roteadores falsos, com relógio
+virtual e um canal que perde, atrasa e reordena mensagens."""
+import heapq
+import itertools
+import os
+import random
+import tempfile
+import unittest
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metricas import Metricas
+from simulador import EventoAgendado
+from transferencia import (CABECALHO_DADOS, MARCADOR_TRANSFERENCIA, MAXIMO_BLOCOS_SACK, MAXIMO_EXPIRACOES,
+                           MAXIMO_RECEPCOES, MAXIMO_SEGMENTOS, RTO_INICIAL, RTO_MAXIMO, RTO_MINIMO,
+                           TAMANHO_DADOS_SEGMENTO, TIPO_DADOS, GerenciadorTransferencias, Recepcao, codificar_ack)
+
+
+class RegistroFalso:
+
+    def __init__(self):
+        self.eventos: List[Tuple[str, Dict]] = []
+
+    def info(self, tipo: str, mensagem="", **campos):
+        self.eventos.append((tipo, campos))
+
+    aviso = erro = info
+
+    def tipos(self) -> List[str]:
+        return [tipo for tipo, _ in self.eventos]
+
+
+class TabelaFalsa:
+    """Todo destino tem rota por um vizinho."""
+
+    def __init__(self):
+        self.atual = self
+
+    def buscar_rota(self, destino: str) -> Tuple[int, str]:
+        return 1, destino
+
+
+class Canal:
+    """Relógio virtual e fila de eventos. descartar(origem, corpo) decide as
+    perdas; atraso(origem, corpo) o tempo de cada mensagem em trânsito."""
+
+    def __init__(self, descartar: Callable[[str, bytes], bool], atraso: Callable[[str, bytes], float]):
+        self.agora = 0.0
+        self.fila: List = []
+        self.ordem = itertools.count()
+        self.descartar = descartar
+        self.atraso = atraso
+        self.roteadores: Dict[str, 'RoteadorFalso'] = {}
+        # (instante, seq) de cada segmento de dados enviado
+        self.segmentos: List[Tuple[float, int]] = []
+
+    def agendar(self, atraso: float, funcao: Callable[[], None]) -> EventoAgendado:
+        evento = EventoAgendado()
+        heapq.heappush(self.fila, (self.agora + atraso, next(self.ordem), evento, funcao))
+        return evento
+
+    def transmitir(self, origem: str, destino: str, corpo: bytes):
+        if corpo[1] == TIPO_DADOS:
+            self.segmentos.append((self.agora, CABECALHO_DADOS.unpack_from(corpo)[3]))
+        if self.descartar(origem, corpo):
+            return
+        receptor = self.roteadores[destino]
+        self.agendar(self.atraso(origem, corpo), lambda: receptor.transferencias.receber(origem, corpo))
+
+    def executar(self, limite: float = 3600.0):
+        while self.fila and self.agora < limite:
+            instante, _, evento, funcao = heapq.heappop(self.fila)
+            self.agora = instante
+            if not evento.cancelado:
+                funcao()
+
+    def envios(self, seq: int) -> List[float]:
+        return [instante for instante, s in self.segmentos if s == seq]
+
+
+class RoteadorFalso:
+    """Só o que o GerenciadorTransferencias usa do Roteador."""
+
+    def __init__(self, canal: Canal, ip_roteador: str, diretorio: str):
+        self.canal = canal
+        self.ip_roteador = ip_roteador
+        self.tabela = TabelaFalsa()
+        self.registro = RegistroFalso()
+        self.metricas = Metricas()
+        self.contador_falhas_parse = self.metricas.contador('falhas', '', ('tipo',))
+        self.relogio = lambda: canal.agora
+        self._agendar = canal.agendar
+        canal.roteadores[ip_roteador] = self
+        self.transferencias = GerenciadorTransferencias(self, os.path.join(diretorio, ip_roteador))
+
+    def enviar_mensagem_dados(self, destino: str, corpo: bytes) -> bool:
+        self.canal.transmitir(self.ip_roteador, destino, corpo)
+        return True
+
+
+def seq_dados(corpo: bytes) -> Optional[int]:
+    return CABECALHO_DADOS.unpack_from(corpo)[3] if corpo[1] == TIPO_DADOS else None
+
+
+class TesteTransferencia(unittest.TestCase):
+
+    def setUp(self):
+        temporario = tempfile.TemporaryDirectory()
+        self.addCleanup(temporario.cleanup)
+        self.diretorio = temporario.name
+
+    def _transferir(self, canal: Canal, tamanho: int) -> Tuple[RoteadorFalso, RoteadorFalso, bytes]:
+        emissor = RoteadorFalso(canal, "10.0.0.1", self.diretorio)
+        receptor = RoteadorFalso(canal, "10.0.0.2", self.diretorio)
+        conteudo = random.Random(tamanho).randbytes(tamanho)
+        caminho = os.path.join(self.diretorio, "dados.bin")
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+        self.assertIsNotNone(emissor.transferencias.enviar_arquivo(receptor.ip_roteador, caminho))
+        canal.executar()
+        return emissor, receptor, conteudo
+
+    def _conferir_recebido(self, receptor: RoteadorFalso, conteudo: bytes):
+        recebidos = [campos for tipo, campos in receptor.registro.eventos if tipo == 'ARQUIVO RECEBIDO']
+        self.assertEqual(len(recebidos), 1)
+        with open(recebidos[0]['caminho'], 'rb') as f:
+            self.assertEqual(f.read(), conteudo)
+
+    def test_integro_com_perda_e_reordenacao(self):
+        for semente in range(5):
+            aleatorio = random.Random(semente)
+            canal = Canal(lambda origem, corpo: aleatorio.random() < 0.15,
+                          lambda origem, corpo: aleatorio.uniform(0.01, 0.05))
+            emissor, receptor, conteudo = self._transferir(canal, 300 * TAMANHO_DADOS_SEGMENTO + 17)
+            self.assertIn('TRANSFERÊNCIA CONCLUÍDA', emissor.registro.tipos())
+            self.assertEqual(emissor.transferencias.envios, {})
+            self._conferir_recebido(receptor, conteudo)
+
+    def test_retransmissao_rapida_so_dos_buracos(self):
+        perdidos = {5, 12, 13, 30}
+        descartados = set()
+
+        def descartar(origem: str, corpo: bytes) -> bool:
+            seq = seq_dados(corpo)
+            if seq in perdidos and seq not in descartados:
+                descartados.add(seq)
+                return True
+            return False
+
+        def atraso(origem: str, corpo: bytes) -> float:
+            # Cada segmento par chega logo depois do ímpar seguinte:
+            # reordenação abaixo do limiar, que não pode gerar retransmissões
+            seq = seq_dados(corpo)
+            if seq is None:
+                return 0.02
+            return 0.02 + 1e-5 * (seq + 1.5 if seq % 2 == 0 else seq)
+
+        canal = Canal(descartar, atraso)
+        emissor, receptor, conteudo = self._transferir(canal, 40 * TAMANHO_DADOS_SEGMENTO)
+        self._conferir_recebido(receptor, conteudo)
+        retransmitidos = {seq for _, seq in canal.segmentos if len(canal.envios(seq)) > 1}
+        self.assertEqual(retransmitidos, perdidos)
+        for seq in perdidos:
+            primeiro, segundo = canal.envios(seq)
+            # Pela retransmissão rápida: antes de qualquer RTO vencer
+            self.assertLess(segundo - primeiro, RTO_MINIMO)
+
+    def test_rto_dobra_a_cada_expiracao(self):
+        canal = Canal(lambda origem, corpo: seq_dados(corpo) is not None, lambda origem, corpo: 0.01)
+        self._transferir(canal, 20 * TAMANHO_DADOS_SEGMENTO)
+        envios = canal.envios(0)
+        intervalos = [depois - antes for antes, depois in zip(envios, envios[1:])]
+        esperados = [min(RTO_INICIAL * 2 ** i, RTO_MAXIMO) for i in range(MAXIMO_EXPIRACOES)]
+        self.assertEqual(len(intervalos), len(esperados))
+        for intervalo, esperado in zip(intervalos, esperados):
+            self.assertAlmostEqual(intervalo, esperado, places=6)
+
+    def test_abandona_apos_maximo_expiracoes(self):
+        canal = Canal(lambda origem, corpo: seq_dados(corpo) is not None, lambda origem, corpo: 0.01)
+        emissor, receptor, _ = self._transferir(canal, 20 * TAMANHO_DADOS_SEGMENTO)
+        self.assertEqual(emissor.registro.tipos().count('TRANSFERÊNCIA FALHOU'), 1)
+        self.assertNotIn('TRANSFERÊNCIA CONCLUÍDA', emissor.registro.tipos())
+        self.assertEqual(emissor.transferencias.envios, {})
+        # Nenhum temporizador ficou vivo depois do abandono
+        self.assertEqual([evento for _, _, evento, _ in canal.fila if not evento.cancelado], [])
+        esperado = sum(min(RTO_INICIAL * 2 ** i, RTO_MAXIMO) for i in range(MAXIMO_EXPIRACOES + 1))
+        self.assertAlmostEqual(canal.agora, esperado, places=6)
+
+
+class TesteSegmentosInvalidos(unittest.TestCase):
+
+    def setUp(self):
+        temporario = tempfile.TemporaryDirectory()
+        self.addCleanup(temporario.cleanup)
+        self.canal = Canal(lambda origem, corpo: False, lambda origem, corpo: 0.01)
+        self.receptor = RoteadorFalso(self.canal, "10.0.0.2", temporario.name)
+        RoteadorFalso(self.canal, "10.0.0.1", temporario.name)
+
+    def _dados(self, id_transferencia: int, seq: int, total: int) -> bytes:
+        return CABECALHO_DADOS.pack(MARCADOR_TRANSFERENCIA, TIPO_DADOS, id_transferencia, seq, total, 0) + b'x'
+
+    def test_rejeitados_sem_criar_recepcao(self):
+        transferencias = self.receptor.transferencias
+        for corpo in (self._dados(1, 0, 0), self._dados(1, 5, 5), self._dados(1, 0, MAXIMO_SEGMENTOS + 1),
+                      self._dados(1, 0, 2 ** 32 - 1), MARCADOR_TRANSFERENCIA + b'\x07' + bytes(20),
+                      MARCADOR_TRANSFERENCIA, codificar_ack(1, 0, 0, [])[:-1]):
+            transferencias.receber("10.0.0.1", corpo)
+        self.assertEqual(transferencias.recepcoes, {})
+        self.assertEqual(self.receptor.contador_falhas_parse.valores[('transferência',)], 7)
+        # Nenhum ACK foi respondido
+        self.assertEqual(self.canal.fila, [])
+
+    def test_total_diferente_do_anterior(self):
+        transferencias = self.receptor.transferencias
+        transferencias.receber("10.0.0.1", self._dados(1, 1, 4))
+        transferencias.receber("10.0.0.1", self._dados(1, 2, 8))
+        self.assertEqual(transferencias.recepcoes[("10.0.0.1", 1)].total, 4)
+        self.assertEqual(transferencias.recepcoes[("10.0.0.1", 1)].partes.keys(), {1})
+
+    def test_limite_de_recepcoes(self):
+        transferencias = self.receptor.transferencias
+        for id_transferencia in range(MAXIMO_RECEPCOES + 3):
+            transferencias.receber("10.0.0.1", self._dados(id_transferencia, 1, 4))
+        self.assertEqual(len(transferencias.recepcoes), MAXIMO_RECEPCOES)
+        self.assertIn('TRANSFERÊNCIA RECUSADA', self.receptor.registro.tipos())
+
+
+class TesteRecepcao(unittest.TestCase):
+
+    def test_blocos_sack_iguais_a_ordenar_tudo(self):
+        aleatorio = random.Random(1)
+        for _ in range(300):
+            total = aleatorio.randint(1, 80)
+            recepcao = Recepcao(total, 0.0)
+            for _ in range(2 * total):
+                seq = aleatorio.randrange(total)
+                novo = seq not in recepcao.partes
+                self.assertEqual(recepcao.registrar(seq, b''), novo)
+                acumulado = 0
+                while acumulado in recepcao.partes:
+                    acumulado += 1
+                self.assertEqual(recepcao.acumulado, acumulado)
+                blocos: List[Tuple[int, int]] = []
+                for s in sorted(s for s in recepcao.partes if s > acumulado):
+                    if blocos and blocos[-1][1] == s:
+                        blocos[-1] = (blocos[-1][0], s + 1)
+                    else:
+                        blocos.append((s, s + 1))
+                self.assertEqual(recepcao.blocos_sack(), blocos[:MAXIMO_BLOCOS_SACK])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+"""Encaminhamento de mensagens '!' em vários processos.
+
+Os processos trabalhadores abrem sockets com SO_REUSEPORT no mesmo IP e
+porta do roteador, então o kernel distribui entre eles (e o processo
+principal) os datagramas recebidos, por endereço de origem. Cada
+trabalhador só encaminha '!': o resto (mensagens de controle, entrega
+local, descartes) é repassado ao processo principal por um Pipe, junto com
+o endereço de origem.
+
+O processo principal é o único que altera a tabela e publica, a cada novo
+instantâneo, a lista compacta de prefixos -> (próximo salto, porta) em um
+bloco de multiprocessing.shared_memory. A escrita usa um contador de
+sequência (ímpar durante a escrita): o trabalhador confere a sequência a
+cada datagrama e só relê a tabela quando ela mudou.
+"""
+import select
+import socket
+import struct
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Tuple
+
+# sequência, número de entradas, tabela completa (0 se não coube no bloco)
+CABECALHO_MEMORIA = struct.Struct('!QIB')
+# rede IPv4, tamanho do prefixo, IPv4 do próximo salto, porta
+ENTRADA_MEMORIA = struct.Struct('!IBIH')
+# mensagens encaminhadas, bytes encaminhados, datagramas repassados
+CONTADORES_TRABALHADOR = struct.Struct('!QQQ')
+CAPACIDADE_ENTRADAS = 65536
+MAXIMO_TRABALHADORES = 64
+# Endereço de origem antes de cada datagrama repassado ao processo principal
+ENDERECO_REPASSE = struct.Struct('!4sH')
+TAMANHO_BUFFER_RECEPCAO = 65535
+MAXIMO_LOTE_RECEPCAO = 256
+# Espera máxima (s) pelo buffer de envio cheio antes de desistir do datagrama
+TEMPO_LIMITE_ENVIO = 1.0
+# Leituras da tabela com uma escrita em andamento antes de desistir
+MAXIMO_TENTATIVAS_LEITURA = 1000
+
+Entrada = Tuple[int, int, int, int]
+
+
+def criar_socket_compartilhado(ip: str, porta: int) -> socket.socket:
+    """Socket UDP não bloqueante que divide a porta com os demais processos."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((ip, porta))
+    sock.setblocking(False)
+    return sock
+
+
+def enviar_datagrama(sock: socket.socket, dados: bytes, destino: Tuple[str, int]):
+    """sendto em socket não bloqueante. Com o buffer de envio cheio espera o
+    socket ficar gravável, como um socket bloqueante faria, em vez de perder
+    o datagrama; BlockingIOError só depois de TEMPO_LIMITE_ENVIO."""
+    prazo = None
+    while True:
+        try:
+            sock.sendto(dados, destino)
+            return
+        except (BlockingIOError, InterruptedError):
+            agora = time.monotonic()
+            if prazo is None:
+                prazo = agora + TEMPO_LIMITE_ENVIO
+            elif agora >= prazo:
+                raise
+            select.select([], [sock], [], prazo - agora)
+
+
+class MemoriaTabela:
+    """Bloco compartilhado: cabeçalho, contadores de cada trabalhador e as
+    entradas da tabela de encaminhamento."""
+
+    def __init__(self, nome: Optional[str] = None, capacidade: int = CAPACIDADE_ENTRADAS):
+        self.capacidade = capacidade
+        tamanho = (CABECALHO_MEMORIA.size + MAXIMO_TRABALHADORES * CONTADORES_TRABALHADOR.size +
+                   capacidade * ENTRADA_MEMORIA.size)
+        self.criador = nome is None
+        if self.criador:
+            self.memoria = shared_memory.SharedMemory(create=True, size=tamanho)
+        else:
+            self.memoria = shared_memory.SharedMemory(name=nome)
+        self.nome = self.memoria.name
+        self.buffer = self.memoria.buf
+        self.inicio_entradas = CABECALHO_MEMORIA.size + MAXIMO_TRABALHADORES * CONTADORES_TRABALHADOR.size
+        self.sequencia = 0
+
+    def publicar(self, entradas: List[Entrada]):
+        """Só um escritor (o processo principal, com a própria trava)."""
+        completa = len(entradas) <= self.capacidade
+        if not completa:
+            # Os trabalhadores repassam todo '!' até a tabela voltar a caber
+            entradas = []
+        self.sequencia += 1
+        CABECALHO_MEMORIA.pack_into(self.buffer, 0, self.sequencia, 0, 0)
+        deslocamento = self.inicio_entradas
+        for entrada in entradas:
+            ENTRADA_MEMORIA.pack_into(self.buffer, deslocamento, *entrada)
+            deslocamento += ENTRADA_MEMORIA.size
+        self.sequencia += 1
+        CABECALHO_MEMORIA.pack_into(self.buffer, 0, self.sequencia, len(entradas), int(completa))
+
+    def sequencia_atual(self) -> int:
+        return CABECALHO_MEMORIA.unpack_from(self.buffer, 0)[0]
+
+    def ler(self) -> Tuple[int, bool, List[Entrada]]:
+        """(sequência, tabela completa, entradas), relendo se uma escrita
+        estava em andamento. Depois de MAXIMO_TENTATIVAS_LEITURA (o processo
+        principal pode ter morrido no meio da escrita) a tabela é dada como
+        incompleta: os datagramas vão ao processo principal e a leitura é
+        refeita quando a sequência mudar."""
+        sequencia = 0
+        for _ in range(MAXIMO_TENTATIVAS_LEITURA):
+            sequencia, quantidade, completa = CABECALHO_MEMORIA.unpack_from(self.buffer, 0)
+            if sequencia % 2:
+                continue
+            fim = self.inicio_entradas + quantidade * ENTRADA_MEMORIA.size
+            dados = bytes(self.buffer[self.inicio_entradas:fim])
+            if CABECALHO_MEMORIA.unpack_from(self.buffer, 0)[0] == sequencia:
+                return sequencia, bool(completa), list(ENTRADA_MEMORIA.iter_unpack(dados))
+        return sequencia, False, []
+
+    def gravar_contadores(self, indice: int, encaminhadas: int, bytes_encaminhados: int, repassadas: int):
+        CONTADORES_TRABALHADOR.pack_into(self.buffer, CABECALHO_MEMORIA.size + indice * CONTADORES_TRABALHADOR.size,
+                                         encaminhadas, bytes_encaminhados, repassadas)
+
+    def ler_contadores(self, indice: int) -> Tuple[int, int, int]:
+        return CONTADORES_TRABALHADOR.unpack_from(self.buffer, CABECALHO_MEMORIA.size +
+                                                  indice * CONTADORES_TRABALHADOR.size)
+
+    def fechar(self):
+        self.buffer = None
+        self.memoria.close()
+        if self.criador:
+            self.memoria.unlink()
+
+
+class Trabalhador:
+    """Laço de um processo trabalhador."""
+
+    def __init__(self, indice: int, ip_roteador: str, porta: int, nome_memoria: str, conexao: Connection):
+        self.indice = indice
+        self.ip_roteador = ip_roteador
+        self.porta = porta
+        self.conexao = conexao
+        self.memoria = MemoriaTabela(nome_memoria)
+        self.socket = criar_socket_compartilhado(ip_roteador, porta)
+        self.buffer_recepcao = bytearray(TAMANHO_BUFFER_RECEPCAO)
+        self.visao_recepcao = memoryview(self.buffer_recepcao)
+        self.sequencia = -1
+        self.completa = False
+        # (máscara, rede -> próximo salto) do prefixo mais longo ao mais curto
+        self.prefixos: List[Tuple[int, Dict[int, Tuple[str, int]]]] = []
+        # destino (bytes crus) -> próximo salto, refeito a cada nova tabela
+        self.encaminhamento: Dict[bytes, Optional[Tuple[str, int]]] = {}
+        self.encaminhadas = 0
+        self.bytes_encaminhados = 0
+        self.repassadas = 0
+
+    def _recarregar(self):
+        self.sequencia, self.completa, entradas = self.memoria.ler()
+        por_tamanho: Dict[int, Dict[int, Tuple[str, int]]] = {}
+        for rede, tamanho, proximo, porta in entradas:
+            por_tamanho.setdefault(tamanho, {})[rede] = (socket.inet_ntoa(struct.pack('!I', proximo)), porta)
+        self.prefixos = [((0xFFFFFFFF << (32 - tamanho)) & 0xFFFFFFFF, por_tamanho[tamanho])
+                         for tamanho in sorted(por_tamanho, reverse=True)]
+        self.encaminhamento = {}
+
+    def _proximo_salto(self, destino: bytes) -> Optional[Tuple[str, int]]:
+        """None quando a mensagem deve ir ao processo principal (sem rota,
+        entrega local ou destino que não é IPv4)."""
+        if destino in self.encaminhamento:
+            return self.encaminhamento[destino]
+        salto = None
+        try:
+            endereco = struct.unpack('!I', socket.inet_pton(socket.AF_INET, destino.decode('ascii')))[0]
+        except (OSError, UnicodeDecodeError):
+            endereco = None
+        if endereco is not None:
+            for mascara, redes in self.prefixos:
+                salto = redes.get(endereco & mascara)
+                if salto is not None:
+                    break
+        if salto is not None and salto[0] == self.ip_roteador:
+            salto = None
+        if len(self.encaminhamento) >= CAPACIDADE_ENTRADAS:
+            self.encaminhamento = {}
+        self.encaminhamento[destino] = salto
+        return salto
+
+    def _encaminhar(self, data: memoryview) -> bool:
+        """Mesmas regras de Roteador.processar_mensagem_texto; False se o
+        datagrama precisa ser tratado pelo processo principal."""
+        if data[:1] != b'!':
+            return False
+        if self.memoria.sequencia_atual() != self.sequencia:
+            self._recarregar()
+        if not self.completa:
+            return False
+        if data[4:5] == b'!' and bytes(data[1:4]).isdigit():
+            ttl: Optional[int] = int(bytes(data[1:4]))
+            inicio = 5
+        else:
+            ttl = None
+            inicio = 1
+        dados = bytes(data)
+        fim_origem = dados.find(b';', inicio)
+        fim_destino = dados.find(b';', fim_origem + 1)
+        if fim_origem < 0 or fim_destino < 0:
+            return False
+        salto = self._proximo_salto(dados[fim_origem + 1:fim_destino])
+        if salto is None:
+            return False
+        if ttl is not None:
+            if ttl <= 1:
+                return False
+            pacote = bytearray(dados)
+            pacote[1:4] = b'%03d' % (ttl - 1)
+            dados = pacote
+        try:
+            enviar_datagrama(self.socket, dados, salto)
+        except OSError:
+            return False
+        self.encaminhadas += 1
+        self.bytes_encaminhados += len(dados)
+        return True
+
+    def _drenar_socket(self):
+        for _ in range(MAXIMO_LOTE_RECEPCAO):
+            try:
+                tamanho, addr = self.socket.recvfrom_into(self.buffer_recepcao)
+            except (BlockingIOError, InterruptedError):
+                break
+            data = self.visao_recepcao[:tamanho]
+            if not self._encaminhar(data):
+                self.repassadas += 1
+                self.conexao.send_bytes(ENDERECO_REPASSE.pack(socket.inet_aton(addr[0]), addr[1]) + bytes(data))
+        self.memoria.gravar_contadores(self.indice, self.encaminhadas, self.bytes_encaminhados, self.repassadas)
+
+    def executar(self):
+        try:
+            while True:
+                prontos, _, _ = select.select([self.socket, self.conexao], [], [], 1.0)
+                if self.conexao in prontos:
+                    # O processo principal fecha a conexão (ou morreu) para encerrar
+                    try:
+                        self.conexao.recv_bytes()
+                    except (EOFError, OSError):
+                        pass
+                    return
+                if self.socket in prontos:
+                    self._drenar_socket()
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        finally:
+            self.socket.close()
+            self.memoria.buffer = None
+            self.memoria.memoria.close()
+
+
+def executar_trabalhador(indice: int, ip_roteador: str, porta: int, nome_memoria: str, conexao: Connection):
+    """Ponto de entrada do processo trabalhador (multiprocessing, spawn)."""
+    Trabalhador(indice, ip_roteador, porta, nome_memoria, conexao).executar()
+
+
+def decodificar_repasse(mensagem: bytes) -> Tuple[bytes, Tuple[str, int]]:
+    ip, porta = ENDERECO_REPASSE.unpack_from(mensagem)
+    return mensagem[ENDERECO_REPASSE.size:], (socket.inet_ntoa(ip), porta)
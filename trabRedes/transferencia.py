@@ -0,0 +1,454 @@
+"""Transferência confiável de arquivos sobre as mensagens '!'.
+
+O arquivo é dividido em segmentos numerados que viajam no texto de
+mensagens '!' comuns, então os roteadores intermediários os encaminham como
+qualquer outra mensagem. O texto de um segmento começa com um byte de
+controle que o comando enviar nunca produz:
+
+    dados: 0x01, 0, id da transferência, sequência, total de segmentos, instante, bytes
+    ACK:   0x01, 1, id da transferência, acumulado, instante ecoado, blocos (início, fim)...
+
+O segmento 0 leva o nome do arquivo. O receptor responde a cada segmento
+com um ACK acumulado (todos os segmentos abaixo dele chegaram) e até
+MAXIMO_BLOCOS_SACK blocos de segmentos recebidos fora de ordem. O emissor
+envia segmentos além do último acumulado até a janela do receptor (janela),
+mas com no máximo uma janela de congestionamento em trânsito, ajustada como
+no TCP: cresce em slow start e depois um segmento por janela confirmada, e
+cai pela metade a cada perda. Um buraco é reenviado assim que
+LIMIAR_RETRANSMISSAO_RAPIDA segmentos posteriores a ele foram confirmados;
+quando vence o RTO (RFC 6298), dobrado a cada expiração, tudo o que não foi
+confirmado é reenviado a partir de uma janela de um segmento. Como nos
+timestamps do TCP (RFC 7323), o ACK ecoa o instante do segmento que o
+gerou, então todo ACK mede o RTT, inclusive o de segmentos reenviados.
+"""
+import bisect
+import heapq
+import os
+import random
+import struct
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+MARCADOR_TRANSFERENCIA = b'\x01'
+TIPO_DADOS = 0
+TIPO_ACK = 1
+# marcador, tipo, id da transferência, sequência, total de segmentos,
+# instante do envio (ms, módulo 2^32)
+CABECALHO_DADOS = struct.Struct('!cBIIII')
+# marcador, tipo, id da transferência, acumulado, instante ecoado
+CABECALHO_ACK = struct.Struct('!cBIII')
+# Segmentos [início, fim) recebidos fora de ordem
+BLOCO_SACK = struct.Struct('!II')
+MAXIMO_BLOCOS_SACK = 16
+
+# Cabe em TAMANHO_MAXIMO_DATAGRAMA (1400) com '!TTL!origem;destino;' IPv4
+TAMANHO_DADOS_SEGMENTO = 1300
+JANELA_PADRAO = 64
+MAXIMO_JANELA_TRANSFERENCIA = 1024
+JANELA_INICIAL_CONGESTIONAMENTO = 10
+LIMIAR_RETRANSMISSAO_RAPIDA = 3
+
+# RTO em segundos (RFC 6298, com mínimo menor que 1s para redes locais)
+RTO_INICIAL = 1.0
+RTO_MINIMO = 0.2
+RTO_MAXIMO = 60.0
+# Expirações seguidas sem progresso até a transferência ser abandonada
+MAXIMO_EXPIRACOES = 8
+# Limites do receptor, que guarda todos os segmentos até o fim: segmentos
+# por arquivo (cerca de 130 MB) e recepções em andamento
+MAXIMO_SEGMENTOS = 100000
+MAXIMO_RECEPCOES = 8
+# Recepções paradas são descartadas; concluídas ainda respondem a
+# segmentos repetidos (ACK final perdido) por esse tempo
+TEMPO_LIMITE_RECEPCAO = 60.0
+DIRETORIO_RECEBIDOS = 'recebidos'
+
+
+def instante_ms(instante: float) -> int:
+    return int(instante * 1000) & 0xFFFFFFFF
+
+
+def codificar_ack(id_transferencia: int, acumulado: int, eco: int, blocos: List[Tuple[int, int]]) -> bytes:
+    return (CABECALHO_ACK.pack(MARCADOR_TRANSFERENCIA, TIPO_ACK, id_transferencia, acumulado, eco) +
+            b''.join(BLOCO_SACK.pack(inicio, fim) for inicio, fim in blocos[:MAXIMO_BLOCOS_SACK]))
+
+
+def decodificar_ack(dados: bytes) -> Tuple[int, int, int, List[Tuple[int, int]]]:
+    """Retorna (id, acumulado, instante ecoado, blocos); ValueError se inválido."""
+    if (len(dados) - CABECALHO_ACK.size) % BLOCO_SACK.size:
+        raise ValueError("ACK truncado")
+    _, _, id_transferencia, acumulado, eco = CABECALHO_ACK.unpack_from(dados)
+    blocos = list(BLOCO_SACK.iter_unpack(dados[CABECALHO_ACK.size:]))
+    return id_transferencia, acumulado, eco, blocos
+
+
+class EstimadorRto:
+    """SRTT e RTTVAR da RFC 6298."""
+
+    def __init__(self):
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = RTO_INICIAL
+
+    def amostra(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MINIMO), RTO_MAXIMO)
+
+    def expirou(self):
+        self.rto = min(self.rto * 2, RTO_MAXIMO)
+
+
+class Envio:
+    __slots__ = ('id', 'destino', 'nome', 'segmentos', 'tamanho', 'janela', 'base', 'proximo',
+                 'enviados', 'confirmados', 'perdidos', 'varrido', 'congestionamento', 'limiar',
+                 'recuperacao', 'estimador', 'temporizador', 'expiracoes', 'retransmissoes', 'inicio')
+
+    def __init__(self, id_transferencia: int, destino: str, nome: str, segmentos: List[bytes],
+                 tamanho: int, janela: int, inicio: float):
+        self.id = id_transferencia
+        self.destino = destino
+        self.nome = nome
+        self.segmentos = segmentos
+        self.tamanho = tamanho
+        self.janela = janela
+        # Todos os segmentos abaixo de base foram confirmados
+        self.base = 0
+        self.proximo = 0
+        # Segmentos em trânsito: sequência -> [instante do último envio, envios]
+        self.enviados: Dict[int, List] = {}
+        # Confirmados por SACK acima de base
+        self.confirmados: Set[int] = set()
+        # Dados como perdidos, reenviados antes de segmentos novos
+        self.perdidos: Set[int] = set()
+        # Buracos abaixo daqui já passaram pela retransmissão rápida
+        self.varrido = 0
+        # Janela de congestionamento (segmentos) e limiar do slow start;
+        # perdas abaixo de recuperacao não reduzem a janela de novo
+        self.congestionamento = float(min(JANELA_INICIAL_CONGESTIONAMENTO, janela))
+        self.limiar = float(janela)
+        self.recuperacao = 0
+        self.estimador = EstimadorRto()
+        self.temporizador = None
+        self.expiracoes = 0
+        self.retransmissoes = 0
+        self.inicio = inicio
+
+
+class Recepcao:
+    __slots__ = ('total', 'partes', 'acumulado', 'fora_de_ordem', 'instante')
+
+    def __init__(self, total: int, instante: float):
+        self.total = total
+        self.partes: Dict[int, bytes] = {}
+        self.acumulado = 0
+        # Intervalos [início, fim) recebidos acima de acumulado, em ordem e
+        # separados por buracos; o primeiro é absorvido quando acumulado o alcança
+        self.fora_de_ordem: List[List[int]] = []
+        self.instante = instante
+
+    def registrar(self, seq: int, dados: bytes) -> bool:
+        """Guarda o segmento e avança acumulado; False se já recebido."""
+        if seq < self.acumulado or seq in self.partes:
+            return False
+        self.partes[seq] = dados
+        blocos = self.fora_de_ordem
+        if seq == self.acumulado:
+            self.acumulado += 1
+            if blocos and blocos[0][0] == self.acumulado:
+                self.acumulado = blocos.pop(0)[1]
+            return True
+        # Primeiro intervalo que começa depois de seq
+        i = bisect.bisect_left(blocos, [seq + 1])
+        junta_anterior = i > 0 and blocos[i - 1][1] == seq
+        junta_seguinte = i < len(blocos) and blocos[i][0] == seq + 1
+        if junta_anterior and junta_seguinte:
+            blocos[i - 1][1] = blocos.pop(i)[1]
+        elif junta_anterior:
+            blocos[i - 1][1] = seq + 1
+        elif junta_seguinte:
+            blocos[i][0] = seq
+        else:
+            blocos.insert(i, [seq, seq + 1])
+        return True
+
+    def blocos_sack(self) -> List[Tuple[int, int]]:
+        return [(inicio, fim) for inicio, fim in self.fora_de_ordem[:MAXIMO_BLOCOS_SACK]]
+
+
+class GerenciadorTransferencias:
+    """Transferências de e para um roteador. Usa dele enviar_mensagem_dados,
+    _agendar, relogio, registro e metricas; uma trava própria serializa a
+    recepção, os temporizadores e os comandos."""
+
+    def __init__(self, roteador, diretorio: str = DIRETORIO_RECEBIDOS):
+        self.roteador = roteador
+        self.diretorio = diretorio
+        self.janela = JANELA_PADRAO
+        self.trava = threading.Lock()
+        self.envios: Dict[int, Envio] = {}
+        # (origem, id) -> recepção em andamento
+        self.recepcoes: Dict[Tuple[str, int], Recepcao] = {}
+        # (origem, id) -> (total de segmentos, instante da conclusão)
+        self.concluidas: Dict[Tuple[str, int], Tuple[int, float]] = {}
+        self.contador_segmentos = roteador.metricas.contador(
+            'roteador_transferencia_segmentos_total', 'Segmentos de transferência de arquivos', ('evento',))
+
+    def enviar_arquivo(self, destino: str, caminho: str) -> Optional[int]:
+        """Inicia a transferência; retorna o id ou None sem rota ou arquivo."""
+        r = self.roteador
+        rota = r.tabela.atual.buscar_rota(destino)
+        if rota is None or rota[1] == r.ip_roteador:
+            r.registro.erro('ERRO', f"Rota não encontrada para {destino}" if rota is None
+                            else f"{destino} pertence a uma rede local deste roteador")
+            return None
+        try:
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+        except OSError as e:
+            r.registro.erro('ERRO', f"Não foi possível ler {caminho}: {e}")
+            return None
+        nome = os.path.basename(caminho)
+        visao = memoryview(conteudo)
+        segmentos = [nome.encode('utf-8')[:TAMANHO_DADOS_SEGMENTO]]
+        segmentos.extend(bytes(visao[i:i + TAMANHO_DADOS_SEGMENTO])
+                         for i in range(0, len(conteudo), TAMANHO_DADOS_SEGMENTO))
+        if len(segmentos) > MAXIMO_SEGMENTOS:
+            r.registro.erro('ERRO', f"{caminho} excede o máximo de {MAXIMO_SEGMENTOS - 1} segmentos")
+            return None
+        with self.trava:
+            id_transferencia = random.getrandbits(32)
+            while id_transferencia in self.envios:
+                id_transferencia = random.getrandbits(32)
+            envio = Envio(id_transferencia, destino, nome, segmentos, len(conteudo), self.janela, r.relogio())
+            self.envios[id_transferencia] = envio
+            r.registro.info('TRANSFERÊNCIA', "{nome} ({tamanho} bytes, {segmentos} segmentos) para {destino}",
+                            nome=nome, tamanho=len(conteudo), segmentos=len(segmentos), destino=destino)
+            self._transmitir(envio)
+            self._armar(envio)
+        return id_transferencia
+
+    def _enviar_segmento(self, envio: Envio, seq: int, agora: float) -> bool:
+        registro = envio.enviados.get(seq)
+        if registro is None:
+            envio.enviados[seq] = [agora, 1]
+            self.contador_segmentos.incrementar('enviado')
+        else:
+            registro[0] = agora
+            registro[1] += 1
+            envio.retransmissoes += 1
+            self.contador_segmentos.incrementar('retransmitido')
+        corpo = CABECALHO_DADOS.pack(MARCADOR_TRANSFERENCIA, TIPO_DADOS, envio.id, seq, len(envio.segmentos),
+                                     instante_ms(agora)) + envio.segmentos[seq]
+        # Sem rota o segmento conta como perdido e volta pelo RTO
+        return self.roteador.enviar_mensagem_dados(envio.destino, corpo)
+
+    def _em_transito(self, envio: Envio) -> int:
+        return len(envio.enviados) - len(envio.confirmados) - len(envio.perdidos)
+
+    def _transmitir(self, envio: Envio):
+        """Reenvia os perdidos e envia segmentos novos enquanto couberem na
+        janela de congestionamento (e os novos, na janela do receptor)."""
+        agora = self.roteador.relogio()
+        em_transito = self._em_transito(envio)
+        if envio.perdidos:
+            for seq in sorted(envio.perdidos):
+                if em_transito >= envio.congestionamento:
+                    return
+                envio.perdidos.discard(seq)
+                self._enviar_segmento(envio, seq, agora)
+                em_transito += 1
+        while (em_transito < envio.congestionamento and envio.proximo < len(envio.segmentos)
+               and envio.proximo < envio.base + envio.janela):
+            self._enviar_segmento(envio, envio.proximo, agora)
+            envio.proximo += 1
+            em_transito += 1
+
+    def _reduzir_janela(self, envio: Envio, em_transito: int, expirou: bool):
+        """Metade do que estava em trânsito, uma vez por janela de dados."""
+        envio.limiar = max(em_transito / 2, 2.0)
+        envio.congestionamento = 1.0 if expirou else envio.limiar
+        envio.recuperacao = envio.proximo
+
+    def _armar(self, envio: Envio):
+        """Um temporizador por transferência, reagendado só quando vence:
+        os ACKs não mexem nele."""
+        if envio.temporizador is not None:
+            return
+        primeiro = min((instante for seq, (instante, _) in envio.enviados.items()
+                        if seq not in envio.confirmados and seq not in envio.perdidos), default=None)
+        if primeiro is None:
+            return
+        atraso = max(primeiro + envio.estimador.rto - self.roteador.relogio(), 0.001)
+        envio.temporizador = self.roteador._agendar(atraso, lambda: self._expirar(envio))
+
+    def _expirar(self, envio: Envio):
+        r = self.roteador
+        with self.trava:
+            envio.temporizador = None
+            if self.envios.get(envio.id) is not envio:
+                return
+            agora = r.relogio()
+            pendentes = [seq for seq in envio.enviados if seq not in envio.confirmados]
+            primeiro = min((envio.enviados[seq][0] for seq in pendentes if seq not in envio.perdidos), default=agora)
+            if agora - primeiro >= envio.estimador.rto:
+                envio.expiracoes += 1
+                if envio.expiracoes > MAXIMO_EXPIRACOES:
+                    del self.envios[envio.id]
+                    r.registro.erro('TRANSFERÊNCIA FALHOU',
+                                    "{nome} para {destino}: sem confirmação após {expiracoes} expirações",
+                                    nome=envio.nome, destino=envio.destino, expiracoes=MAXIMO_EXPIRACOES)
+                    return
+                # Como no TCP: tudo o que não foi confirmado é reenviado,
+                # recomeçando do slow start
+                envio.estimador.expirou()
+                self._reduzir_janela(envio, self._em_transito(envio), expirou=True)
+                envio.perdidos.update(pendentes)
+                self._transmitir(envio)
+            self._armar(envio)
+
+    def receber(self, origem: str, corpo: bytes):
+        """Segmento de dados ou ACK entregue a este roteador."""
+        try:
+            tipo = corpo[1:2]
+            if tipo == bytes([TIPO_DADOS]):
+                _, _, id_transferencia, seq, total, instante = CABECALHO_DADOS.unpack_from(corpo)
+                self._receber_dados(origem, id_transferencia, seq, total, instante, corpo[CABECALHO_DADOS.size:])
+            elif tipo == bytes([TIPO_ACK]):
+                self._receber_ack(*decodificar_ack(corpo))
+            else:
+                raise ValueError(f"Tipo de segmento desconhecido: {tipo.hex() or 'ausente'}")
+        except (ValueError, struct.error) as e:
+            self.roteador.contador_falhas_parse.incrementar('transferência')
+            self.roteador.registro.aviso('ERRO', "Segmento de transferência inválido de {origem}: {erro}",
+                                         origem=origem, erro=e)
+
+    def _receber_ack(self, id_transferencia: int, acumulado: int, eco: int, blocos: List[Tuple[int, int]]):
+        r = self.roteador
+        with self.trava:
+            envio = self.envios.get(id_transferencia)
+            if envio is None:
+                return
+            agora = r.relogio()
+            novos = 0
+            if acumulado > envio.base:
+                for seq in range(envio.base, min(acumulado, envio.proximo)):
+                    del envio.enviados[seq]
+                    if seq not in envio.confirmados:
+                        novos += 1
+                envio.base = min(acumulado, envio.proximo)
+                envio.confirmados = {seq for seq in envio.confirmados if seq >= envio.base}
+                envio.perdidos = {seq for seq in envio.perdidos if seq >= envio.base}
+            for inicio, fim in blocos:
+                for seq in range(max(inicio, envio.base), min(fim, envio.proximo)):
+                    if seq not in envio.confirmados:
+                        envio.confirmados.add(seq)
+                        envio.perdidos.discard(seq)
+                        novos += 1
+            if not novos:
+                return
+            envio.expiracoes = 0
+            envio.estimador.amostra(((instante_ms(agora) - eco) & 0xFFFFFFFF) / 1000)
+
+            if envio.base >= len(envio.segmentos):
+                self._concluir(envio, agora)
+                return
+            if envio.congestionamento < envio.limiar:
+                envio.congestionamento += novos
+            else:
+                envio.congestionamento += novos / envio.congestionamento
+            envio.congestionamento = min(envio.congestionamento, float(envio.janela))
+
+            # Buracos com LIMIAR_RETRANSMISSAO_RAPIDA segmentos confirmados
+            # acima deles são dados como perdidos (cada um só uma vez)
+            if len(envio.confirmados) >= LIMIAR_RETRANSMISSAO_RAPIDA:
+                limite = heapq.nlargest(LIMIAR_RETRANSMISSAO_RAPIDA, envio.confirmados)[-1]
+                em_transito = self._em_transito(envio)
+                perdas = [seq for seq in range(max(envio.varrido, envio.base), limite)
+                          if seq not in envio.confirmados and seq not in envio.perdidos
+                          and envio.enviados[seq][1] == 1]
+                envio.varrido = max(envio.varrido, limite)
+                if perdas:
+                    envio.perdidos.update(perdas)
+                    if perdas[-1] >= envio.recuperacao:
+                        self._reduzir_janela(envio, em_transito, expirou=False)
+            self._transmitir(envio)
+            self._armar(envio)
+
+    def _concluir(self, envio: Envio, agora: float):
+        del self.envios[envio.id]
+        if envio.temporizador is not None:
+            envio.temporizador.cancel()
+            envio.temporizador = None
+        segundos = max(agora - envio.inicio, 1e-9)
+        self.roteador.registro.info(
+            'TRANSFERÊNCIA CONCLUÍDA',
+            "{nome} para {destino}: {tamanho} bytes em {segundos:.3f}s ({vazao:.2f} MB/s), "
+            "{retransmissoes} retransmissões, RTO final {rto:.3f}s",
+            nome=envio.nome, destino=envio.destino, tamanho=envio.tamanho, segundos=segundos,
+            vazao=envio.tamanho / segundos / 1e6, retransmissoes=envio.retransmissoes, rto=envio.estimador.rto)
+
+    def _receber_dados(self, origem: str, id_transferencia: int, seq: int, total: int, instante: int,
+                       dados: bytes):
+        r = self.roteador
+        chave = (origem, id_transferencia)
+        with self.trava:
+            agora = r.relogio()
+            concluida = self.concluidas.get(chave)
+            if concluida is not None:
+                # O ACK final se perdeu: o emissor ainda reenvia
+                r.enviar_mensagem_dados(origem, codificar_ack(id_transferencia, concluida[0], instante, []))
+                return
+            # Validado antes de criar a recepção: nada fica guardado
+            if not seq < total <= MAXIMO_SEGMENTOS:
+                raise ValueError(f"Segmento {seq} de {total} inválido")
+            recepcao = self.recepcoes.get(chave)
+            if recepcao is None:
+                self._descartar_antigas(agora)
+                if len(self.recepcoes) >= MAXIMO_RECEPCOES:
+                    r.registro.aviso('TRANSFERÊNCIA RECUSADA', "{origem}: {quantidade} recepções em andamento",
+                                     limite=1, chave=origem, origem=origem, quantidade=len(self.recepcoes))
+                    return
+                recepcao = Recepcao(total, agora)
+                self.recepcoes[chave] = recepcao
+            elif total != recepcao.total:
+                raise ValueError(f"Total {total} diferente do anterior, {recepcao.total}")
+            recepcao.instante = agora
+            if recepcao.registrar(seq, dados):
+                self.contador_segmentos.incrementar('recebido')
+            r.enviar_mensagem_dados(origem, codificar_ack(id_transferencia, recepcao.acumulado, instante,
+                                                          recepcao.blocos_sack()))
+            if recepcao.acumulado < recepcao.total:
+                return
+            del self.recepcoes[chave]
+            self.concluidas[chave] = (recepcao.total, agora)
+        self._gravar(origem, id_transferencia, recepcao)
+
+    def _descartar_antigas(self, agora: float):
+        for chave, recepcao in list(self.recepcoes.items()):
+            if agora - recepcao.instante > TEMPO_LIMITE_RECEPCAO:
+                del self.recepcoes[chave]
+        for chave, (_, instante) in list(self.concluidas.items()):
+            if agora - instante > TEMPO_LIMITE_RECEPCAO:
+                del self.concluidas[chave]
+
+    def _gravar(self, origem: str, id_transferencia: int, recepcao: Recepcao):
+        r = self.roteador
+        nome = os.path.basename(recepcao.partes[0].decode('utf-8', 'replace')) or 'arquivo'
+        caminho = os.path.join(self.diretorio, nome)
+        if os.path.exists(caminho):
+            caminho = os.path.join(self.diretorio, f"{id_transferencia:08x}-{nome}")
+        conteudo = b''.join(recepcao.partes[seq] for seq in range(1, recepcao.total))
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            with open(caminho, 'wb') as f:
+                f.write(conteudo)
+        except OSError as e:
+            r.registro.erro('ERRO', f"Não foi possível gravar {caminho}: {e}")
+            return
+        r.registro.info('ARQUIVO RECEBIDO', "{caminho} ({tamanho} bytes) de {origem}",
+                        caminho=caminho, tamanho=len(conteudo), origem=origem)